@@ -31,8 +31,14 @@ DIRECTION = config.main.trade_direction
 LOGGER = get_logger(__name__)
 PAIRS = config.main.pairs.split()
 MAIN_INDICATORS = config.main.indicators.split()
+VECTOR_RULES = str2bool(config.main.vector_rules)
 GET_EXCEPTIONS = exception_catcher((Exception))
 TRIGGERED = {}
+SEEN = set()
+STARTED = False
+# min seconds between loops when there are no update events, eg. if redis_stream_block is 0
+MIN_LOOP = 5 if 'CHECK_REDIS_PAIR' in os.environ else 1
+GROUP = f"analyse_data-{config.main.name}"
 
 if sys.argv[-1] != "--help":
     CLIENT = binance_auth()
@@ -49,6 +55,7 @@ def analyse_loop():
     """
     Gather data from redis and analyze
     """
+    global STARTED
     LOGGER.debug("Recently triggered: %s", str(TRIGGERED))
 
     Path('/var/local/greencandle').touch()
@@ -58,6 +65,10 @@ def analyse_loop():
 
     LOGGER.debug("Start of current loop")
     redis = Redis()
+    # wait for pairs with new candle data rather than re-reading every pair
+    start = time.time()
+    block = MIN_LOOP if CHECK_REDIS_PAIR else None
+    ids, updated = redis.get_updates(INTERVAL, GROUP, block=block)
     if CHECK_REDIS_PAIR:
         redis4=Redis(db=CHECK_REDIS_PAIR)
         redis_pairs = [x.decode().split(':') for x in
@@ -80,17 +91,25 @@ def analyse_loop():
                 trade.close_trade(details)
 
         del redis4
+        # pairs newly added to the set are analysed even if their data hasn't changed
+        new_pairs = set(pairs) - SEEN
+        SEEN.clear()
+        SEEN.update(pairs)
+        pairs = [pair for pair in pairs if pair[0] in updated or pair in new_pairs]
     else:
-        pairs = [(pair, 'normal') for pair in PAIRS]
+        # all pairs are analysed on the first loop, as earlier events aren't replayed
+        pairs = [(pair, 'normal') for pair in PAIRS if pair in updated or not STARTED]
 
+    actions = redis.get_rule_actions([pair.strip() for pair, _ in pairs], INTERVAL) \
+            if VECTOR_RULES and pairs else None
     for pair in pairs:
-        analyse_pair(pair, redis)
-    LOGGER.debug("End of current loop")
+        analyse_pair(pair, redis, actions)
+    redis.ack_updates(INTERVAL, GROUP, ids)
+    STARTED = True
+    LOGGER.debug("End of current loop, analysed %s pairs", len(pairs))
     del redis
-    if CHECK_REDIS_PAIR:
-        time.sleep(5)
-    else:
-        time.sleep(1)
+    if not ids:
+        time.sleep(max(0, MIN_LOOP - (time.time() - start)))
 
 def get_match_name(matches):
     """
@@ -112,9 +131,10 @@ def get_match_name(matches):
         match_names.append(name_lookup[container_num-1][match-1])
     return ','.join(match_names)
 
-def analyse_pair(pair, redis):
+def analyse_pair(pair, redis, actions=None):
     """
     Analysis of individual pair
+    Rule results are taken from actions if given, as returned by Redis.get_rule_actions
     """
     pair, reversal = pair  # split tuple
     pair = pair.strip()
@@ -133,15 +153,19 @@ def analyse_pair(pair, redis):
 
     LOGGER.debug("Analysing pair: %s", pair)
     try:
-        result, _, current_time, current_price, match = \
-                redis.get_rule_action(pair=pair, interval=INTERVAL)
+        if actions is not None and pair in actions:
+            result, _, current_time, current_price, match = actions[pair]
+        else:
+            # pairs missing values used by rules are evaluated separately
+            result, _, current_time, current_price, match = \
+                    redis.get_rule_action(pair=pair, interval=INTERVAL)
         event = 'reversal'
 
         if result in ('OPEN', 'CLOSE'):
             LOGGER.debug("Trades to %s", result.lower())
             now = datetime.now()
-            items = redis.get_items(pair, INTERVAL)
-            data = redis.get_item(f"{pair}:{INTERVAL}", items[-1]).decode()
+            items = redis.get_items(pair, INTERVAL, last_n=1)
+            data = json.dumps(redis.get_candle(pair, INTERVAL, items[-1]))
             redis3 = Redis(db=3)
             raw_agg = redis3.conn.hgetall(f"{pair}:{INTERVAL}")
             agg = {k.decode():v.decode() for k,v in raw_agg.items()}
@@ -6,6 +6,7 @@ intermediate check in higher timeframe to ensure
 we don't open a trade against longterm trend
 """
 import os
+import json
 import time
 import glob
 import sys
@@ -94,8 +95,8 @@ def analyse_pair(pair, redis):
     del redis4
 
     redis0 = Redis(db=0)
-    items = redis0.get_items(pair, INTERVAL)
-    data = redis0.get_item(f"{pair}:{INTERVAL}", items[-1]).decode()
+    items = redis0.get_items(pair, INTERVAL, last_n=1)
+    data = json.dumps(redis0.get_candle(pair, INTERVAL, items[-1]))
     redis3 = Redis(db=3)
     raw_agg = redis3.conn.hgetall(f"{pair}:{INTERVAL}")
     agg = {k.decode():v.decode() for k,v in raw_agg.items()}
@@ -1,5 +1,5 @@
 #!/usr/bin/env python
-#pylint: disable=no-member,broad-except
+#pylint: disable=no-member,broad-except,global-statement
 """
 Flask module for manipulating API trades and displaying relevent graphs
 """
@@ -20,6 +20,8 @@ SHORT = set()
 ALL = defaultdict(dict)
 PAIRS = config.main.pairs.split()
 LOGGER = get_logger(__name__)
+GROUP = f"api_data-{config.main.name}"
+STARTED = False
 APP = Flask(__name__, template_folder="/etc/gcapi", static_url_path='/',
             static_folder='/etc/gcapi')
 
@@ -35,6 +37,7 @@ def analyse_loop():
     """
     Gather data from redis and analyze
     """
+    global STARTED
 
     while glob.glob(f'/var/run/{config.main.base_env}-data-{config.main.interval}-*'):
         LOGGER.info("Waiting for initial data collection to complete for %s",
@@ -43,8 +46,15 @@ def analyse_loop():
 
 
     redis = Redis()
+    # only pairs with new candle data since the last run need to be analysed again, waiting for
+    # updates for up to half of the scheduler interval so runs don't overlap
+    block = min(int(config.redis.redis_stream_block), int(config.main.check_interval) // 2)
+    ids, updated = redis.get_updates(config.main.interval, GROUP, block=block)
     for pair in PAIRS:
         pair = pair.strip()
+        # all pairs are analysed on the first run, as earlier events aren't replayed
+        if STARTED and pair not in updated:
+            continue
         LOGGER.debug("Analysing pair: %s", pair)
         try:
             result = redis.get_action(pair=pair, interval=config.main.interval)
@@ -61,6 +71,8 @@ def analyse_loop():
 
         except Exception as err_msg:
             LOGGER.critical("Error with pair %s %s", pair, str(err_msg))
+    redis.ack_updates(config.main.interval, GROUP, ids)
+    STARTED = True
     LOGGER.info("End of current loop")
     del redis
 
@@ -92,11 +104,24 @@ def get_stoch():
     """
     pair = request.args.get('pair')
     redis = Redis()
-    items = redis.get_items(pair, config.main.interval)[-2:]
+    items = redis.get_items(pair, config.main.interval, last_n=2)
     result1 = redis.get_item(items[0], 'STOCHRSI_14')
     result2 = redis.get_item(items[1], 'STOCHRSI_14')
     return (result1, result2)
 
+@APP.route('/metrics', methods=["GET"])
+def metrics():
+    """
+    Return indicator timings from latest data collection run
+    Only available when engine_metrics is enabled in config
+    """
+    redis = Redis()
+    result = redis.get_metrics(config.main.interval)
+    del redis
+    if not result:
+        return Response("No indicator metrics recorded", status=404)
+    return result
+
 @arg_decorator
 def main():
     """
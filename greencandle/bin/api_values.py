@@ -37,7 +37,7 @@ def get_value():
     """
     payload = request.json
     redis = Redis()
-    item = redis.get_items(payload['pair'], payload['interval'])[-1]
+    item = redis.get_items(payload['pair'], payload['interval'], last_n=1)[-1]
     result = redis.get_result(item, payload['indicator'])
     return result
 
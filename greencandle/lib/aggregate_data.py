@@ -4,7 +4,6 @@
 get data for all timeframes and pairs
 output data to csv files
 """
-import json
 import sys
 import os
 import errno
@@ -319,8 +318,8 @@ def collect_agg_data(interval):
     samples = 6
     for pair in pairs:
         try:
-            items[interval][pair] = redis.get_items(pair=pair,
-                                                    interval=interval)[-int(samples):]
+            items[interval][pair] = redis.get_items(pair=pair, interval=interval,
+                                                    last_n=int(samples))
         except:
             continue
 
@@ -328,12 +327,13 @@ def collect_agg_data(interval):
     for pair in pairs:
         res[interval][pair] = {}
 
-        for item in items[interval][pair]:
-            try:
-                res[interval][pair][item] = json.loads(redis.get_item(f'{pair}:{interval}',
-                                                                      item).decode())
-            except:
-                continue
+        try:
+            candles = redis.get_candles(pair, interval, items[interval][pair])
+        except:
+            continue
+        for item, candle in zip(items[interval][pair], candles):
+            if candle is not None:
+                res[interval][pair][item] = candle
     ###
     aggregate_data('redis', pairs, interval, res, items)
     LOGGER.debug("Finishing aggregate run")
@@ -1,5 +1,5 @@
 #!/usr/bin/env python
-#pylint: disable=no-member,eval-used,broad-except,too-many-locals,too-many-statements
+#pylint: disable=no-member,broad-except,too-many-locals,too-many-statements
 
 """
 Function for adding to redis queue
@@ -10,6 +10,7 @@ from time import strftime, gmtime
 import requests
 from greencandle.lib import config
 from greencandle.lib.redis_conn import Redis
+from greencandle.lib.rules import get_value
 from greencandle.lib.binance_common import get_current_price, get_dataframes
 from greencandle.lib.order import Trade
 from greencandle.lib.logger import get_logger
@@ -28,9 +29,9 @@ def add_to_queue(req, test=False):
     action = str(req['action']).strip()
     text = req['text'].strip()
     take_profit = float(req['tp']) if 'tp' in req and req['tp'] else \
-                eval(config.main.take_profit_perc)
+                get_value(config.main.take_profit_perc)
     stop_loss = float(req['sl']) if 'sl' in req and req['sl'] else \
-                eval(config.main.stop_loss_perc)
+                get_value(config.main.stop_loss_perc)
 
     if not pair:
         send_slack_message("alerts", "Missing pair for api trade")
@@ -92,8 +93,7 @@ def add_to_queue(req, test=False):
             redis.update_on_entry(item[0][0], 'stop_loss_perc', stop_loss)
 
             current_candle = dataframes[pair].iloc[-1]
-            redis.update_drawdown(pair, current_candle, event="open")
-            redis.update_drawup(pair, current_candle, event="open")
+            redis.update_draw(pair, current_candle, event="open")
 
     elif action_str == 'CLOSE':
         drawdown = redis.get_drawdown(pair)['perc']
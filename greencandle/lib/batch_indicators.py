@@ -0,0 +1,97 @@
+"""
+Indicators calculated along the last axis of numpy arrays
+
+Used to calculate indicators for many pairs at once by stacking price series of the same length
+into 2D arrays of shape (pairs, candles).  1D arrays are also accepted.  Results line up with the
+equivalent talib/pandas functions, with NaN for candles without enough history.
+"""
+
+import numpy
+from numpy.lib.stride_tricks import sliding_window_view
+from scipy.signal import lfilter
+
+def ewm_mean(values, alpha):
+    """
+    Exponentially weighted mean equivalent to pandas ewm(alpha=alpha, adjust=False).mean()
+    """
+    result = numpy.empty(values.shape)
+    result[..., 0] = values[..., 0]
+    result[..., 1:], _ = lfilter([alpha], [1, alpha - 1], values[..., 1:], axis=-1,
+                                 zi=(1 - alpha) * values[..., :1])
+    return result
+
+def seeded_mean(values, period, alpha):
+    """
+    Exponential mean seeded with the simple average of the first period values, as used by
+    talib EMA (alpha=2/(period+1)) and Wilder's smoothing (alpha=1/period)
+    First result is at position period-1
+    """
+    result = numpy.full(values.shape, numpy.nan)
+    if values.shape[-1] < period:
+        return result
+    seed = values[..., :period].mean(axis=-1, keepdims=True)
+    result[..., period-1:period] = seed
+    result[..., period:], _ = lfilter([alpha], [1, alpha - 1], values[..., period:], axis=-1,
+                                      zi=(1 - alpha) * seed)
+    return result
+
+def ema(close, period):
+    """
+    Exponential moving average, equivalent to talib.EMA
+    """
+    return seeded_mean(close, period, 2 / (period + 1))
+
+def rsi(close, period):
+    """
+    Relative strength index, equivalent to talib.RSI
+    """
+    delta = numpy.diff(close, axis=-1)
+    avg_gain = seeded_mean(numpy.where(delta > 0, delta, 0), period, 1 / period)
+    avg_loss = seeded_mean(numpy.where(delta < 0, -delta, 0), period, 1 / period)
+    total = avg_gain + avg_loss
+
+    result = numpy.full(close.shape, numpy.nan)
+    with numpy.errstate(divide='ignore', invalid='ignore'):
+        result[..., 1:] = numpy.where(total == 0, 0, 100 * avg_gain / total)
+    return result
+
+def atr(high, low, close, period):
+    """
+    Average true range, equivalent to talib.ATR
+    """
+    prev_close = close[..., :-1]
+    true_range = numpy.maximum(numpy.maximum(high[..., 1:] - low[..., 1:],
+                                             numpy.abs(high[..., 1:] - prev_close)),
+                               numpy.abs(low[..., 1:] - prev_close))
+
+    result = numpy.full(close.shape, numpy.nan)
+    result[..., 1:] = seeded_mean(true_range, period, 1 / period)
+    return result
+
+def bbands(close, period, multiplier):
+    """
+    Upper, middle and lower bollinger bands using population standard deviation, equivalent to
+    talib.BBANDS with matype=0
+    """
+    upper, middle, lower = (numpy.full(close.shape, numpy.nan) for _ in range(3))
+    if close.shape[-1] < period:
+        return upper, middle, lower
+
+    # deviation is taken from each window's own mean rather than as E[x^2]-E[x]^2, which loses
+    # precision to cancellation on low-priced pairs
+    windows = sliding_window_view(close, period, axis=-1)
+    mean = windows.mean(axis=-1)
+    deviation = windows.std(axis=-1) * multiplier
+
+    middle[..., period-1:] = mean
+    upper[..., period-1:] = mean + deviation
+    lower[..., period-1:] = mean - deviation
+    return upper, middle, lower
+
+def macd(close, short_term, long_term, signal_period):
+    """
+    MACD line, signal and histogram using pandas style ewm(span=x, adjust=False)
+    """
+    macd_line = ewm_mean(close, 2 / (short_term + 1)) - ewm_mean(close, 2 / (long_term + 1))
+    signal_line = ewm_mean(macd_line, 2 / (signal_period + 1))
+    return macd_line, signal_line, macd_line - signal_line
@@ -11,6 +11,7 @@ import os
 import pickle
 import time
 import datetime
+import threading
 from concurrent.futures import ThreadPoolExecutor
 import pandas
 from greencandle.lib.binance import Binance
@@ -19,6 +20,16 @@ from greencandle.lib.logger import get_logger
 from greencandle.lib.common import epoch2date, TF2MIN
 
 LOGGER = get_logger(__name__)
+# numeric types for kline fields which are returned by binance as strings
+KLINE_TYPES = {"openTime": "int64",
+               "open": "float64",
+               "high": "float64",
+               "low": "float64",
+               "close": "float64",
+               "volume": "float64",
+               "closeTime": "int64",
+               "quoteVolume": "float64",
+               "numTrades": "int64"}
 
 def get_current_price(pair, prices=None):
     """Get current price from binance"""
@@ -27,6 +38,44 @@ def get_current_price(pair, prices=None):
     prices = prices if prices else client.prices()
     return prices[pair]
 
+def klines_to_dataframe(klines):
+    """
+    Create pandas dataframe from list of kline dicts, converting prices and volumes to float64
+    and times and trade counts to int64 so they don't need to be parsed by each consumer
+
+    Args:
+        klines: list of dicts containing klines for a given pair
+
+    Returns:
+        pandas dataframe with numeric columns
+    """
+    dataframe = pandas.DataFrame(klines)
+    return dataframe.astype({key: value for key, value in KLINE_TYPES.items()
+                             if key in dataframe.columns})
+
+def add_kline(dataframe, kline, max_klines):
+    """
+    Add kline dict to dataframe of klines for the same pair, keeping numeric column dtypes
+    A kline with the same open time as the last candle replaces it in place, otherwise it is
+    added as a new candle, keeping the last max_klines candles
+
+    Args:
+        dataframe: pandas dataframe of klines created with klines_to_dataframe
+        kline: dict containing kline for the same pair
+        max_klines: max number of candles to keep
+
+    Returns:
+        pandas dataframe containing kline
+    """
+    candle = klines_to_dataframe([kline])
+    if candle.openTime.values[0] == dataframe.openTime.values[-1]:
+        # assign each column separately, a row of mixed dtypes would be upcast to float
+        for column in candle.columns:
+            dataframe.loc[dataframe.index[-1], column] = candle[column].values[0]
+        return dataframe
+    return pandas.concat([dataframe, candle], ignore_index=True).tail(max_klines) \
+            .reset_index(drop=True)
+
 def get_binance_klines(pair, interval=None, limit=50):
     """
     Get binance klines data for given trading pair and return as a pandas dataframe
@@ -53,8 +102,7 @@ def get_binance_klines(pair, interval=None, limit=50):
         sys.exit(2)
 
     non_empty = [x for x in raw if x['numTrades'] != 0]
-    dataframe = pandas.DataFrame.from_dict(non_empty)
-    return dataframe
+    return klines_to_dataframe(non_empty)
 
 def get_all_klines(pair, interval=None, start_time=0, no_of_klines=1E1000):
     """
@@ -105,6 +153,82 @@ def get_all_klines(pair, interval=None, start_time=0, no_of_klines=1E1000):
 
     return result[:no_of_klines] if no_of_klines != float("inf") else result
 
+class DailyKlinesCache():
+    """
+    Cache of daily klines keyed by (pair, date)
+    Entries are kept for the most recent max_days dates, older dates are evicted when a new date
+    is added
+
+    The cache is only kept in the parent process.  Forked worker processes start with a copy of
+    it, so all pairs should be prefetched in the parent before workers are started - entries
+    fetched within a worker are discarded when it exits, and pairs which failed to prefetch are
+    retried by the next prefetch
+    """
+
+    def __init__(self, max_days=2, no_of_klines=3):
+        self.max_days = max_days
+        self.no_of_klines = no_of_klines
+        self.data = {}
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def get_key(pair, start_time):
+        """
+        Get cache key for pair, using human-readable date of start_time (milliseconds)
+        """
+        return pair, time.strftime('%Y-%m-%d', time.localtime(start_time/1000))
+
+    def __add(self, key, klines):
+        """
+        Add klines to cache and evict old dates
+        Empty results are not cached so that they are retried on next request
+        """
+        if not klines:
+            return
+        with self.lock:
+            self.data[key] = klines
+            dates = sorted({date for _, date in self.data})[-self.max_days:]
+            for old_key in [item for item in self.data if item[1] not in dates]:
+                del self.data[old_key]
+
+    def get(self, pair, start_time):
+        """
+        Get daily klines for pair starting from start_time (milliseconds)
+        Klines are fetched from binance if not already cached
+        """
+        key = self.get_key(pair, start_time)
+        if key not in self.data:
+            LOGGER.debug("Fetching daily klines for %s %s", *key)
+            self.__add(key, get_all_klines(pair, '1d', start_time, self.no_of_klines))
+        return self.data.get(key)
+
+    def prefetch(self, start_times, max_workers=50):
+        """
+        Concurrently fetch daily klines which aren't already cached
+
+        Args:
+            start_times: dict of pair: start_time (milliseconds)
+            max_workers: maximum number of concurrent requests
+        """
+        missing = {}
+        for pair, start_time in start_times.items():
+            key = self.get_key(pair, start_time)
+            if key not in self.data:
+                missing[key] = start_time
+        if not missing:
+            return
+
+        LOGGER.debug("Prefetching daily klines for %s pairs", len(missing))
+        with ThreadPoolExecutor(max_workers=min(max_workers, len(missing))) as pool:
+            results = {key: pool.submit(get_all_klines, pair=key[0], interval='1d',
+                                        start_time=start_time, no_of_klines=self.no_of_klines)
+                       for key, start_time in missing.items()}
+            for key, result in results.items():
+                try:
+                    self.__add(key, result.result())
+                except Exception as exc:
+                    LOGGER.warning("Unable to prefetch daily klines for %s: %s", key[0], exc)
+
 def get_data(startdate, intervals, pairs, days, outputdir, extra):
     """Calculate which data to fetch given args and fetch into outputdir"""
 
@@ -212,6 +336,6 @@ def get_dataframes(pairs, interval=None, no_of_klines=None, max_workers=50):
     # extract results
     for pair, value in results.items():
         non_empty = [x for x in value.result() if x['numTrades'] != 0]
-        dataframe[pair] = pandas.DataFrame(non_empty)
+        dataframe[pair] = klines_to_dataframe(non_empty)
     pool.shutdown(wait=True)
     return dataframe
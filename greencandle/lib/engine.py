@@ -7,77 +7,273 @@ Module for collecting price data and creating TA results
 
 import math
 import traceback
+from functools import lru_cache
+from contextlib import nullcontext
 import operator
-from time import time, strftime, localtime
+from time import time
 from concurrent.futures import ProcessPoolExecutor
 from collections import defaultdict
-from decimal import Decimal
 import pandas
 import numpy
+from numpy.lib.stride_tricks import sliding_window_view
 import pandas_ta as ta
 import talib
-
-from greencandle.lib.common import make_float
-from greencandle.lib.binance_common import get_all_klines
+from talib import abstract
+
+from greencandle.lib.common import divide_chunks
+from greencandle.lib.binance_common import DailyKlinesCache
+from greencandle.lib.indicator_plan import IndicatorPlan
+from greencandle.lib.indicator_metrics import IndicatorMetrics
+from greencandle.lib import batch_indicators
+from greencandle.lib.batch_indicators import ewm_mean
+from greencandle.lib.indicator_state import heikin_ashi, supertrend
 from greencandle.lib.logger import get_logger, exception_catcher
 
 LOGGER = get_logger(__name__)
-CROSS_DATA = {}  # data from different time period
+PIVOT_CACHE = DailyKlinesCache()  # daily data used for pivot points
+OHLCV = ("volume", "open", "high", "low", "close")
+# minimum number of pairs for each worker process - forking workers and sending them ohlcv data
+# takes longer than calculating indicators for a few pairs in process
+MIN_SHARD = 10
+# indicators which can be calculated for all pairs at once in batch mode
+BATCH_FUNCTIONS = ("get_moving_averages", "get_rsi", "get_bb", "get_atr", "get_macd")
+
+def get_shard_schemes(dataframes, interval=None, localconfig=None, first_run=False,
+                      no_of_runs=999, state=None, dtype='float64', metrics=False, ohlcv=None):
+    """
+    Collect indicator data for a subset of pairs
+    Run within a worker process - returns list of schemes, cache stats and indicator metrics
+    to be merged by the parent Engine
+    """
+    engine = Engine(dataframes=dataframes, interval=interval, state=state, dtype=dtype,
+                    metrics=metrics, ohlcv=ohlcv)
+    for pair in engine.pairs:
+        engine.get_pair_data(pair.strip(), localconfig=localconfig, first_run=first_run,
+                             no_of_runs=no_of_runs)
+    return engine.schemes, engine.cache_stats, \
+            dict(engine.metrics.stats) if engine.metrics else {}
+
+@lru_cache(maxsize=None)
+def pattern_lookback(pattern):
+    """
+    Number of previous candles talib needs to evaluate given candlestick pattern (eg. DOJI)
+    """
+    return abstract.Function("CDL" + pattern).lookback
+
+def candle_patterns(open_, high, low, close, patterns, count):
+    """
+    Evaluate candlestick patterns for the last count candles of float64 ohlc arrays
+    Each pattern is only run over the trailing window it needs, which gives the same results as
+    running over the full history
+
+    Returns:
+        dict of pattern name and int array of last count results
+    """
+    results = {}
+    for pattern in patterns:
+        start = max(len(close) - pattern_lookback(pattern) - count, 0)
+        results[pattern] = getattr(talib, "CDL" + pattern)(open_[start:], high[start:],
+                                                           low[start:], close[start:])[-count:]
+    return results
+
+def rolling_min_max(arr, window):
+    """
+    Rolling min and max including partial windows at the start, ignoring NaN values
+    equivalent to pandas rolling(window, min_periods=0).min() and .max()
+    """
+    # pad start with first value so that each partial window includes it
+    windows = sliding_window_view(numpy.concatenate([numpy.repeat(arr[:1], window - 1), arr]),
+                                  window)
+    return numpy.fmin.reduce(windows, axis=1), numpy.fmax.reduce(windows, axis=1)
+
+def rolling_mean(arr, window):
+    """
+    Rolling mean including partial windows at the start, ignoring NaN values
+    equivalent to pandas rolling(window, min_periods=0).mean()
+    """
+    valid = ~numpy.isnan(arr)
+    totals = numpy.cumsum(numpy.where(valid, arr, 0))
+    counts = numpy.cumsum(valid)
+    totals[window:] = totals[window:] - totals[:-window]
+    counts[window:] = counts[window:] - counts[:-window]
+    with numpy.errstate(divide='ignore', invalid='ignore'):
+        return numpy.where(counts > 0, totals / counts, numpy.nan)
+
+def stoch_rsi(close, rsi_period, stoch_period, smooth):
+    """
+    Get Stochastic RSI k and d arrays for array of close prices
+    Results are aligned with the end of the close array, and have rsi_period fewer items
+
+    RSI is calculated with Wilder's smoothing on float32 gains and losses, where the first
+    value is the simple average of the first rsi_period gains/losses
+    """
+    delta = numpy.diff(close.astype('float32'))
+    ups = numpy.where(delta > 0, delta, 0).astype('float32')
+    downs = numpy.where(delta < 0, -delta, 0).astype('float32')
+    ups[rsi_period-1] = ups[:rsi_period].mean()
+    downs[rsi_period-1] = downs[:rsi_period].mean()
+
+    alpha = 1 / rsi_period
+    with numpy.errstate(divide='ignore', invalid='ignore'):
+        r_s = ewm_mean(ups[rsi_period-1:].astype(float), alpha) / \
+                ewm_mean(downs[rsi_period-1:].astype(float), alpha)
+        rsi = 100 - 100 / (1 + r_s)
+
+        rsi_min, rsi_max = rolling_min_max(rsi, stoch_period)
+        stochrsi = (rsi - rsi_min) / (rsi_max - rsi_min)
+    sto_k = rolling_mean(stochrsi, smooth)
+    sto_d = rolling_mean(sto_k, smooth)
+    return 100 * sto_k, 100 * sto_d
 
 class Engine(dict):
     """ Represent events created from data & indicators """
 
     get_exceptions = exception_catcher((Exception))
-    def __init__(self, dataframes, interval=None, test=False, redis=None):
+    def __init__(self, dataframes, interval=None, test=False, redis=None, workers=1, state=None,
+                 dtype='float64', batch=False, metrics=False, ohlcv=None):
         """
         Initialize class
         Create hold and event dicts
         Fetch initial data from binance and store within object
+        Optional IndicatorState object can be passed in to calculate supported indicators
+        for the current candle incrementally
+        ohlcv columns for each pair are converted once into numpy arrays of given dtype
+        (float64 or float32) which are shared by all indicators, unless already converted
+        arrays are passed in as ohlcv (eg. from the parent Engine to a worker shard)
+        In batch mode, indicators in BATCH_FUNCTIONS are calculated for all pairs at once
+        If metrics is True, time spent in each indicator is recorded and summarized at the end
+        of get_data
         """
         LOGGER.debug("Fetching raw data")
         self.interval = interval
         self.pairs = [key for key in dataframes.keys() if len(dataframes[key]) > 4]
         self.test = test
         self.redis = redis
+        self.workers = int(workers)
+        self.state = state
+        self.dtype = dtype
+        self.batch = batch
+        self.metrics = IndicatorMetrics(interval) if metrics else None
+        self.runs = 1
+        self.cache = {}
+        self.cache_stats = {"hits": 0, "misses": 0}
         self["hold"] = {}
         self["event"] = {}
         self.current_time = str(int(time()*1000))
         self.dataframes = dataframes
+        self.ohlcv = ohlcv if ohlcv is not None else \
+                {pair: {column: numpy.ascontiguousarray(dataframes[pair][column].values,
+                                                         dtype=dtype)
+                        for column in OHLCV}
+                 for pair in self.pairs}
 
         self.schemes = []
         super().__init__()
         LOGGER.debug("Finished fetching raw data")
 
-    def __make_data_tupple(self, pair, index):
+    def __make_data_tupple(self, pair):
         """
-        Transform dataframe to tupple of of floats
+        Get tupple of float64 volume, open, high, low, close arrays from ohlcv cache
+        talib only accepts doubles so float32 columns are upcast here
         """
-        local = self.dataframes[pair] if index == -1 else self.dataframes[pair].iloc[:index]
-        ohlc = (make_float(local.volume),
-                make_float(local.open),
-                make_float(local.high),
-                make_float(local.low),
-                make_float(local.close))
-        return ohlc
+        columns = self.ohlcv[pair]
+        return tuple(columns[column].astype(float, copy=False) for column in OHLCV)
 
-    @staticmethod
-    def __renamed_dataframe_columns(klines=None):
+    def __measure(self, indicator, pair, candles=None):
+        """
+        Context recording time spent in indicator if metrics are enabled
+        """
+        if self.metrics is None:
+            return nullcontext()
+        if candles is None:
+            candles = len(self.dataframes[pair])
+        return self.metrics.measure(indicator, pair, candles)
+
+    def __get_incremental(self, pair, function, period, index):
         """
-        Return dataframe with ordered/renamed coulumns
-        Rename dataframe columns and reorder, only fetch columns that we care about
+        Get value for current candle from running indicator state
+        Returns None if not available and a full recompute is required
+        """
+        if self.state is None or self.runs > 1 or index not in (None, -1):
+            return None
+        return self.state.get(pair, function, period, self.dataframes[pair])
+
+    def __cached(self, pair, function, params, calculate):
+        """
+        Get intermediate result shared between indicators, calculated at most once per pass
+        Results cover the full series, so are valid for any candle being processed
+
         Args:
-              klines: pandas dataframe containing data for specified pair
-        Returns:
-              klines: pandas dataframe with modified column names and ordering
+            pair: trading pair (eg. XRPBTC)
+            function: name of calculation (eg. BBANDS)
+            params: tuple of parameters passed to calculation
+            calculate: function returning result if not already cached
         """
+        key = (pair, function, params)
+        if key in self.cache:
+            self.cache_stats["hits"] += 1
+        else:
+            self.cache_stats["misses"] += 1
+            self.cache[key] = calculate()
+        return self.cache[key]
 
+    def __get_bbands(self, pair, timeframe, multiplier):
+        """
+        Get upper, middle and lower bollinger bands for pair
+        Shared by get_bb and get_bb_perc
+        """
+        def calculate():
+            close = self.__make_data_tupple(pair)[-1]
+            bands = talib.BBANDS(close * 100000, timeperiod=int(timeframe),
+                                 nbdevup=float(multiplier), nbdevdn=float(multiplier), matype=0)
+            return tuple(band / 100000 for band in bands)
+        return self.__cached(pair, "BBANDS", (int(timeframe), float(multiplier)), calculate)
 
-        dataframe = pandas.DataFrame(klines, columns=["openTime", "open", "high",
-                                                      "low", "close", "volume"])
-        columns = ["date", "Open", "High", "Low", "Close", "Volume"]  # rename columns
-        for index, item in enumerate(columns):
-            dataframe.columns.values[index] = item
-        return dataframe
+    def __get_ewm(self, pair, span):
+        """
+        Get exponentially weighted mean of close prices for given span
+        Shared by MACD configs using the same short/long terms
+        """
+        return self.__cached(pair, "ewm", (int(span),),
+                             lambda: pandas.Series(self.__make_data_tupple(pair)[-1])
+                             .ewm(span=int(span), adjust=False).mean())
+
+    def __get_pivot_time(self, pair):
+        """
+        Get m'epoch time to fetch daily data from for pivot points - 2 days before current candle
+        """
+        return int(int(self.dataframes[pair].openTime.values[-1]) - 1.728e+8)
+
+    def __add_series(self, pair, event, get_row, index=None):
+        """
+        Add scheme for each candle being processed
+        This is the current candle, or the last no_of_runs candles when back-filling on first run.
+        If index is given, only that candle is used.
+
+        Args:
+            pair: trading pair (eg. XRPBTC)
+            event: name of indicator used as key in redis (eg. EMA_20)
+            get_row: function returning data for a given row position in the pair's dataframe
+            index: optional row position
+        """
+        open_times = self.dataframes[pair].openTime.values
+        if index is not None:
+            rows = [index]
+        else:
+            rows = range(-min(self.runs, len(open_times)), 0)
+
+        for row in rows:
+            try:
+                data = get_row(row)
+            except (IndexError, TypeError, ValueError) as exc:
+                LOGGER.debug("Unable to get %s for %s seq: %s %s", event, pair, row, exc)
+                continue
+            scheme = {}
+            scheme["data"] = data
+            scheme["symbol"] = pair
+            scheme["event"] = event
+            scheme["open_time"] = str(open_times[row])
+            self.schemes.append(scheme)
 
     @staticmethod
     def get_operator_fn(symbol):
@@ -102,18 +298,55 @@ class Engine(dict):
             pair = scheme["symbol"]
             # add to redis
             event = scheme['event']
-            open_time = str(self.dataframes[pair].iloc[-1]["openTime"]) if not "open_time" in \
+            open_time = str(self.dataframes[pair].openTime.values[-1]) if not "open_time" in \
                     scheme else scheme["open_time"]
 
             result = None if (isinstance(scheme["data"], float) and
                               math.isnan(scheme["data"])) else scheme["data"]
             final_scheme[pair][open_time][event] = result
 
-        for pair, data in final_scheme.items():
-            self.redis.add_data(pair, self.interval, data)
+        # all pairs and timestamps are written in a single pipelined flush
+        # test runs keep their full history rather than being trimmed to redis_retention
+        self.redis.add_bulk_data(self.interval, final_scheme, retention=0 if self.test else None)
+        if not self.test:
+            # let analysers know which pairs have new data once it has been written
+            self.redis.publish_updates(self.interval, {pair: max(items) for pair, items in
+                                                       final_scheme.items()})
 
         self.schemes = []
 
+    def get_pair_data(self, pair, localconfig=None, first_run=False, no_of_runs=999):
+        """
+        Collect ohlc and all configured indicator data for a single trading pair
+        Results are appended to self.schemes
+        localconfig is a compiled IndicatorPlan
+
+        On first run each indicator is calculated once over the full history, and the last
+        no_of_runs values are back-filled.  Each back-filled value includes the candle it is
+        stored against, as for the current candle
+        """
+
+        self.runs = no_of_runs if first_run else 1
+        with self.__measure("ohlc", pair):
+            self.send_ohlcs(pair)
+
+        # candlestick patterns are evaluated together from a single scan
+        patterns = [indicator.localconfig for indicator in localconfig
+                    if indicator.function == 'get_indicators']
+        if patterns:
+            with self.__measure("patterns", pair):
+                self.get_candle_patterns(pair, patterns)
+
+        for indicator in localconfig:
+            if indicator.function == 'get_indicators':
+                continue
+            # call each method defined in config with current pair and name,period tuple
+            # from config eg. self.supertrend(pair, config), where config is a tuple
+            # each method has the method name in 'function't st
+            with self.__measure(indicator.event, pair):
+                getattr(self, indicator.function)(pair, index=None,
+                                                  localconfig=indicator.localconfig)
+
     @get_exceptions
     def get_data(self, localconfig=None, first_run=False, no_of_runs=999):
         """
@@ -121,82 +354,154 @@ class Engine(dict):
         Run data through indicator, oscillators, moving average
         Return dict containing alert data and hold data
 
-        Args: None
+        When more than one worker is available, and there are at least MIN_SHARD pairs for each
+        worker, pairs are split into shards and each shard is processed in a separate process,
+        receiving only its own pairs' converted ohlcv arrays and indicator state.  Schemes from
+        each shard are merged before being sent to redis
+
+        Args:
+            localconfig: IndicatorPlan or list of indicator strings from config, which are
+                         compiled and validated before any data is collected
 
         Returns:
             dict containing all collected data
         """
 
-        # get indicators supertrend, and API for each trading pair
-        pool = ProcessPoolExecutor(max_workers=20)
-        futures = []
-
-        for pair in self.pairs:
-            pair = pair.strip()
-            actual_klines = len(self.dataframes[pair])
-
-            futures.append(pool.submit(getattr(self,'send_ohlcs')(pair, first_run=first_run,
-                                                                  no_of_runs=no_of_runs)))
-
-            for item in localconfig:
-                function, name, period = item.split(';')
-                # call each method defined in config with current pair and name,period tuple
-                # from config eg. self.supertrend(pair, config), where config is a tuple
-                # each method has the method name in 'function't st
-
-                if first_run:
-                    for seq in range(int(actual_klines))[-no_of_runs:]:
-                        if seq > len(self.dataframes[pair]):
-                            continue
-                        futures.append(pool.submit(getattr(self, function)(pair, index=seq,
-                                                            localconfig=(name, period))))
-                else:
-                    futures.append(pool.submit(getattr(self, function)(pair, index=None,
-                                                        localconfig=(name, period))))
-        pool.shutdown(wait=False)
-        self.__add_schemes()
+        if not isinstance(localconfig, IndicatorPlan):
+            localconfig = IndicatorPlan(localconfig)
+        localconfig.validate(self)
+
+        pairs = [pair.strip() for pair in self.pairs]
+        workers = min(self.workers, len(pairs) // MIN_SHARD)
+
+        if self.batch:
+            self.get_batch_data(pairs, localconfig, first_run=first_run, no_of_runs=no_of_runs)
+            # remaining indicators are collected per pair
+            localconfig = IndicatorPlan([indicator.spec for indicator in localconfig
+                                         if indicator.function not in BATCH_FUNCTIONS])
+
+        if any(indicator.function == 'get_pivot' for indicator in localconfig):
+            # fetch daily data for all pairs at once when date changes, before any worker
+            # processes are forked - the cache is parent-only, so anything fetched within a
+            # worker shard is not kept
+            PIVOT_CACHE.prefetch({pair: self.__get_pivot_time(pair) for pair in pairs})
+
+        if workers > 1:
+            shards = divide_chunks(pairs, math.ceil(len(pairs) / workers))
+            with ProcessPoolExecutor(max_workers=workers) as pool:
+                futures = [pool.submit(get_shard_schemes,
+                                       {pair: self.dataframes[pair] for pair in shard},
+                                       interval=self.interval, localconfig=localconfig,
+                                       first_run=first_run, no_of_runs=no_of_runs,
+                                       state=self.state and self.state.subset(shard),
+                                       dtype=self.dtype, metrics=self.metrics is not None,
+                                       ohlcv={pair: self.ohlcv[pair] for pair in shard})
+                           for shard in shards]
+                for future in futures:
+                    schemes, cache_stats, metrics = future.result()
+                    self.schemes.extend(schemes)
+                    for key, value in cache_stats.items():
+                        self.cache_stats[key] += value
+                    if self.metrics:
+                        self.metrics.merge(metrics)
+        else:
+            for pair in pairs:
+                self.get_pair_data(pair, localconfig=localconfig, first_run=first_run,
+                                   no_of_runs=no_of_runs)
 
+        self.__add_schemes()
+        self.cache = {}
+
+        LOGGER.debug("Indicator cache hits: %s, misses: %s", self.cache_stats['hits'],
+                     self.cache_stats['misses'])
+        if self.metrics:
+            self.metrics.log_summary()
+            if self.redis:
+                self.redis.set_metrics(self.interval, self.metrics.report())
         LOGGER.debug("Done getting data")
         return self
 
-    def send_ohlcs(self, pair, first_run, no_of_runs=999):
+    def get_batch_data(self, pairs, localconfig, first_run=False, no_of_runs=999):
+        """
+        Collect data for indicators in BATCH_FUNCTIONS for all given pairs at once
+        Pairs with the same number of candles are stacked into 2D arrays of shape
+        (pairs, candles), so each indicator is calculated with a single call per group rather
+        than once per pair.  Results are added to self.schemes in the same format as the per-pair
+        indicator methods
+        """
+        indicators = [indicator for indicator in localconfig
+                      if indicator.function in BATCH_FUNCTIONS]
+        if not indicators:
+            return
+
+        self.runs = no_of_runs if first_run else 1
+        groups = defaultdict(list)
+        for pair in pairs:
+            groups[len(self.dataframes[pair])].append(pair)
+
+        for group in groups.values():
+            _, _, high, low, close = (numpy.vstack(arrays) for arrays in
+                                      zip(*(self.__make_data_tupple(pair) for pair in group)))
+            for indicator in indicators:
+                with self.__measure(indicator.event, "batch", close.size):
+                    try:
+                        get_result = self.__get_batch_result(indicator, high, low, close)
+                    except Exception as exc:
+                        LOGGER.warning("Unable to get batch %s: %s", indicator.event, exc)
+                        continue
+                    for position, pair in enumerate(group):
+                        self.__add_series(pair, indicator.event,
+                                          lambda row, position=position, result=get_result:
+                                          result(position, row))
+        LOGGER.debug("Done getting batch data for %s pairs in %s groups", len(pairs),
+                     len(groups))
+
+    @staticmethod
+    def __get_batch_result(indicator, high, low, close):
+        """
+        Calculate indicator for stacked arrays
+        Returns function to get data for a given pair position and row
+        """
+        params = indicator.params
+        if indicator.function == "get_moving_averages":
+            result = batch_indicators.ema(close, int(params[0]))
+            return lambda position, row: result[position, row]
+        if indicator.function == "get_rsi":
+            result = batch_indicators.rsi(close * 100000, int(params[0]))
+            return lambda position, row: float(result[position, row])
+        if indicator.function == "get_atr":
+            result = batch_indicators.atr(high, low, close, int(params[0]))
+            return lambda position, row: float(result[position, row])
+        if indicator.function == "get_bb":
+            # scaled as in get_bb
+            bands = [band / 100000 for band in
+                     batch_indicators.bbands(close * 100000, int(params[0]), params[1])]
+            return lambda position, row: [band[position, row] for band in bands]
+        if indicator.function == "get_macd":
+            lines = batch_indicators.macd(close, *(int(param) for param in params))
+            return lambda position, row: tuple(line[position, row] for line in lines)
+        raise ValueError(f"Batch mode not supported for {indicator.function}")
+
+    def send_ohlcs(self, pair, index=None):
         """Send ohcls data to redis"""
-        scheme = {}
-        scheme["symbol"] = pair
-        # Unless we are in test mode, use the second to last data row as the previous one is still
-        # being constructed and contains incomplete data
-
-        self.schemes.append(scheme)
-        if first_run:
-            for seq in range(-no_of_runs, 0, 1): # last x items in seq order
-                LOGGER.debug("Getting initial sequence number %s", seq)
-                scheme['data'] = self.dataframes[pair].iloc[seq].to_dict()
-                for key, val in scheme['data'].items():
-                    if isinstance(val, numpy.int64):
-                        scheme['data'][key] = int(val)
-                scheme["event"] = "ohlc"
-                scheme["open_time"] = str(self.dataframes[pair].iloc[seq]["openTime"])
-                self.schemes.append(scheme)
-
-                # reset for next loop
-                scheme = {"symbol": pair, "event": "ohlc"}
-
-        location = -1
+
         try:
-            close = float(self.dataframes[pair].iloc[location]["close"])
+            close = float(self.dataframes[pair].iloc[-1]["close"])
             if close <= 0:
                 LOGGER.critical("Zero size dataframe found")
         except Exception:
             LOGGER.critical("Non-float dataframe found")
 
-        scheme['data'] = self.dataframes[pair].iloc[location].to_dict()
-        for key, val in scheme['data'].items():
-            if isinstance(val, numpy.int64):
-                scheme['data'][key] = int(val)
+        dataframe = self.dataframes[pair]
+        def get_ohlc(row):
+            # read each column separately so int columns aren't upcast to float in a mixed row
+            data = {}
+            for key in dataframe.columns:
+                val = dataframe[key].values[row]
+                data[key] = val.item() if isinstance(val, numpy.generic) else val
+            return data
 
-        scheme["event"] = "ohlc"
-        scheme["open_time"] = str(self.dataframes[pair].iloc[location]["openTime"])
-        self.schemes.append(scheme)
+        self.__add_series(pair, "ohlc", get_ohlc, index)
 
     def get_bb_perc_ema(self, pair, index=None, localconfig=None):
         """
@@ -209,184 +514,126 @@ class Engine(dict):
 
         func, timef = localconfig  # split tuple
         short_term, long_term, signal_period = timef.split(',')
+        event = f"{func}_{short_term}"
 
-        # Calculate MACD
+        result = self.__get_incremental(pair, 'get_macd', timef, index)
+        if result is not None:
+            self.__add_series(pair, event, lambda row: result, index)
+            return
 
-        # Calculate short-term and long-term EMAs
-        short_ema = self.dataframes[pair]['close'].ewm(span=int(short_term), adjust=False).mean()
-        long_ema = self.dataframes[pair]['close'].ewm(span=int(long_term), adjust=False).mean()
+        try:
+            # Calculate MACD
 
-        # Calculate MACD Line
-        macd_line = short_ema - long_ema
+            # Calculate short-term and long-term EMAs
+            short_ema = self.__get_ewm(pair, short_term)
+            long_ema = self.__get_ewm(pair, long_term)
 
-        # Calculate Signal Line
-        signal_line = macd_line.ewm(span=int(signal_period), adjust=False).mean()
+            # Calculate MACD Line
+            macd_line = short_ema - long_ema
 
-        # Calculate MACD Histogram
-        macd_histogram = macd_line - signal_line
+            # Calculate Signal Line
+            signal_line = macd_line.ewm(span=int(signal_period), adjust=False).mean()
 
-        scheme = {}
-        try:
-            scheme["data"] = macd_line.iloc[-1], signal_line.iloc[-1], macd_histogram.iloc[-1]
-            scheme["symbol"] = pair
-            scheme["event"] = f"{func}_{short_term}"
-            open_time = str(self.dataframes[pair].iloc[-1]["openTime"])
-            scheme["open_time"] = open_time
+            # Calculate MACD Histogram
+            macd_histogram = macd_line - signal_line
 
-            self.schemes.append(scheme)
+            self.__add_series(pair, event, lambda row: (macd_line.iloc[row],
+                                                        signal_line.iloc[row],
+                                                        macd_histogram.iloc[row]), index)
 
         except Exception as exc:
             LOGGER.warning("Overall FAILURE in macd: %s", str(exc))
 
     def get_bb_perc(self, pair, index=None, localconfig=None, ema=False):
         """get bb %"""
-        if index is None:
-            index = -1
-        open_time = str(self.dataframes[pair].iloc[index]["openTime"])
         func, timef = localconfig  # split tuple
         timeframe, multiplier = timef.split(',')
 
         try:
-            if index == -1:
-                closes = make_float(self.dataframes[pair].close)
-            else:
-                closes = make_float(self.dataframes[pair].close.iloc[:index])
-            current_price = str(Decimal(self.dataframes[pair].iloc[index]["close"]))
-            upper, _, lower = \
-                     talib.BBANDS(closes*100000, timeperiod=int(timeframe),
-                                  nbdevup=float(multiplier), nbdevdn=float(multiplier), matype=0)
+            closes = self.__make_data_tupple(pair)[-1]
+            upper, _, lower = self.__get_bbands(pair, timeframe, multiplier)
 
             #%B = (Current Price - Lower Band) / (Upper Band - Lower Band)
-            perc = ((float(current_price)- float(lower[-1]/100000)) /
-                    (float(upper[-1])/100000 - float(lower[-1])/100000))
-            if ema:
-                percs = []
-                for i in range(-21, 0):
-
-                    # loop over last 21 bb items and get corresponding bbperc
-                    current_perc = ((float(current_price) - float(lower[i])/100000) /
-                                    (float(upper[i])/100000 - float(lower[i])/100000))
-                    percs.append(float(current_perc))
-                # convert real list to ndarray
-                perc_arr = numpy.array(percs)
-                # get EMA using 21 timepeiod
-                ema_result = int(talib.EMA(perc_arr, timeperiod=21)[-1])
-            else:
-                ema_result = None
+            percs = (closes - lower) / (upper - lower)
 
         except Exception as exc:
-            perc = None
-            ema_result = None
             LOGGER.debug("Overall Exception getting bb perc: %s seq: %s", exc, index)
-        scheme = {}
-        try:
-            scheme["data"] = ema_result if ema else perc
-            scheme["symbol"] = pair
-            scheme["event"] = f"{func}_{timeframe}"
-            scheme["open_time"] = open_time
+            self.__add_series(pair, f"{func}_{timeframe}", lambda row: None, index)
+            return
 
-            self.schemes.append(scheme)
+        def get_ema(row):
+            # loop over last 21 bb items and get corresponding bbperc using current price
+            window = slice(row - 20, row + 1 or None)
+            perc_arr = (closes[row] - lower[window]) / (upper[window] - lower[window])
+            # get EMA using 21 timepeiod
+            return int(talib.EMA(perc_arr, timeperiod=21)[-1])
 
-        except KeyError as exc:
-            LOGGER.warning("KEY FAILURE in bb perc : %s", str(exc))
+        self.__add_series(pair, f"{func}_{timeframe}",
+                          get_ema if ema else lambda row: percs[row], index)
 
-        LOGGER.debug("Done Getting bb perc for %s - %s", pair, open_time)
+        LOGGER.debug("Done Getting bb perc for %s", pair)
 
     def get_bb(self, pair, index=None, localconfig=None):
         """get bollinger bands"""
-        if index is None:
-            index = -1
-
-        open_time = str(self.dataframes[pair].iloc[index]["openTime"])
-        klines = self.__make_data_tupple(pair, index)
 
         func, timef = localconfig  # split tuple
         timeframe, multiplier = timef.split(',')
-        try:
-            close = klines[-1]
+        event = f"{func}_{timeframe}"
 
-        except Exception as exc:
-            LOGGER.info("FAILED bbands: %s ", str(exc))
+        res = self.__get_incremental(pair, 'get_bb', timef, index)
+        if res is not None:
+            self.__add_series(pair, event, lambda row: res, index)
             return
+
         try:
-            upper, middle, lower = \
-                    talib.BBANDS(close * 100000, timeperiod=int(timeframe),
-                                 nbdevup=float(multiplier), nbdevdn=float(multiplier), matype=0)
-            res = [upper[-1]/100000, middle[-1]/100000, lower[-1]/100000]
+            upper, middle, lower = self.__get_bbands(pair, timeframe, multiplier)
+            get_res = lambda row: [upper[row], middle[row], lower[row]]
 
         except Exception as exc:
-            res = [None, None, None]
+            get_res = lambda row: [None, None, None]
             LOGGER.debug("Overall Exception getting bollinger bands: %s seq: %s", exc, index)
-        try:
-            scheme = {}
-            scheme["open_time"] = open_time
-            scheme["data"] = res
-            scheme["symbol"] = pair
-            scheme["event"] = f"{func}_{timeframe}"
-            self.schemes.append(scheme)
 
-        except KeyError as exc:
-            LOGGER.warning("KEY FAILURE in bollinger bands: %s", str(exc))
-
-        LOGGER.debug("Done Getting bb for %s - %s", pair, open_time)
+        self.__add_series(pair, event, get_res, index)
+        LOGGER.debug("Done Getting bb for %s", pair)
 
     @get_exceptions
     def get_pivot(self, pair, index=None, localconfig=None):
         """
         Get pivot points based on previous day data
+        Only calculated for the current candle
         !!!Does not work with test data!!!
         """
 
-        global CROSS_DATA
         func, timeperiod = localconfig
         index = -1
-        # Get current date:
-        scheme = {}
-        scheme["open_time"] = str(self.dataframes[pair].iloc[index]["openTime"])
-
-        # get yesterday's m'epoch time
-        get_data_for = int(int(scheme["open_time"]) - 1.728e+8)
-        # use human-readable date as dict key
-        key = pair + strftime('%Y-%m-%d', localtime(get_data_for/1000))
-
-        if key not in CROSS_DATA:
-            # if data doesn't already exist for this date, then wipe previous data and re-fetch data
-            # for current date
-            CROSS_DATA = {}
-            CROSS_DATA[key] = get_all_klines(pair, '1d', get_data_for, 3)
-
-        klines = CROSS_DATA[key]
+        open_time = str(self.dataframes[pair].openTime.values[index])
+
+        klines = PIVOT_CACHE.get(pair, self.__get_pivot_time(pair))
         result = (float(klines[0]['high']) + float(klines[0]['low']) + float(klines[0]['close']))/3
-        scheme["data"] = result
-        scheme["symbol"] = pair
-        scheme["event"] = f"{func}_{timeperiod}"
 
-        self.schemes.append(scheme)
-        LOGGER.debug("Done Getting pivot for %s - %s", pair, scheme['open_time'])
+        self.__add_series(pair, f"{func}_{timeperiod}", lambda row: result, index)
+        LOGGER.debug("Done Getting pivot for %s - %s", pair, open_time)
 
     @get_exceptions
     def get_tsi(self, pair, index=None, localconfig=None):
         """
         Get TSI osscilator
         """
-        index = -1
         func, timeperiod = localconfig
-        tsi = ta.smi(self.dataframes[pair].close.astype(float), fast=13, slow=25, signal=13)
+        # tsi and signal configs share the same calculation
+        tsi = self.__cached(pair, "smi", (13, 25, 13),
+                            lambda: ta.smi(pandas.Series(self.__make_data_tupple(pair)[-1]),
+                                           fast=13, slow=25, signal=13))
         if func == 'tsi':
-            result = float(tsi[tsi.columns[0]].iloc[index]) * 100
+            column = tsi[tsi.columns[0]]
         elif func == 'signal':
-            result = float(tsi[tsi.columns[1]].iloc[index]) * 100
+            column = tsi[tsi.columns[1]]
         else:
             raise RuntimeError
-        scheme = {}
-        scheme["data"] = result
-        scheme["symbol"] = pair
-        scheme["event"] = f"{func}_{timeperiod}"
-
-        scheme["open_time"] = str(self.dataframes[pair].iloc[index]["openTime"])
 
-        self.schemes.append(scheme)
-        LOGGER.debug("Done Getting TSI for %s - %s", pair, scheme['open_time'])
+        self.__add_series(pair, f"{func}_{timeperiod}",
+                          lambda row: float(column.iloc[row]) * 100, index)
+        LOGGER.debug("Done Getting TSI for %s", pair)
 
     @get_exceptions
     def get_atr(self, pair, index=None, localconfig=None):
@@ -403,18 +650,16 @@ class Engine(dict):
         """
 
         func, timeperiod = localconfig  # split tuple
-        scheme = {}
-        if index is None:
-            index = -1
-        atr = talib.ATR(high=self.dataframes[pair].high.values.astype(float),
-                        low=self.dataframes[pair].low.values.astype(float),
-                        close=self.dataframes[pair].close.values.astype(float), timeperiod=14)
-        scheme["symbol"] = pair
-        scheme["event"] = f"{func}_{timeperiod}"
-        scheme["open_time"] = str(self.dataframes[pair].iloc[index]["openTime"])
-        scheme["data"] = float(atr[index]) if atr[index] != None else None
-        self.schemes.append(scheme)
-        LOGGER.debug("Done Getting ATR for %s - %s", pair, scheme['open_time'])
+        event = f"{func}_{timeperiod}"
+        result = self.__get_incremental(pair, 'get_atr', timeperiod, index)
+        if result is not None:
+            self.__add_series(pair, event, lambda row: result, index)
+            return
+
+        _, _, high, low, close = self.__make_data_tupple(pair)
+        atr = talib.ATR(high=high, low=low, close=close, timeperiod=int(timeperiod))
+        self.__add_series(pair, event, lambda row: float(atr[row]), index)
+        LOGGER.debug("Done Getting ATR for %s", pair)
 
     @get_exceptions
     def get_rsi(self, pair, index=None, localconfig=None):
@@ -431,20 +676,16 @@ class Engine(dict):
         """
 
         func, timeperiod = localconfig  # split tuple
-        scheme = {}
+        event = f"{func}_{timeperiod}"
+        result = self.__get_incremental(pair, 'get_rsi', timeperiod, index)
+        if result is not None:
+            self.__add_series(pair, event, lambda row: result, index)
+            return
 
-        if index is None:
-            index = -1
-        rsi = talib.RSI(self.dataframes[pair].close.values.astype(float) * 100000,
+        rsi = talib.RSI(self.__make_data_tupple(pair)[-1] * 100000,
                         timeperiod=int(timeperiod))
-        scheme["symbol"] = pair
-        scheme["event"] = f"{func}_{timeperiod}"
-
-        scheme["open_time"] = str(self.dataframes[pair].iloc[index]["openTime"])
-        scheme["data"] = float(rsi[index]) if rsi[index] != None else None
-
-        self.schemes.append(scheme)
-        LOGGER.debug("Done Getting RSI for %s - %s", pair, scheme['open_time'])
+        self.__add_series(pair, event, lambda row: float(rsi[row]), index)
+        LOGGER.debug("Done Getting RSI for %s", pair)
 
     @get_exceptions
     def get_stochrsi(self, pair, index=None, localconfig=None):
@@ -460,59 +701,27 @@ class Engine(dict):
 
         """
 
-        series = self.dataframes[pair].close.apply(pandas.to_numeric).astype('float32')
-
-        if index is None:
-            index = -1
-        else:
-            series = series.iloc[:index +1]
         func, details = localconfig  # split tuple
         rsi_period, stoch_period, smooth = (int(x) for x in details.split(','))
 
-        scheme = {}
         try:
-            # Calculate RSI
-            delta = series.astype('float32').diff().dropna()
-            ups = delta * 0
-            downs = ups.copy()
-            ups[delta > 0] = delta[delta > 0]
-            downs[delta < 0] = -delta[delta < 0]
-            #first value is sum of avg gains
-            ups[ups.index[rsi_period-1]] = numpy.mean(ups[:rsi_period])
-            ups = ups.drop(ups.index[:(rsi_period-1)])
-            #first value is sum of avg losses
-            downs[downs.index[rsi_period-1]] = numpy.mean(downs[:rsi_period])
-            downs = downs.drop(downs.index[:(rsi_period-1)])
-            r_s = ups.ewm(com=rsi_period-1, min_periods=0, adjust=False, ignore_na=False).mean() / \
-                 downs.ewm(com=rsi_period-1, min_periods=0, adjust=False, ignore_na=False).mean()
-            rsi = 100 - 100 / (1 + r_s)
-
-            # Calculate StochRSI
-            stochrsi = (rsi - rsi.rolling(stoch_period, min_periods=0).min()) / \
-            (rsi.rolling(stoch_period, min_periods=0).max() - rsi.rolling(stoch_period,
-                                                                          min_periods=0).min())
-            stochrsik = stochrsi.rolling(smooth, min_periods=0).mean()
-            stochrsid = stochrsik.rolling(smooth, min_periods=0).mean()
-            sto_k = 100 * stochrsik
-            sto_d = 100 * stochrsid
+            sto_k, sto_d = stoch_rsi(self.ohlcv[pair]['close'], rsi_period, stoch_period, smooth)
 
-            scheme["symbol"] = pair
-            scheme["event"] = f"{func}_{rsi_period}"
-            scheme["open_time"] = str(self.dataframes[pair].iloc[index]["openTime"])
-            scheme["data"] = sto_k.iloc[-1], sto_d.iloc[-1]
-            self.schemes.append(scheme)
+            # arrays are aligned with the end of the dataframe
+            self.__add_series(pair, f"{func}_{rsi_period}",
+                              lambda row: (sto_k[row], sto_d[row]), index)
 
         except (IndexError, KeyError) as exc:
             LOGGER.warning("FAILURE in stochrsi %s", str(exc))
         else:
-            LOGGER.debug("Done Getting STOCHRSI for %s - %s", pair, scheme['open_time'])
+            LOGGER.debug("Done Getting STOCHRSI for %s", pair)
 
     @get_exceptions
     def get_envelope(self, pair, index=None, localconfig=None):
         """
         Get envelope strategy
         """
-        klines = self.__make_data_tupple(pair, index)
+        klines = self.__make_data_tupple(pair)
         func, timeperiod = localconfig
         close = klines[-1]
         basis = talib.SMA(close, int(timeperiod))
@@ -522,53 +731,32 @@ class Engine(dict):
         lower = basis * (1 - k)
 
         results = {}
-        results['upper'] = upper[-1]
-        results['middle'] = basis[-1]
-        results['lower'] = lower[-1]
-        scheme = {}
+        results['upper'] = upper
+        results['middle'] = basis
+        results['lower'] = lower
         try:
-            scheme["data"] = results[func]
-            scheme["symbol"] = pair
-            scheme["event"] = f"{func}_{timeperiod}"
-            index = -1
-            scheme["open_time"] = str(self.dataframes[pair].iloc[index]["openTime"])
-            self.schemes.append(scheme)
+            result = results[func]
+            self.__add_series(pair, f"{func}_{timeperiod}", lambda row: result[row], index)
 
         except KeyError as exc:
             LOGGER.warning("KEY FAILURE in envelope  %s", str(exc))
-        LOGGER.debug("Done Getting envelope for %s - %s", pair, scheme['open_time'])
+        LOGGER.debug("Done Getting envelope for %s", pair)
 
     @get_exceptions
     def get_hma(self, pair, index=None, localconfig=None):
         """
         Calculate Hull Moving Average using Weighted Moving Average
         """
-        klines = self.__make_data_tupple(pair, index)
+        klines = self.__make_data_tupple(pair)
         func, timeperiod = localconfig
         close = klines[-1]
         first = talib.WMA(close, int(timeperiod)/2)
         second = talib.WMA(close, int(timeperiod))
 
-        result = talib.WMA((2 * first) - second, round(math.sqrt(int(timeperiod))))[-1]
-        if result > close[-1]:
-            trigger = "SELL"
-        else:
-            trigger = "BUY"
-        scheme = {}
-        try:
-            scheme["data"] = result
-            scheme["symbol"] = pair
-            scheme["event"] = f"{func}_{timeperiod}"
-
-            index = -1
-            scheme["open_time"] = str(self.dataframes[pair].iloc[index]["openTime"])
-
-            self.schemes.append(scheme)
-
-        except KeyError as exc:
-            LOGGER.warning("KEY FAILURE in moving averages: %s", str(exc))
+        result = talib.WMA((2 * first) - second, round(math.sqrt(int(timeperiod))))
+        self.__add_series(pair, f"{func}_{timeperiod}", lambda row: result[row], index)
 
-        LOGGER.debug("Done Getting MA for %s - %s", pair, scheme['open_time'])
+        LOGGER.debug("Done Getting MA for %s", pair)
 
     @get_exceptions
     def get_moving_averages(self, pair, index=None, localconfig=None):
@@ -583,37 +771,24 @@ class Engine(dict):
         Returns:
             None
         """
-        if index is None:
-            index = -1
-        open_time = str(self.dataframes[pair].iloc[index]["openTime"])
-        klines = self.__make_data_tupple(pair, index)
         func, timef = localconfig  # split tuple
-        results = {}
+        event = "{0}_{1}".format(func, timef)
 
         try:
-            if index == -1:
-                closes = make_float(self.dataframes[pair].close)
-            else:
-                closes = make_float(self.dataframes[pair].close.iloc[:index])
+            result = self.__get_incremental(pair, 'get_moving_averages', timef, index)
+            if result is not None:
+                self.__add_series(pair, event, lambda row: result, index)
+                return
 
+            closes = self.__make_data_tupple(pair)[-1]
             results = talib.EMA(closes, timeperiod=int(timef))
 
         except Exception as exc:
             LOGGER.debug("Overall Exception getting EMA: %s seq: %s", exc, index)
-        scheme = {}
-        try:
-
-            scheme["data"] = results[-1]
-            scheme["symbol"] = pair
-            scheme["event"] = "{0}_{1}".format(func, timef)
-            scheme["open_time"] = open_time
-
-            self.schemes.append(scheme)
-
-        except KeyError as exc:
-            LOGGER.warning("KEY FAILURE in moving averages : %s", str(exc))
+            return
 
-        LOGGER.debug("Done Getting moving averages for %s - %s", pair, open_time)
+        self.__add_series(pair, event, lambda row: results[row], index)
+        LOGGER.debug("Done Getting moving averages for %s", pair)
 
     @get_exceptions
     def get_oscillators(self, pair, index=None, localconfig=None):
@@ -629,11 +804,10 @@ class Engine(dict):
         Returns:
             None
         """
-        klines = self.__make_data_tupple(pair, index)
+        klines = self.__make_data_tupple(pair)
         _, _, high, low, close = klines
         func, timeperiod = localconfig  # split tuple
 
-        scheme = {}
         trends = {
             "STOCHF": {"args":[20], "klines":("high", "low", "close")},
             #"CCI": {"klines": ("high", "low", "close"), "args": [14]},
@@ -658,18 +832,9 @@ class Engine(dict):
             LOGGER.debug("failed getting oscillators: %s", str(error))
             return
 
-        result = float(fastk[-1]) if fastk[-1] != None else None
-        try:
-            scheme["data"] = result
-            scheme["symbol"] = pair
-            scheme["event"] = f'{func}_{timeperiod}'
-            index = -1
-            scheme["open_time"] = str(self.dataframes[pair].iloc[index]["openTime"])
-            self.schemes.append(scheme)
-
-        except KeyError as error:
-            LOGGER.warning("Key failure while getting oscillators: %s", str(error))
-        LOGGER.debug("Done Getting oscillators for %s - %s", pair, scheme['open_time'])
+        self.__add_series(pair, f'{func}_{timeperiod}',
+                          lambda row: float(fastk[row]) if fastk[row] != None else None, index)
+        LOGGER.debug("Done Getting oscillators for %s", pair)
 
     @get_exceptions
     def get_indicators(self, pair, index=None, localconfig=None):
@@ -685,9 +850,23 @@ class Engine(dict):
         Returns:
             None
         """
-        func, timeperiod = localconfig
-        klines = self.__make_data_tupple(pair, index)
-        scheme = {}
+        self.get_candle_patterns(pair, [localconfig], index)
+
+    @get_exceptions
+    def get_candle_patterns(self, pair, localconfigs, index=None):
+        """
+        Evaluate several candlestick patterns in a single scan
+        ohlc arrays are fetched once and each pattern is only run over the trailing candles needed
+        for the candles being processed
+
+        Args:
+            pair: trading pair (eg. XRPBTC)
+            localconfigs: list of (pattern, timeperiod) tuples eg. [('DOJI', '0')]
+            index: optional row position
+
+        Returns:
+            None
+        """
         trends = {"HAMMER": {100: "BUY", 0:"HOLD"},
                   "INVERTEDHAMMER": {100: "SELL", 0:"HOLD"},
                   "ENGULFING": {-100:"SELL", 100:"BUY", 0:"HOLD"},
@@ -697,16 +876,19 @@ class Engine(dict):
                   "MARUBOZU": {-100:"SELL", 100:"BUY", 0:"HOLD"},
                   "DOJI": {100: "HOLD", 0:"HOLD"}}
 
-        result = getattr(talib, "CDL" + func)(*klines).tolist()[-1]
-
-        scheme["data"] = result   # convert from array to list
-        scheme["symbol"] = pair
-        scheme["event"] = f"{func}_{timeperiod}"
+        _, open_, high, low, close = self.__make_data_tupple(pair)
+        length = len(close)
+        count = length - index % length if index is not None else min(self.runs, length)
+        results = candle_patterns(open_, high, low, close,
+                                  {func for func, _ in localconfigs}, count)
 
-        index = -1
-        scheme["open_time"] = str(self.dataframes[pair].iloc[index]["openTime"])
-        self.schemes.append(scheme)
-        LOGGER.debug("Done Getting indicators for %s - %s", pair, scheme['open_time'])
+        for func, timeperiod in localconfigs:
+            values = results[func]
+            # rows are relative to end of full series
+            self.__add_series(pair, f"{func}_{timeperiod}",
+                              lambda row, values=values: int(values[row % length - length]),
+                              index)
+        LOGGER.debug("Done Getting indicators for %s", pair)
 
     @get_exceptions
     def get_ha(self, pair, index=None, localconfig=None):
@@ -721,38 +903,23 @@ class Engine(dict):
         """
 
         func, timef = localconfig  # split tuple
-        dataframe = self.__renamed_dataframe_columns(self.dataframes[pair])
-        if index:
-            series = dataframe.apply(pandas.to_numeric)[:index+1].astype(float)
-        else:
-            series = dataframe.apply(pandas.to_numeric).astype(float)
-        scheme = {}
-        series['HA_Close']=(series.Open + series.High + series.Low + series.Close)/4
-
-        series.reset_index(inplace=True)
-
-        ha_open = [ (series.Open[0] + series.Close[0]) / 2 ]
-
-        for i in range(0, len(series)-1):
-            ha_open.append((ha_open[i] + series.HA_Close.values[i]) / 2)
-        series['HA_Open'] = ha_open
-
-        series.set_index('index', inplace=True)
-
-        series['HA_High']=series[['HA_Open','HA_Close','High']].max(axis=1)
-        series['HA_Low']=series[['HA_Open','HA_Close','Low']].min(axis=1)
+        event = f"{func}_{timef}"
+        result = self.__get_incremental(pair, 'get_ha', timef, index)
+        if result is not None:
+            self.__add_series(pair, event, lambda row: result, index)
+            return
 
-        scheme["data"] = {'open':series['HA_Open'].iloc[-1],
-                          'high':series['HA_High'].iloc[-1],
-                          'low':series['HA_Low'].iloc[-1],
-                          'close':series['HA_Close'].iloc[-1],
-                          'openTime':series['date'].iloc[-1]}
-        scheme["symbol"] = pair
-        scheme["event"] = f"{func}_{timef}"
-        scheme["open_time"] = str(int(series.iloc[-1]["date"]))
+        _, open_, high, low, close = self.__make_data_tupple(pair)
+        ha_open, ha_high, ha_low, ha_close = heikin_ashi(open_, high, low, close)
+        open_times = self.dataframes[pair].openTime.values.astype(float)
 
-        self.schemes.append(scheme)
-        LOGGER.debug("Done Getting heiken ashi for %s - %s", pair, scheme['open_time'])
+        self.__add_series(pair, event,
+                          lambda row: {'open':ha_open[row],
+                                       'high':ha_high[row],
+                                       'low':ha_low[row],
+                                       'close':ha_close[row],
+                                       'openTime':open_times[row]}, index)
+        LOGGER.debug("Done Getting heiken ashi for %s", pair)
 
     @get_exceptions
     def get_supertrend(self, pair, index=None, localconfig=None):
@@ -767,32 +934,21 @@ class Engine(dict):
             None
 
         """
-        dataframe = self.__renamed_dataframe_columns(self.dataframes[pair])
-        series = dataframe.apply(pandas.to_numeric)
-        if index is None:
-            index = -1
-        else:
-            # line up with TV graphs
-            series = series.iloc[:index +1]
         _, timef = localconfig  # split tuple
-        scheme = {}
         timeframe, multiplier = timef.split(',')
-
-        supertrend2 = ta.supertrend(high=series.High.astype(float),
-                                    low=series.Low.astype(float),
-                                    close=series.Close.astype(float),
-                                    multiplier=float(multiplier), length=float(timeframe))
+        event = f"STX_{timeframe}"
         # -1 = downtrend - go short
         # 1 = uptrend - go long
-        try:
-            scheme["data"] = (int(supertrend2[f'SUPERTd_{timeframe}_{multiplier}.0'].iloc[-1]),
-                              supertrend2[f'SUPERT_{timeframe}_{multiplier}.0'].iloc[-1])
-            scheme["symbol"] = pair
-            scheme["event"] = f"STX_{timeframe}"
-            scheme["open_time"] = str(self.dataframes[pair].iloc[index]["openTime"])
-        except TypeError:
-            LOGGER.debug("Overall Exception getting supertrend seq: %s", index)
+        result = self.__get_incremental(pair, 'get_supertrend', timef, index)
+        if result is not None:
+            self.__add_series(pair, event, lambda row: result, index)
+            return
+
+        _, _, high, low, close = self.__make_data_tupple(pair)
+        if len(close) < int(timeframe):
+            LOGGER.debug("Not enough candles to get supertrend for %s", pair)
             return
+        direction, value, _, _ = supertrend(high, low, close, int(timeframe), float(multiplier))
 
-        self.schemes.append(scheme)
-        LOGGER.debug("Done Getting supertrend for %s - %s", pair, scheme['open_time'])
+        self.__add_series(pair, event, lambda row: (int(direction[row]), value[row]), index)
+        LOGGER.debug("Done Getting supertrend for %s", pair)
@@ -1,7 +1,6 @@
 #pylint: disable=no-member,too-many-statements,too-many-locals,too-many-branches
 """Create candlestick graphs from OHLC data"""
 
-import json
 import time
 import datetime
 from collections import defaultdict
@@ -308,43 +307,35 @@ class Graph():
             ind = split[1] + '_' + split[2].split(',')[0]
             ind_list.append(ind)
         list_of_results = defaultdict(list)
-        for index_item in index:
+        # all candles are fetched in a single round trip and each is decoded once
+        candles = redis.get_candles(self.pair, self.interval, index)
+        for index_item, candle in zip(index, candles):
             result_list = {}
+            candle = candle or {}
             for ind in ind_list:
                 try:
                     LOGGER.debug("Getting Data for %s", ind)
-                    str_dict = redis.get_item(f'{self.pair}:{self.interval}',
-                                              index_item).decode()
-                    result_list[ind] = json.loads(str_dict)[ind]
-                except AttributeError:
-                    pass
+                    result_list[ind] = candle[ind]
                 except KeyError:
                     LOGGER.debug("No indicator data for %s %s", ind, index_item)
                     continue
-                except ValueError:
-                    LOGGER.debug("Value Error while getting %s", ind)
-                    result_list[int] = redis.get_item(index_item, ind).decode()
 
             LOGGER.debug("Getting current prices")
-            str_dict = redis.get_item(f'{self.pair}:{self.interval}',
-                                      index_item).decode()
-
             try:  #ohlc
-                result_list['ohlc'] = json.loads(str_dict)['ohlc']
+                result_list['ohlc'] = candle['ohlc']
                 result_list['current_price'] = result_list['ohlc']['close']
 
-            except (KeyError, AttributeError) as error:
-                LOGGER.critical("Error, unable to find ohlc data for %s %s %s",
-                                index_item, ind, error)
+            except KeyError as error:
+                LOGGER.critical("Error, unable to find ohlc data for %s %s",
+                                index_item, error)
             try:   #ha
-                result_list['HA_0'] = json.loads(str_dict)['HA_0']
+                result_list['HA_0'] = candle['HA_0']
                 result_list['current_price'] = result_list['HA_0']['close']
             except KeyError:
                 pass
             try:  # event
                 LOGGER.debug("Getting trade events")
-                str_dict = redis.get_item(f'{self.pair}:{self.interval}', index_item).decode()
-                result_list['event'] = json.loads(str_dict)['event']
+                result_list['event'] = candle['event']
             except KeyError:  # no event for this time period, so skip
                 pass
             try:
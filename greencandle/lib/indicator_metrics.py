@@ -0,0 +1,84 @@
+"""
+Opt-in timing and call counts for engine indicator methods
+
+Wall time, CPU time, number of calls and number of input candles are recorded per
+(indicator, pair, interval) so the cost of each configured indicator can be seen before adding
+it to config.main.indicators
+"""
+
+import time
+from contextlib import contextmanager
+from collections import defaultdict
+from greencandle.lib.logger import get_logger
+
+LOGGER = get_logger(__name__)
+FIELDS = ("calls", "wall", "cpu", "candles")
+
+class IndicatorMetrics():
+    """
+    Collected timings for a single engine run
+    """
+    def __init__(self, interval=None):
+        self.interval = interval
+        self.stats = defaultdict(lambda: dict.fromkeys(FIELDS, 0))
+
+    @contextmanager
+    def measure(self, indicator, pair, candles=0):
+        """
+        Record time spent within context against given indicator and pair
+
+        Args:
+            indicator: name of indicator eg. bb_20
+            pair: trading pair (eg. XRPBTC), or batch when calculated for all pairs at once
+            candles: number of input candles
+        """
+        wall, cpu = time.perf_counter(), time.process_time()
+        try:
+            yield
+        finally:
+            stats = self.stats[(indicator, pair, self.interval)]
+            stats["calls"] += 1
+            stats["wall"] += time.perf_counter() - wall
+            stats["cpu"] += time.process_time() - cpu
+            stats["candles"] += candles
+
+    def merge(self, stats):
+        """
+        Add stats collected elsewhere (eg. in a worker process) to this instance
+        """
+        for key, values in stats.items():
+            for field in FIELDS:
+                self.stats[key][field] += values[field]
+
+    def summary(self):
+        """
+        Get totals per indicator, most expensive first
+
+        Returns:
+            dict of indicator name and dict of calls, wall, cpu, candles and pairs
+        """
+        totals = defaultdict(lambda: dict.fromkeys(FIELDS + ("pairs",), 0))
+        for (indicator, _, _), values in self.stats.items():
+            for field in FIELDS:
+                totals[indicator][field] += values[field]
+            totals[indicator]["pairs"] += 1
+        return dict(sorted(totals.items(), key=lambda item: item[1]["wall"], reverse=True))
+
+    def report(self):
+        """
+        Get summary along with per pair stats in a json serializable format
+        """
+        pairs = defaultdict(dict)
+        for (indicator, pair, _), values in self.stats.items():
+            pairs[pair][indicator] = values
+        return {"interval": self.interval, "time": int(time.time()),
+                "indicators": self.summary(), "pairs": pairs}
+
+    def log_summary(self):
+        """
+        Log totals per indicator
+        """
+        for indicator, values in self.summary().items():
+            LOGGER.info("Indicator %s %s: calls=%s pairs=%s candles=%s wall=%.4fs cpu=%.4fs",
+                        self.interval, indicator, values["calls"], values["pairs"],
+                        values["candles"], values["wall"], values["cpu"])
@@ -0,0 +1,100 @@
+"""
+Compiled indicator plan built from config.main.indicators
+
+Each indicator is configured as a string in the form function;name;period eg. get_bb;bb;20,2
+Strings are parsed and validated once so that bad specs fail at startup rather than within an
+engine run
+"""
+
+from functools import lru_cache
+from greencandle.lib.logger import get_logger
+
+LOGGER = get_logger(__name__)
+
+class Indicator():
+    """
+    Single parsed indicator spec
+    """
+    def __init__(self, spec):
+        """
+        Args:
+            spec: indicator string from config eg. get_bb;bb;20,2
+        Raises:
+            ValueError if spec is not in the form function;name;period with numeric periods
+        """
+        self.spec = spec
+        try:
+            self.function, self.name, self.period = spec.split(';')
+            self.params = tuple(float(param) for param in self.period.split(','))
+        except ValueError:
+            raise ValueError(f"Invalid indicator spec: {spec}") from None
+
+        if not self.function.startswith('get_') or not self.name:
+            raise ValueError(f"Invalid indicator spec: {spec}")
+
+        # name used as key in redis eg. bb_20
+        self.event = f"{self.name}_{self.period.split(',')[0]}"
+
+    @property
+    def localconfig(self):
+        """(name, period) tuple passed to engine indicator methods"""
+        return self.name, self.period
+
+    def __repr__(self):
+        return f"Indicator({self.spec!r})"
+
+class IndicatorPlan():
+    """
+    Parsed and validated list of indicators
+    """
+    def __init__(self, indicators, functions=None):
+        """
+        Args:
+            indicators: list of indicator strings from config eg. ['get_rsi;RSI;14']
+            functions: optional class or object (eg. Engine) which each indicator function
+                       must be callable from
+        Raises:
+            ValueError if any spec is invalid
+        """
+        self.indicators = tuple(Indicator(spec.strip()) for spec in indicators if spec.strip())
+        if functions is not None:
+            self.validate(functions)
+        LOGGER.debug("Compiled indicator plan with %s indicators", len(self.indicators))
+
+    def validate(self, functions):
+        """
+        Ensure each indicator function exists in given class or object
+        Raises:
+            ValueError if function is missing
+        """
+        for indicator in self.indicators:
+            if not callable(getattr(functions, indicator.function, None)):
+                raise ValueError(f"Unknown indicator function {indicator.function} in "
+                                 f"{indicator.spec}")
+        return self
+
+    @property
+    def history(self):
+        """Number of candles needed by the indicator with the largest period"""
+        return max((int(max(indicator.params)) for indicator in self.indicators), default=0)
+
+    @property
+    def events(self):
+        """List of indicator names used as keys in redis"""
+        return [indicator.event for indicator in self.indicators]
+
+    def __iter__(self):
+        return iter(self.indicators)
+
+    def __len__(self):
+        return len(self.indicators)
+
+@lru_cache(maxsize=None)
+def get_plan(indicators):
+    """
+    Get plan for space separated indicator string, parsed once per process
+
+    Args:
+        indicators: string of indicators from config eg. config.main.indicators
+    """
+    return IndicatorPlan(indicators.split())
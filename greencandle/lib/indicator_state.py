@@ -0,0 +1,368 @@
+#pylint: disable=too-few-public-methods,no-member
+
+"""
+Running indicator state for incremental updates between prod loops
+
+All candles apart from the last one in a dataframe are treated as closed.  State is built from
+the closed candles of the current window each time a new candle is added, so it matches a full
+recompute over the same window even when old candles are dropped from it.  The value for the last
+(still changing) candle is calculated from that state in constant time on every loop.
+"""
+
+import copy
+import math
+import numpy
+import talib
+from scipy.signal import lfilter
+from greencandle.lib.logger import get_logger
+
+LOGGER = get_logger(__name__)
+
+def heikin_ashi(open_, high, low, close):
+    """
+    Get Heikin-Ashi open, high, low and close arrays from float64 ohlc arrays
+
+    HA open is a first order recurrence on the previous HA candle:
+        ha_open[i] = (ha_open[i-1] + ha_close[i-1]) / 2
+    which is calculated with a linear filter rather than a python loop.  Halving is exact, so
+    results are identical to the loop
+    """
+    ha_close = (open_ + high + low + close) / 4
+    ha_open = numpy.empty_like(ha_close)
+    ha_open[0] = (open_[0] + close[0]) / 2
+    ha_open[1:], _ = lfilter([0.5], [1, -0.5], ha_close[:-1], zi=[ha_open[0] / 2])
+    ha_high = numpy.maximum(numpy.maximum(ha_open, ha_close), high)
+    ha_low = numpy.minimum(numpy.minimum(ha_open, ha_close), low)
+    return ha_open, ha_high, ha_low, ha_close
+
+def supertrend_step(close, upper, lower, prev):
+    """
+    Get direction and final bands for a single candle from previous (direction, upper, lower)
+
+    Direction flips when close crosses the previous band, otherwise the band on the side of the
+    trend can only move towards price
+    """
+    direction, prev_upper, prev_lower = prev
+    if close > prev_upper:
+        direction = 1
+    elif close < prev_lower:
+        direction = -1
+    else:
+        if direction > 0 and lower < prev_lower:
+            lower = prev_lower
+        if direction < 0 and upper > prev_upper:
+            upper = prev_upper
+    return direction, upper, lower
+
+def supertrend(high, low, close, length, multiplier):
+    """
+    Get Supertrend direction, value and final upper/lower bands from float64 hlc arrays, equivalent
+    to pandas_ta.supertrend using talib ATR
+
+    Bands are (high+low)/2 +/- multiplier * ATR, calculated with numpy.  The band ratchet depends
+    on the previous candle so is run over plain floats rather than pandas rows
+    """
+    band_range = multiplier * talib.ATR(high, low, close, timeperiod=length)
+    mid = (high + low) / 2
+    uppers = (mid + band_range).tolist()
+    lowers = (mid - band_range).tolist()
+    closes = close.tolist()
+
+    directions = [1] * len(closes)
+    values = [0.0] * len(closes)
+    state = (1, uppers[0], lowers[0])
+    for i in range(1, len(closes)):
+        state = supertrend_step(closes[i], uppers[i], lowers[i], state)
+        directions[i], uppers[i], lowers[i] = state
+        values[i] = lowers[i] if state[0] > 0 else uppers[i]
+    return numpy.array(directions), numpy.array(values), numpy.array(uppers), \
+            numpy.array(lowers)
+
+class RunningEma():
+    """
+    Exponential moving average, seeded with talib so results line up with a full recompute
+    """
+    def __init__(self, period):
+        self.period = int(period)
+        self.alpha = 2 / (self.period + 1)
+        self.value = None
+
+    def seed(self, dataframe):
+        """Calculate state from closed candles"""
+        self.value = talib.EMA(dataframe.close.values.astype(float), timeperiod=self.period)[-1]
+
+    def current(self, candle):
+        """Get EMA value for given candle"""
+        return self.value + self.alpha * (float(candle['close']) - self.value)
+
+class RunningRsi():
+    """
+    Relative strength index using Wilder's smoothing
+    Closes are scaled by the same factor as get_rsi
+    """
+    SCALE = 100000
+
+    def __init__(self, period):
+        self.period = int(period)
+        self.avg_gain = None
+        self.avg_loss = None
+        self.prev_close = None
+
+    def seed(self, dataframe):
+        """Calculate state from closed candles"""
+        closes = dataframe.close.values.astype(float) * self.SCALE
+        deltas = numpy.diff(closes)
+        gains = numpy.where(deltas > 0, deltas, 0)
+        losses = numpy.where(deltas < 0, -deltas, 0)
+        avg_gain = gains[:self.period].mean()
+        avg_loss = losses[:self.period].mean()
+        for gain, loss in zip(gains[self.period:], losses[self.period:]):
+            avg_gain = (avg_gain * (self.period - 1) + gain) / self.period
+            avg_loss = (avg_loss * (self.period - 1) + loss) / self.period
+        self.avg_gain, self.avg_loss, self.prev_close = avg_gain, avg_loss, closes[-1]
+
+    def __next(self, candle):
+        """Get next averages for given candle"""
+        delta = float(candle['close']) * self.SCALE - self.prev_close
+        avg_gain = (self.avg_gain * (self.period - 1) + max(delta, 0)) / self.period
+        avg_loss = (self.avg_loss * (self.period - 1) + max(-delta, 0)) / self.period
+        return avg_gain, avg_loss
+
+    def current(self, candle):
+        """Get RSI value for given candle"""
+        avg_gain, avg_loss = self.__next(candle)
+        if avg_gain + avg_loss == 0:
+            return 0.0
+        return 100 * avg_gain / (avg_gain + avg_loss)
+
+class RunningAtr():
+    """
+    Average true range using Wilder's smoothing
+    """
+    def __init__(self, period):
+        self.period = int(period)
+        self.value = None
+        self.prev_close = None
+
+    def seed(self, dataframe):
+        """Calculate state from closed candles"""
+        self.value = talib.ATR(dataframe.high.values.astype(float),
+                               dataframe.low.values.astype(float),
+                               dataframe.close.values.astype(float),
+                               timeperiod=self.period)[-1]
+        self.prev_close = float(dataframe.close.iloc[-1])
+
+    def current(self, candle):
+        """Get ATR value for given candle"""
+        high, low = float(candle['high']), float(candle['low'])
+        true_range = max(high - low, abs(high - self.prev_close), abs(low - self.prev_close))
+        return (self.value * (self.period - 1) + true_range) / self.period
+
+class RunningMacd():
+    """
+    MACD line, signal and histogram matching pandas ewm(adjust=False)
+    """
+    def __init__(self, period):
+        short_term, long_term, signal_period = (int(x) for x in period.split(','))
+        self.alphas = (2 / (short_term + 1), 2 / (long_term + 1), 2 / (signal_period + 1))
+        self.values = None
+
+    def __next(self, close, values):
+        """Get next short ema, long ema and signal values"""
+        short_alpha, long_alpha, signal_alpha = self.alphas
+        short_ema, long_ema, signal = values
+        short_ema += short_alpha * (close - short_ema)
+        long_ema += long_alpha * (close - long_ema)
+        signal += signal_alpha * ((short_ema - long_ema) - signal)
+        return short_ema, long_ema, signal
+
+    def seed(self, dataframe):
+        """Calculate state from closed candles"""
+        closes = dataframe.close.values.astype(float)
+        values = (closes[0], closes[0], 0.0)
+        for close in closes[1:]:
+            values = self.__next(close, values)
+        self.values = values
+
+    def current(self, candle):
+        """Get macd, signal and histogram values for given candle"""
+        short_ema, long_ema, signal = self.__next(float(candle['close']), self.values)
+        macd = short_ema - long_ema
+        return macd, signal, macd - signal
+
+class RunningBb():
+    """
+    Bollinger bands over the previous period-1 closes plus the current close
+    Closes are scaled by the same factor as get_bb so results match a full talib recompute on
+    low-priced pairs
+    """
+    SCALE = 100000
+
+    def __init__(self, period):
+        timeframe, multiplier = period.split(',')
+        self.period = int(timeframe)
+        self.multiplier = float(multiplier)
+        self.window = None
+
+    def seed(self, dataframe):
+        """Calculate state from closed candles"""
+        closes = dataframe.close.values[-(self.period - 1):].astype(float)
+        if len(closes) < self.period - 1:
+            raise ValueError("Not enough candles to seed bollinger bands")
+        self.window = closes * self.SCALE
+
+    def current(self, candle):
+        """Get upper, middle and lower band values for given candle"""
+        closes = numpy.append(self.window, float(candle['close']) * self.SCALE)
+        middle = closes.mean()
+        deviation = closes.std() * self.multiplier
+        return [(middle + deviation) / self.SCALE, middle / self.SCALE,
+                (middle - deviation) / self.SCALE]
+
+class RunningHa():
+    """
+    Heikin-Ashi candle following the last closed HA open and close
+    """
+    def __init__(self, _period):
+        self.ha_open = None
+        self.ha_close = None
+
+    def seed(self, dataframe):
+        """Calculate state from closed candles"""
+        ha_open, _, _, ha_close = heikin_ashi(*(dataframe[column].values.astype(float)
+                                                 for column in ('open', 'high', 'low', 'close')))
+        self.ha_open, self.ha_close = ha_open[-1], ha_close[-1]
+
+    def current(self, candle):
+        """Get HA candle for given candle"""
+        high, low = float(candle['high']), float(candle['low'])
+        ha_open = (self.ha_open + self.ha_close) / 2
+        ha_close = (float(candle['open']) + high + low + float(candle['close'])) / 4
+        return {'open': ha_open,
+                'high': max(ha_open, ha_close, high),
+                'low': min(ha_open, ha_close, low),
+                'close': ha_close,
+                'openTime': float(candle['openTime'])}
+
+class RunningSupertrend():
+    """
+    Supertrend following the last closed final bands and direction
+    """
+    def __init__(self, period):
+        length, multiplier = period.split(',')
+        self.multiplier = float(multiplier)
+        self.atr = RunningAtr(length)
+        self.state = None
+
+    def seed(self, dataframe):
+        """Calculate state from closed candles"""
+        high, low, close = (dataframe[column].values.astype(float)
+                            for column in ('high', 'low', 'close'))
+        directions, _, uppers, lowers = supertrend(high, low, close, self.atr.period,
+                                                   self.multiplier)
+        if math.isnan(uppers[-1]):
+            raise ValueError("Not enough candles to seed supertrend")
+        self.atr.seed(dataframe)
+        self.state = (int(directions[-1]), uppers[-1], lowers[-1])
+
+    def __next(self, candle):
+        """Get next direction and final bands for given candle"""
+        band_range = self.multiplier * self.atr.current(candle)
+        mid = (float(candle['high']) + float(candle['low'])) / 2
+        return supertrend_step(float(candle['close']), mid + band_range, mid - band_range,
+                               self.state)
+
+    def current(self, candle):
+        """Get direction and supertrend value for given candle"""
+        direction, upper, lower = self.__next(candle)
+        return direction, lower if direction > 0 else upper
+
+class IndicatorState():
+    """
+    Per-pair running state for supported indicators
+    """
+
+    RUNNERS = {"get_moving_averages": RunningEma,
+               "get_rsi": RunningRsi,
+               "get_atr": RunningAtr,
+               "get_macd": RunningMacd,
+               "get_bb": RunningBb,
+               "get_ha": RunningHa,
+               "get_supertrend": RunningSupertrend}
+
+    def __init__(self, indicators):
+        """
+        Args:
+            indicators: list of indicator strings from config eg. get_rsi;RSI;14
+        """
+        self.indicators = set()
+        for item in indicators:
+            function, _, period = item.split(';')
+            if function in self.RUNNERS:
+                self.indicators.add((function, period))
+        self.pairs = {}
+
+    def subset(self, pairs):
+        """
+        Get copy of state holding only given pairs, eg. to send to a worker process
+        """
+        state = copy.copy(self)
+        state.pairs = {pair: self.pairs[pair] for pair in pairs if pair in self.pairs}
+        return state
+
+    @staticmethod
+    def __get_window(dataframe):
+        """
+        Get open times of first and last closed candles, identifying the window state is built from
+        """
+        open_times = dataframe.openTime.values
+        return open_times[0], open_times[-2]
+
+    def __seed(self, pair, dataframe):
+        """
+        Rebuild state for pair from all closed candles in dataframe
+        """
+        closed = dataframe.iloc[:-1]
+        runners = {}
+        for function, period in self.indicators:
+            runner = self.RUNNERS[function](period)
+            try:
+                runner.seed(closed)
+            except (IndexError, ValueError) as exc:
+                LOGGER.debug("Unable to seed %s %s for %s: %s", function, period, pair, exc)
+                continue
+            runners[(function, period)] = runner
+        self.pairs[pair] = {"window": self.__get_window(dataframe), "runners": runners}
+
+    def update(self, pair, dataframe):
+        """
+        Bring state for pair in line with given dataframe
+        If the last candle has only been updated, there is nothing to do.  Otherwise (new candle,
+        restart or gap) state is rebuilt from the closed candles, so values match a full
+        recompute over the current window rather than drifting as old candles are dropped
+        """
+        if len(dataframe) < 3:
+            self.pairs.pop(pair, None)
+            return
+        current = self.pairs.get(pair)
+        if current and current["window"] == self.__get_window(dataframe):
+            return
+
+        LOGGER.debug("Rebuilding indicator state for %s", pair)
+        self.__seed(pair, dataframe)
+
+    def get(self, pair, function, period, dataframe):
+        """
+        Get indicator value for the last candle in dataframe
+        Returns None if there is no state in line with dataframe, in which case caller should
+        fall back to a full recompute
+        """
+        current = self.pairs.get(pair)
+        if not current or len(dataframe) < 3 or current["window"] != \
+                self.__get_window(dataframe):
+            return None
+        try:
+            runner = current["runners"][(function, period)]
+        except KeyError:
+            return None
+        return runner.current(dataframe.iloc[-1])
@@ -252,6 +252,20 @@ class Mysql():
         row = [(item[0], item[1], item[2], item[3], item[4], item[5]) for item in cur.fetchall()]
         return row if row else [[None] * 6]
 
+    @get_exceptions
+    def get_trade_pairs(self):
+        """
+        Return set of pairs with an open trade, using the same criteria as get_trade_value
+        """
+
+        command = (f'select pair, open_price from trades where close_price is NULL and '
+                   f'`interval` = "{self.interval}" and name ="{config.main.name}" '
+                   f'and direction="{config.main.trade_direction}"')
+
+        cur = self.dbase.cursor()
+        self.__execute(cur, command)
+        return {item[0] for item in cur.fetchall() if item[1]}
+
     @get_exceptions
     def get_last_trades(self):
         """
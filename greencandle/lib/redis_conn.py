@@ -1,4 +1,4 @@
-#pylint: disable=eval-used,no-member,too-many-locals,too-many-branches,too-many-statements
+#pylint: disable=no-member,too-many-locals,too-many-branches,too-many-statements
 #pylint: disable=broad-except,too-many-arguments,invalid-name,unused-variable
 
 """
@@ -8,14 +8,313 @@ import json
 import time
 import zlib
 import pickle
+import threading
+from functools import partial
 from datetime import datetime, timedelta
 import redis
+import msgpack
+import numpy
 from str2bool import str2bool
 from greencandle.lib.mysql import Mysql
 from greencandle.lib.logger import get_logger
+from greencandle.lib.indicator_plan import get_plan
+from greencandle.lib.rules import get_config_rules, get_value, truth
 from greencandle.lib import config
 from greencandle.lib.common import add_perc, sub_perc, AttributeDict, \
-        perc_diff, convert_to_seconds, get_short_name, TF2MIN, epoch2date
+        perc_diff, convert_to_seconds, get_short_name, TF2MIN, epoch2date, divide_chunks
+
+# Candles are stored as a version byte followed by msgpack, or as JSON in the original format
+# which is still read transparently
+MSGPACK_VERSION = b'\x01'
+
+def encode_candle(data, encoding=None):
+    """
+    Encode dict of candle data for storing in redis using config.redis.redis_encoding
+    (msgpack or json)
+    """
+    if (encoding or config.redis.redis_encoding) == 'json':
+        return json.dumps(data)
+    return MSGPACK_VERSION + msgpack.packb(data, default=lambda obj: obj.item())
+
+def decode_candle(raw):
+    """
+    Decode candle data stored in redis in either msgpack or legacy JSON format
+    """
+    if raw[:1] == MSGPACK_VERSION:
+        return msgpack.unpackb(raw[1:])
+    return json.loads(raw.decode("UTF-8"))
+
+# Add hash fields missing from the sorted timestamp index, eg. candles written before the index
+# was maintained.  Only scans the hash when it holds more fields than the index
+# KEYS[1]: hash key  KEYS[2]: index key
+INDEX_SCRIPT = r"""
+if redis.call('HLEN', KEYS[1]) > redis.call('ZCARD', KEYS[2]) then
+    local fields = redis.call('HKEYS', KEYS[1])
+    for i = 1, #fields, 1000 do
+        local members = {}
+        for j = i, math.min(i + 999, #fields) do
+            local score = tonumber(fields[j])
+            if score then
+                members[#members + 1] = score
+                members[#members + 1] = fields[j]
+            end
+        end
+        if #members > 0 then redis.call('ZADD', KEYS[2], unpack(members)) end
+    end
+end
+"""
+
+# Merge top level members of encoded candles into existing hash fields in a single atomic call
+# Existing values are spliced as raw bytes rather than decoded and re-encoded, so numbers keep
+# their full precision.  Fields whose stored data has a different encoding (eg. JSON written
+# before switching to msgpack) are left unchanged and returned, to be merged by the caller.
+# Fields are also added to the sorted timestamp index, which is first brought in line with the
+# hash
+# KEYS[1]: hash key  KEYS[2]: index key  ARGV: field1, data1, field2, data2, ...
+MERGE_SCRIPT = INDEX_SCRIPT + r"""
+local function json_members(obj)
+    local keys, values = {}, {}
+    local pos, size = 2, #obj
+    while pos <= size do
+        if obj:sub(pos, pos) == '"' then
+            local last = pos + 1
+            while obj:sub(last, last) ~= '"' do
+                if obj:sub(last, last) == '\\' then last = last + 1 end
+                last = last + 1
+            end
+            local name = obj:sub(pos, last)
+            local first = obj:find(':', last + 1, true) + 1
+            local depth, in_string, stop = 0, false, first
+            while stop <= size do
+                local char = obj:sub(stop, stop)
+                if in_string then
+                    if char == '\\' then stop = stop + 1
+                    elseif char == '"' then in_string = false end
+                elseif char == '"' then in_string = true
+                elseif char == '{' or char == '[' then depth = depth + 1
+                elseif char == '}' or char == ']' then
+                    if depth == 0 then break end
+                    depth = depth - 1
+                elseif char == ',' and depth == 0 then break end
+                stop = stop + 1
+            end
+            if values[name] == nil then keys[#keys + 1] = name end
+            values[name] = obj:sub(first, stop - 1)
+            pos = stop + 1
+        else
+            pos = pos + 1
+        end
+    end
+    return keys, values
+end
+
+local function json_join(keys, values)
+    local parts = {}
+    for i, name in ipairs(keys) do parts[i] = name .. ':' .. values[name] end
+    return '{' .. table.concat(parts, ',') .. '}'
+end
+
+local function uint(obj, pos, size)
+    local value = 0
+    for i = pos, pos + size - 1 do value = value * 256 + obj:byte(i) end
+    return value
+end
+
+-- msgpack formats with a fixed size: total bytes
+local FIXED = {[0xc0]=1, [0xc2]=1, [0xc3]=1, [0xca]=5, [0xcb]=9, [0xcc]=2, [0xcd]=3, [0xce]=5,
+               [0xcf]=9, [0xd0]=2, [0xd1]=3, [0xd2]=5, [0xd3]=9, [0xd4]=3, [0xd5]=4, [0xd6]=6,
+               [0xd7]=10, [0xd8]=18}
+-- msgpack formats followed by a length: bytes of length, extra bytes before data
+local SIZED = {[0xc4]={1, 0}, [0xc5]={2, 0}, [0xc6]={4, 0}, [0xc7]={1, 1}, [0xc8]={2, 1},
+               [0xc9]={4, 1}, [0xd9]={1, 0}, [0xda]={2, 0}, [0xdb]={4, 0}}
+-- msgpack containers followed by a count: bytes of count, values per item
+local CONTAINERS = {[0xdc]={2, 1}, [0xdd]={4, 1}, [0xde]={2, 2}, [0xdf]={4, 2}}
+
+local function msgpack_skip(obj, pos)
+    local count = 1
+    while count > 0 do
+        count = count - 1
+        local byte = obj:byte(pos)
+        if byte <= 0x7f or byte >= 0xe0 then
+            pos = pos + 1
+        elseif byte <= 0x8f then
+            pos, count = pos + 1, count + 2 * (byte - 0x80)
+        elseif byte <= 0x9f then
+            pos, count = pos + 1, count + byte - 0x90
+        elseif byte <= 0xbf then
+            pos = pos + 1 + byte - 0xa0
+        elseif FIXED[byte] then
+            pos = pos + FIXED[byte]
+        elseif SIZED[byte] then
+            local size, extra = SIZED[byte][1], SIZED[byte][2]
+            pos = pos + 1 + size + extra + uint(obj, pos + 1, size)
+        else
+            local size, per_item = CONTAINERS[byte][1], CONTAINERS[byte][2]
+            count = count + per_item * uint(obj, pos + 1, size)
+            pos = pos + 1 + size
+        end
+    end
+    return pos
+end
+
+local function msgpack_members(obj)
+    local keys, values = {}, {}
+    local byte, count, pos = obj:byte(2), 0, 0
+    if byte <= 0x8f then
+        count, pos = byte - 0x80, 3
+    elseif byte == 0xde then
+        count, pos = uint(obj, 3, 2), 5
+    else
+        count, pos = uint(obj, 3, 4), 7
+    end
+    for _ = 1, count do
+        local value_pos = msgpack_skip(obj, pos)
+        local stop = msgpack_skip(obj, value_pos)
+        local name = obj:sub(pos, value_pos - 1)
+        if values[name] == nil then keys[#keys + 1] = name end
+        values[name] = obj:sub(value_pos, stop - 1)
+        pos = stop
+    end
+    return keys, values
+end
+
+local function msgpack_join(keys, values)
+    local count, header = #keys, nil
+    if count < 16 then
+        header = string.char(0x80 + count)
+    elseif count < 65536 then
+        header = string.char(0xde, math.floor(count / 256), count % 256)
+    else
+        header = string.char(0xdf, math.floor(count / 16777216) % 256,
+                             math.floor(count / 65536) % 256, math.floor(count / 256) % 256,
+                             count % 256)
+    end
+    local parts = {}
+    for i, name in ipairs(keys) do parts[i] = name .. values[name] end
+    return '\1' .. header .. table.concat(parts)
+end
+
+local CODECS = {['{']={json_members, json_join}, ['\1']={msgpack_members, msgpack_join}}
+
+local mixed = {}
+for i = 1, #ARGV, 2 do
+    local field, update = ARGV[i], ARGV[i + 1]
+    local current = redis.call('HGET', KEYS[1], field)
+    local codec = CODECS[update:sub(1, 1)]
+    if current and current:sub(1, 1) ~= update:sub(1, 1) then
+        mixed[#mixed + 1] = field
+    else
+        if current then
+            local members, join = codec[1], codec[2]
+            local keys, values = members(current)
+            local new_keys, new_values = members(update)
+            for _, name in ipairs(new_keys) do
+                if values[name] == nil then keys[#keys + 1] = name end
+                values[name] = new_values[name]
+            end
+            update = join(keys, values)
+        end
+        redis.call('HSET', KEYS[1], field, update)
+    end
+    redis.call('ZADD', KEYS[2], field, field)
+end
+return mixed
+"""
+
+def check_retention(plan, retention=None):
+    """
+    Ensure candles kept in redis cover the largest indicator period of given IndicatorPlan
+
+    Args:
+        plan: compiled indicator plan
+        retention: number of candles kept, defaults to config.redis.redis_retention
+    Raises:
+        ValueError if retention is below what the plan requires
+    """
+    retention = int(config.redis.redis_retention if retention is None else retention)
+    if 0 < retention < plan.history:
+        raise ValueError(f"redis_retention of {retention} candles is below the {plan.history} "
+                         f"required by configured indicators")
+
+POOLS = {}
+POOLS_LOCK = threading.Lock()
+
+def get_pool(host, port, db):
+    """
+    Get connection pool for given host, port and db, shared by all Redis instances within the
+    current process
+    Pool size and connection health check interval are taken from config
+    """
+    key = (host, str(port), int(db))
+    with POOLS_LOCK:
+        if key not in POOLS:
+            POOLS[key] = redis.ConnectionPool(
+                host=host, port=port, db=db,
+                max_connections=int(config.redis.redis_max_connections),
+                health_check_interval=int(config.redis.redis_health_check_interval))
+        return POOLS[key]
+
+# Remove all but the latest ARGV[1] timestamps from hash and sorted timestamp index
+# The index is first brought in line with the hash, so candles written before it existed are
+# also removed
+# KEYS[1]: hash key  KEYS[2]: index key  ARGV[1]: number of timestamps to keep
+TRIM_SCRIPT = INDEX_SCRIPT + r"""
+local stale = redis.call('ZRANGE', KEYS[2], 0, -tonumber(ARGV[1]) - 1)
+for i = 1, #stale, 1000 do
+    local chunk = {unpack(stale, i, math.min(i + 999, #stale))}
+    redis.call('HDEL', KEYS[1], unpack(chunk))
+    redis.call('ZREM', KEYS[2], unpack(chunk))
+end
+return #stale
+"""
+
+# Update drawdown/drawup hashes of open trades, keeping the lowest or highest price seen
+# A hash is (re)created with the current price when a trade is opened, otherwise only existing
+# hashes are updated.  Returns drawdown/drawup percentage from orig_price for each key
+# KEYS: drawdown/drawup hash keys
+# ARGV: for each key - price field, price, 1 to keep highest price or -1 for lowest, 1 if
+#       opening trade, current close price
+DRAW_SCRIPT = r"""
+local results = {}
+for i, key in ipairs(KEYS) do
+    local pos = (i - 1) * 5
+    local field, price, keep = ARGV[pos + 1], ARGV[pos + 2], tonumber(ARGV[pos + 3])
+    if ARGV[pos + 4] == '1' then
+        redis.call('DEL', key)
+        redis.call('HSET', key, field, price, 'orig_price', price)
+    elseif redis.call('EXISTS', key) == 1 then
+        local current = redis.call('HGET', key, field)
+        if not current or (tonumber(price) - tonumber(current)) * keep > 0 then
+            redis.call('HSET', key, field, price)
+        end
+        redis.call('HSETNX', key, 'orig_price', ARGV[pos + 5])
+    end
+    local values = redis.call('HMGET', key, field, 'orig_price')
+    local perc = 0
+    if values[1] and values[2] then
+        local orig = tonumber(values[2])
+        perc = math.abs((tonumber(values[1]) - orig) / math.abs(orig) * 100)
+    end
+    results[i] = string.format('%.17g', perc)
+end
+return results
+"""
+
+SCRIPTS = {}
+SCRIPTS_LOCK = threading.Lock()
+
+def get_scripts(host, port, db):
+    """
+    Get merge, trim and draw scripts for given host, port and db, registered once and shared by
+    all Redis instances within the current process
+    """
+    key = (host, str(port), int(db))
+    with SCRIPTS_LOCK:
+        if key not in SCRIPTS:
+            conn = redis.StrictRedis(connection_pool=get_pool(host, port, db))
+            SCRIPTS[key] = tuple(conn.register_script(script) for script in
+                                 (MERGE_SCRIPT, TRIM_SCRIPT, DRAW_SCRIPT))
+        return SCRIPTS[key]
 
 class Redis():
     """
@@ -40,8 +339,9 @@ class Redis():
         self.test_data = test_data
 
         self.logger.debug("Starting Redis with interval %s db=%s", self.interval, db)
-        pool = redis.ConnectionPool(host=host, port=port, db=db)
+        pool = get_pool(host, port, db)
         self.conn = redis.StrictRedis(connection_pool=pool)
+        self.merge_data, self.trim_data, self.update_draw_data = get_scripts(host, port, db)
 
     def __del__(self):
         """destroy instance"""
@@ -53,17 +353,6 @@ class Redis():
         """
         self.conn.execute_command("flushdb")
 
-    def __add_price(self, name, data):
-        """
-        add/update min and max price dict
-        """
-        redis1 = Redis(interval=self.interval, db=2)
-        for key, val in data.items():
-            self.logger.debug("Adding to Redis: %s %s %s", name, key, val)
-            response = redis1.conn.hset(name, key, val)
-        del redis1
-        return response
-
     def get_drawup(self, pair, **kwargs):
         """
         Get maximum price of current open trade for given pair/interval
@@ -81,8 +370,7 @@ class Redis():
                                direction)
 
         key = f"{pair}:drawup:{short}"
-        max_price = redis1.get_item(key, 'max_price')
-        orig_price = redis1.get_item(key, 'orig_price')
+        max_price, orig_price = redis1.conn.hmget(key, 'max_price', 'orig_price')
         try:
             drawup = perc_diff(orig_price, max_price)
         except TypeError:
@@ -139,8 +427,7 @@ class Redis():
                                config.main.base_env,
                                direction)
         key = f"{pair}:drawdown:{short}"
-        min_price = redis1.get_item(key, 'min_price')
-        orig_price = redis1.get_item(key, 'orig_price')
+        min_price, orig_price = redis1.conn.hmget(key, 'min_price', 'orig_price')
 
         try:
             drawdown = perc_diff(orig_price, min_price)
@@ -212,101 +499,112 @@ class Redis():
         future_time = open_time + timedelta(minutes=TF2MIN[config.main.interval])
         return bool(future_time > current_time)
 
-    def update_drawdown(self, pair, current_candle, event=None, open_time=None):
+    def update_draws(self, trades, draws=("drawdown", "drawup")):
         """
-        Update minimum price for current asset.  Create redis record if it doesn't exist.
+        Update minimum and maximum prices of several open trades with a single atomic script
+        call per trade, sent in one round trip.  Records are created when a trade is opened
+        (event='open'), otherwise only existing records are updated
+
+        Args:
+            trades: list of (pair, current_candle, event, open_time) tuples, see update_drawdown
+            draws: update drawdown, drawup or both
+        Returns:
+            dict of pair and dict of drawdown and/or drawup percentage
         """
         redis1 = Redis(interval=self.interval, db=2)
         short = get_short_name(config.main.name,
                                config.main.base_env,
                                config.main.trade_direction)
+        is_long = config.main.trade_direction == 'long'
+        pipe = redis1.conn.pipeline(transaction=False)
+        for pair, current_candle, event, open_time in trades:
+            current_price = current_candle['close']
+            if event == 'open' or self.in_current_candle(open_time):
+                current_low = current_high = current_price
+            else:
+                current_low, current_high = current_candle['low'], current_candle['high']
+
+            # min_price is the lowest price for long trades, and highest for short trades
+            prices = {"drawdown": ("min_price", current_low, -1) if is_long else
+                                  ("min_price", current_high, 1),
+                      "drawup": ("max_price", current_high, 1) if is_long else
+                                ("max_price", current_low, -1)}
+            args = []
+            for draw in draws:
+                field, price, keep = prices[draw]
+                args.extend([field, str(price), keep, int(event == 'open'), str(current_price)])
+            self.logger.debug("Updating %s for %s with %s", ','.join(draws), pair, args)
+            self.update_draw_data(keys=[f"{pair}:{draw}:{short}" for draw in draws], args=args,
+                                  client=pipe)
+
+        results = pipe.execute()
+        del redis1
+        return {trade[0]: {draw: float(perc) for draw, perc in zip(draws, result)}
+                for trade, result in zip(trades, results)}
 
-        key = f"{pair}:drawdown:{short}"
-        min_price = redis1.get_item(key, 'min_price')
-        orig_price = redis1.get_item(key, 'orig_price')
-
-        current_low = current_candle['low']
-        current_high = current_candle['high']
-        current_price = current_candle['close']
-
-        if event == 'open':
-            self.rm_drawdown(pair)
-            current_low = current_price
-            current_high = current_price
-            min_price = None
-            orig_price = None
-
-        if not orig_price:
-            orig_price = current_price
-
-        if config.main.trade_direction == 'long':
-            # if min price already exists and current price is lower, or there is no min price yet.
-            price = current_price if self.in_current_candle(open_time) else current_low
-            if (min_price and float(price) < float(min_price)) or not min_price:
-                data = {"min_price": price, "orig_price": orig_price}
-                self.logger.debug("setting drawdown for long %s", pair)
-                self.__add_price(key, data)
-
-        elif config.main.trade_direction == 'short':
-            price = current_price if self.in_current_candle(open_time) else current_high
-            if (min_price and float(price) > float(min_price)) or not min_price:
-                data = {"min_price": price, "orig_price": orig_price}
-                self.logger.debug("setting drawdown for short %s", pair)
-                self.__add_price(key, data)
+    def update_draw(self, pair, current_candle, event=None, open_time=None):
+        """
+        Update both minimum and maximum price of an open trade
+        Returns:
+            dict of drawdown and drawup percentage
+        """
+        return self.update_draws([(pair, current_candle, event, open_time)])[pair]
+
+    def update_drawdown(self, pair, current_candle, event=None, open_time=None):
+        """
+        Update minimum price for current asset.  Create redis record if trade is being opened
+        (event='open').
+        If still within the candle the trade was opened in (open_time), the close price is used
+        rather than the low (long) or high (short)
+        Returns:
+            drawdown percentage
+        """
+        return self.update_draws([(pair, current_candle, event, open_time)],
+                                 draws=("drawdown",))[pair]["drawdown"]
 
     def update_drawup(self, pair, current_candle, event=None, open_time=None):
         """
-        Update maximum price for current asset.  Create redis record if it doesn't exist.
+        Update maximum price for current asset.  Create redis record if trade is being opened
+        (event='open').
+        Returns:
+            drawup percentage
         """
-        redis1 = Redis(interval=self.interval, db=2)
-        short = get_short_name(config.main.name,
-                               config.main.base_env,
-                               config.main.trade_direction)
-        key = f"{pair}:drawup:{short}"
-        max_price = redis1.get_item(key, 'max_price')
-        orig_price = redis1.get_item(key, 'orig_price')
-        current_low = current_candle['low']
-        current_high = current_candle['high']
-        current_price = current_candle['close']
-
-        if event == 'open':
-            self.rm_drawup(pair)
-            current_low = current_price
-            current_high = current_price
-            orig_price = None
-
-        if not orig_price:
-            orig_price = current_price
-
-        if config.main.trade_direction == 'long':
-            price = current_price if self.in_current_candle(open_time) else current_high
-            if (max_price and float(price) > float(max_price)) or not max_price:
-                data = {"max_price": price, "orig_price": orig_price}
-                self.logger.debug("setting drawup for long %s", pair)
-                self.__add_price(key, data)
-
-        elif config.main.trade_direction == 'short':
-            price = current_price if self.in_current_candle(open_time) else current_low
-            if (max_price and float(price) < float(max_price)) or not max_price:
-                data = {"max_price": price, "orig_price": orig_price}
-                self.logger.debug("setting drawup for short %s", pair)
-                self.__add_price(key, data)
+        return self.update_draws([(pair, current_candle, event, open_time)],
+                                 draws=("drawup",))[pair]["drawup"]
 
     def append_data(self, pair, interval, data):
         """
         Add data to existing redis keys
+        Top level items are merged into the stored candle server side in a single atomic call
         """
         date = data['event']['date']
         key = f"{pair}:{interval}"
-        byte = self.conn.hmget(key, date)
-        if byte[0]:
-            decoded = json.loads(byte[0].decode())
-            decoded.update(data)
-            recoded = json.dumps(decoded)
-            result = self.conn.hmset(key, {date: recoded})
-        else:
-            result = self.conn.hmset(key, {date: json.dumps(data)})
-        return result
+        mixed = self.merge_data(keys=[key, self.index_key(key)], args=[date, encode_candle(data)])
+        self.__merge_mixed(key, {date: data}, mixed)
+        return True
+
+    def __merge_mixed(self, key, items, fields):
+        """
+        Merge data into stored candles which have a different encoding and were skipped by the
+        merge script.  Stored candles are decoded and re-encoded with the current encoding, in a
+        transaction so members written in between aren't lost
+
+        Args:
+            key: pair:interval hash key
+            items: dict of timestamp and data written
+            fields: timestamps returned by the merge script
+        """
+        for field in fields:
+            field = field.decode() if isinstance(field, bytes) else field
+            self.logger.debug("Converting encoding of %s %s", key, field)
+
+            def merge(pipe, field=field):
+                current = pipe.hget(key, field)
+                data = decode_candle(current) if current else {}
+                data.update(items[field])
+                pipe.multi()
+                pipe.hset(key, field, encode_candle(data))
+            self.conn.transaction(merge, key)
 
     def add_data(self, pair, interval, data):
         """
@@ -320,19 +618,89 @@ class Redis():
         Returns:
             success of operation: True/False
         """
+        return self.add_bulk_data(interval, {pair: data})
+
+    def add_bulk_data(self, interval, data, batch_size=None, retention=None):
+        """
+        Add data for several pairs to redis through a pipeline
+        Timestamps for a pair are merged into existing candles with a single script call, so
+        items added by other writers (eg. trade events) are kept.  Commands are sent in batches
+        rather than one round trip per timestamp
+        Each pair is then trimmed to the latest retention timestamps within the same pipeline
 
-        for close, value in data.items():
+        Args:
+              interval: interval of each kline
+              data: dict of pair and dict of timestamp and data to store
+                    eg. {"XRPBTC": {"1520869499999": {"ohlc": {...}, "EMA_20": 0.1}}}
+              batch_size: max number of timestamps sent per round trip, defaults to
+                          config.redis.redis_batch_size
+              retention: number of timestamps kept for each pair, defaults to
+                         config.redis.redis_retention, 0 to keep all
+        Returns:
+            success of operation: True/False
+        """
+        batch_size = int(batch_size or config.redis.redis_batch_size)
+        expire = str2bool(config.redis.redis_expire)
+        expiry = int(config.redis.redis_expiry_seconds)
+        current_epoch = int(time.time())
+        current_time = epoch2date(current_epoch)
+        retention = int(config.redis.redis_retention if retention is None else retention)
+
+        pipe = self.conn.pipeline(transaction=False)
+        results = []
+        # position of each merge result, with hash key and items
+        merges = []
+        pending = 0
+        for pair, items in data.items():
             key = f"{pair}:{interval}"
-            expiry = int(config.redis.redis_expiry_seconds)
-            value['current_epoch'] = int(time.time())
-            value['current_time'] = epoch2date(time.time())
-            result = self.conn.hmset(key, {close: json.dumps(value)})
+            items = sorted(items.items())
+            if 0 < retention < len(items):
+                # don't write candles which would be trimmed straight away
+                self.logger.info("Dropping %s of %s candles for %s beyond retention of %s",
+                                 len(items) - retention, len(items), key, retention)
+                items = items[-retention:]
+            for chunk in divide_chunks(items, batch_size):
+                for _, value in chunk:
+                    value['current_epoch'] = current_epoch
+                    value['current_time'] = current_time
+                merges.append((len(results) + len(pipe), key, dict(chunk)))
+                self.merge_data(keys=[key, self.index_key(key)], client=pipe,
+                                args=[item for close, value in chunk
+                                      for item in (close, encode_candle(value))])
+                pending += len(chunk)
+                if pending >= batch_size:
+                    results.extend(pipe.execute())
+                    pending = 0
+            if retention > 0:
+                self.trim_data(keys=[key, self.index_key(key)], args=[retention], client=pipe)
+            if expire:
+                pipe.expire(key, expiry)
+                pipe.expire(self.index_key(key), expiry)
+        results.extend(pipe.execute())
+        for position, key, items in merges:
+            self.__merge_mixed(key, items, results[position])
+        self.logger.debug("Added %s pairs to redis in bulk", len(data))
+        return all(result is not False for result in results)
 
-        if str2bool(config.redis.redis_expire):
-            self.conn.expire(key, expiry)
-        return result
+    @staticmethod
+    def index_key(key):
+        """
+        Name of sorted set holding timestamps of given pair:interval hash
+        """
+        return f"{key}:index"
 
-    def get_items(self, pair, interval):
+    def __build_index(self, key):
+        """
+        Create timestamp index from the fields of an existing hash written before the index
+        was maintained
+        """
+        fields = [item.decode() for item in self.conn.hkeys(key)]
+        if fields:
+            self.logger.info("Building timestamp index for %s", key)
+            self.conn.zadd(self.index_key(key), {field: int(field) for field in fields})
+        return bool(fields)
+
+    def get_items(self, pair, interval, last_n=None, start=None, end=None):
         """
         Get sorted list of available keys for a given trading pair/interval
         eg.
@@ -343,23 +711,153 @@ class Redis():
          ...
 
          each item in the list is a key to the hash containing data for that given period
+        Keys are read from the sorted timestamp index rather than the hash itself
+
+        Args:
+            pair: trading pair (eg. XRPBTC)
+            interval: interval of each kline
+            last_n: only return the latest n keys
+            start: only return keys from this mepoch onwards
+            end: only return keys up to and including this mepoch
         """
         key = f"{pair}:{interval}"
-        return sorted([item.decode() for item in list(self.conn.hgetall(key).keys())])
+        index = self.index_key(key)
+
+        if last_n is None:
+            first = 0
+        elif last_n > 0:
+            first = -int(last_n)
+        else:
+            return []
+
+        def get_range():
+            if start is not None or end is not None:
+                items = self.conn.zrangebyscore(index, start if start is not None else '-inf',
+                                                end if end is not None else '+inf')
+                return items[first:]
+            return self.conn.zrange(index, first, -1)
+
+        items = get_range()
+        if not items and not self.conn.exists(index) and self.__build_index(key):
+            items = get_range()
+        return [item.decode() for item in items]
+
+    def get_candles(self, pair, interval, items):
+        """
+        Get decoded data for several items (mepochs) of given pair/interval with a single HMGET
+        Returns list of dicts in the same order as items, with None for missing items
+        """
+        if not items:
+            return []
+        return [decode_candle(raw) if raw is not None else None
+                for raw in self.conn.hmget(f"{pair}:{interval}", items)]
+
+    def get_candle(self, pair, interval, item):
+        """
+        Get decoded data for a single item (mepoch) of given pair/interval, or None if missing
+        """
+        return self.get_candles(pair, interval, [item])[0]
 
     def get_item(self, address, key, pair=None, interval=None):
-        """Return a specific item from redis, given an address and key"""
+        """
+        Return a specific item from redis, given an address and key
+        If pair is given, address is a mepoch and key is looked up in the decoded candle
+        """
         if pair:
             try:
-                item = json.loads(self.conn.hget(f"{pair}:{interval}",
-                                                 address).decode())[key]
-                return item
+                candle = self.get_candle(pair, interval, address)
+                return candle[key] if candle is not None else None
             except KeyError as keyerr:
                 self.logger.warning("Unable to get key for %s: %s %s", address, key, str(keyerr))
                 return None
         item = self.conn.hget(address, key)
         return item
 
+    def set_metrics(self, interval, data):
+        """
+        Store latest indicator metrics report for given interval
+        """
+        return self.conn.set(f"metrics:{interval}", json.dumps(data))
+
+    def get_metrics(self, interval):
+        """
+        Get latest indicator metrics report for given interval, or None if not recorded
+        """
+        data = self.conn.get(f"metrics:{interval}")
+        return json.loads(data.decode()) if data else None
+
+    @staticmethod
+    def stream_key(interval):
+        """
+        Get name of stream holding candle update events for given interval
+        """
+        return f"updates:{interval}"
+
+    def publish_updates(self, interval, pairs):
+        """
+        Add a single event to the update stream of given interval listing pairs which have
+        new data.  Stream is capped at approx config.redis.redis_stream_length events
+
+        Args:
+            interval: interval of updated klines
+            pairs: dict of pair and latest open_time written
+        Returns:
+            id of added event, or None if there were no pairs
+        """
+        if not pairs:
+            return None
+        return self.conn.xadd(self.stream_key(interval),
+                              {pair: str(open_time) for pair, open_time in pairs.items()},
+                              maxlen=int(config.redis.redis_stream_length), approximate=True)
+
+    def get_updates(self, interval, group, block=None):
+        """
+        Get pairs updated since last acknowledged event for given consumer group
+        Group is created on first use at the end of the stream, so events added before it existed
+        aren't replayed - callers should check all pairs on their first run instead.
+        Events delivered previously but not acknowledged (eg. before a restart) are returned
+        first, otherwise wait up to block seconds (default config.redis.redis_stream_block)
+        for new events, or return straight away if block is 0
+
+        Args:
+            interval: interval of klines
+            group: consumer group name, each group receives every event
+            block: max seconds to wait for new events
+        Returns:
+            tuple of list of event ids to acknowledge and dict of pair and latest open_time
+        """
+        stream = self.stream_key(interval)
+        block = int(config.redis.redis_stream_block) if block is None else block
+        try:
+            self.conn.xgroup_create(stream, group, id='$', mkstream=True)
+        except redis.exceptions.ResponseError as err:
+            if 'BUSYGROUP' not in str(err):
+                raise
+
+        # a single consumer per group, so offsets are kept across restarts
+        events = self.conn.xreadgroup(group, group, {stream: '0'})
+        if not events or not events[0][1]:
+            events = self.conn.xreadgroup(group, group, {stream: '>'},
+                                          block=block * 1000 if block else None)
+
+        ids = []
+        pairs = {}
+        for _, entries in events or []:
+            for event_id, fields in entries:
+                ids.append(event_id)
+                # fields of pending events already trimmed from the stream are empty
+                for pair, open_time in (fields or {}).items():
+                    pair = pair.decode()
+                    pairs[pair] = max(pairs.get(pair, ''), open_time.decode())
+        return ids, pairs
+
+    def ack_updates(self, interval, group, ids):
+        """
+        Acknowledge events returned by get_updates once they have been processed
+        """
+        if ids:
+            self.conn.xack(self.stream_key(interval), group, *ids)
+
     def hgetall(self):
         """
         Log current redis hashes for debugging unit tests
@@ -380,7 +878,7 @@ class Redis():
         byte = self.conn.hget(name, item)
 
         try:
-            data = json.loads(byte.decode("UTF-8"))[candle_type]
+            data = decode_candle(byte)[candle_type]
             current_price = data['close']
         except KeyError:
             self.logger.critical("No Data for item %s %s", name, item)
@@ -407,6 +905,209 @@ class Redis():
         except TypeError:
             return result
 
+    def get_rows(self, pair, interval, items, indicators, heikin_ashi=False):
+        """
+        Get indicator results and float ohlc values for several items (mepochs) with a single
+        HMGET, decoding each candle once
+        args:
+          pair
+          interval
+          items: list of mepochs
+          indicators: list of indicator names eg. EMA_200
+          heikin_ashi: also add HA_open, HA_high etc. if HA_0 data is available
+        Returns:
+          list of AttributeDict rows in the same order as items
+        """
+        rows = []
+        for item, data in zip(items, self.get_candles(pair, interval, items)):
+            if data is None:
+                self.logger.critical("No Data for item %s:%s %s", pair, interval, item)
+                data = {}
+
+            row = AttributeDict()
+            for indicator in indicators:
+                if indicator not in data:
+                    self.logger.warning("Unable to get key for %s: %s", item, indicator)
+                result = data.get(indicator)
+                try:
+                    row[indicator] = float(result)
+                except TypeError:
+                    row[indicator] = result
+
+            ha_raw = data.get('HA_0')
+            if heikin_ashi and ha_raw:
+                for key in ['open', 'high', 'low', 'close']:
+                    row[f'HA_{key}'] = float(ha_raw[key])
+
+            ohlc = data['ohlc']
+            for key in ['open', 'high', 'low', 'close']:
+                ohlc[key] = float(ohlc[key])
+            row.update(ohlc)
+            rows.append(row)
+        return rows
+
+    def get_rows_array(self, pairs, interval, fields, count=5, heikin_ashi=False):
+        """
+        Get the last count candles for several pairs as a numpy structured array, fetched in
+        two round trips for all pairs
+        Values are taken from ohlc, heikin ashi or indicator data in the same way as get_rows.
+        Fields holding lists (eg. STX_22) become subarrays, and missing or non-numeric values
+        are NaN.  Pairs with non-numeric values, or a list in a field without lists elsewhere
+        and the other way round, are not regular as get_rows would give different values
+        args:
+          pairs: list of trading pairs
+          interval
+          fields: list of field names eg. close, EMA_200
+          count: number of candles for each pair
+          heikin_ashi: also get HA_open, HA_high etc. if HA_0 data is available
+        Returns:
+          tuple of list of pairs with at least count candles, list of latest mepoch for each
+          of these pairs, array of shape (pairs, count), newest candle first, and boolean array
+          of regular pairs
+        """
+        def get_float(value):
+            try:
+                return float(value)
+            except (TypeError, ValueError):
+                return numpy.nan
+
+        def is_number(value):
+            try:
+                return value is None or float(value) is not None
+            except (TypeError, ValueError):
+                return False
+
+        def get_field_value(data, field):
+            if field in data.get('ohlc', {}):
+                return data['ohlc'][field]
+            if heikin_ashi and field.startswith('HA_') and data.get('HA_0'):
+                return data['HA_0'].get(field[3:])
+            return data.get(field)
+
+        pipe = self.conn.pipeline(transaction=False)
+        for pair in pairs:
+            pipe.zrange(self.index_key(f"{pair}:{interval}"), -count, -1)
+        indexes = {}
+        for pair, index in zip(pairs, pipe.execute()):
+            # legacy hashes without an index are rebuilt by get_items
+            index = [item.decode() for item in index] or \
+                    self.get_items(pair, interval, last_n=count)
+            if len(index) >= count:
+                indexes[pair] = index
+        pairs = list(indexes)
+        indexes = list(indexes.values())
+
+        for pair, index in zip(pairs, indexes):
+            pipe.hmget(f"{pair}:{interval}", index[::-1])
+        candles = [[get_field_value(data, field) for field in fields]
+                   for data in (decode_candle(raw) if raw else {}
+                                for candle in pipe.execute() for raw in candle)]
+
+        # width of subarray for fields holding lists, 0 for single values
+        widths = [max((len(candle[pos]) for candle in candles
+                       if isinstance(candle[pos], (list, tuple))), default=0)
+                  for pos in range(len(fields))]
+        rows = numpy.full((len(pairs), count), numpy.nan,
+                          dtype=[(field, 'f8', (width,)) if width else (field, 'f8')
+                                 for field, width in zip(fields, widths)])
+        flat = rows.reshape(-1)
+        regular = numpy.ones(len(candles), dtype=bool)
+        for row, candle in enumerate(candles):
+            for field, width, value in zip(fields, widths, candle):
+                if width and isinstance(value, (list, tuple)):
+                    flat[field][row, :len(value)] = [get_float(item) for item in value]
+                    regular[row] &= all(is_number(item) for item in value)
+                elif not width:
+                    flat[field][row] = get_float(value)
+                    regular[row] &= is_number(value)
+                else:
+                    regular[row] &= value is None
+        return pairs, [index[-1] for index in indexes], rows, \
+                regular.reshape(len(pairs), count).all(axis=1)
+
+    def get_agg_array(self, pairs, interval, fields):
+        """
+        Get given fields of aggregate data for several pairs from db 3 as a numpy structured
+        array of shape (pairs,) with a single round trip.  Missing or non-numeric values are NaN
+        Returns:
+          tuple of array and boolean array of pairs without non-numeric values, which get_agg
+          keeps as strings
+        """
+        fields = sorted(fields)
+        aggs = numpy.full(len(pairs), numpy.nan, dtype=[(field, 'f8') for field in fields])
+        numeric = numpy.ones(len(pairs), dtype=bool)
+        if not fields:
+            return aggs, numeric
+        redis3 = Redis(interval=interval, db=3)
+        pipe = redis3.conn.pipeline(transaction=False)
+        for pair in pairs:
+            pipe.hmget(f'{pair}:{interval}', fields)
+        for row, values in enumerate(pipe.execute()):
+            for field, value in zip(fields, values):
+                try:
+                    aggs[field][row] = float(value)
+                except TypeError:
+                    pass
+                except ValueError:
+                    numeric[row] = False
+        del redis3
+        return aggs, numeric
+
+    def get_rule_results(self, pairs, interval, action=True):
+        """
+        Evaluate open and close rules for several pairs at once
+        Candles for all pairs are loaded into a single structured array and each compiled rule
+        is evaluated as one vector expression over all pairs
+        args:
+          pairs: list of trading pairs
+          interval
+          action: evaluate rules as in get_action (open/close_rule1-9 with 5 candles and
+                  perc_rate/rate), otherwise as in get_rule_action (rules 1-4 with 4 candles and
+                  heikin ashi data)
+        Returns:
+          dict of pair and tuple of latest mepoch, current price and dict of open and close lists
+          of rule results, for pairs with enough data and values needed by rules.  Other pairs,
+          including those with non-numeric or list values where single values are expected,
+          should be evaluated separately with get_action or get_rule_action.  None if rules
+          can't be vectorized
+        """
+        ruleset = get_config_rules(config.main, count=9 if action else 4)
+        if not ruleset.vectorized:
+            return None
+
+        fields = ruleset.fields | {'close'}
+        rate_indicator = config.main.rate_indicator
+        if action:
+            fields |= {'perc_rate', 'rate', rate_indicator}
+        pairs, items, rows, regular = self.get_rows_array(pairs, interval, sorted(fields),
+                                                          count=5 if action else 4,
+                                                          heikin_ashi=not action)
+        if not pairs or action and rows[rate_indicator].ndim > 2:
+            # perc_rate and rate can't be taken from lists, leave all pairs to get_action
+            return {}
+
+        if action:
+            # change of rate_indicator from previous candle, as in get_action
+            current, previous = rows[rate_indicator][:, :-1], rows[rate_indicator][:, 1:]
+            valid = truth(current) & truth(previous)
+            with numpy.errstate(all="ignore"):
+                rows['perc_rate'][:, :-1] = numpy.where(
+                    valid, (current - previous) / numpy.abs(previous) * 100, 0)
+                rows['rate'][:, :-1] = numpy.where(valid, current - previous, 0)
+
+        aggs, numeric = self.get_agg_array(pairs, interval, ruleset.agg)
+        try:
+            results = ruleset.evaluate_vector(rows, aggs)
+        except ValueError as err:
+            # list field used as a single value, which can't be broadcast
+            self.logger.warning("Unable to evaluate rules for all pairs: %s", err)
+            return {}
+        complete = ruleset.complete(rows, aggs) & regular & numeric
+        return {pair: (item, float(rows['close'][pos, 0]),
+                       {direction: results[direction][:, pos].tolist()
+                        for direction in results})
+                for pos, (pair, item) in enumerate(zip(pairs, items)) if complete[pos]}
+
     def __log_event(self, pair, event, current_time, data):
         """Send event data to logger"""
 
@@ -586,6 +1287,35 @@ class Redis():
                              "open_price: %s", current_low, current_price, open_price)
         return result
 
+    def get_agg(self, pair, interval, fields):
+        """
+        Get given fields of aggregate data for pair/interval from db 3 as an AttributeDict,
+        converting values to float where possible.  Missing fields are omitted
+        """
+        def get_float(var):
+            """
+            try to convert var into float
+            otherwise return unmodified
+            """
+            try:
+                return float(var)
+            except ValueError:
+                return var
+
+        fields = sorted(fields)
+        if not fields:
+            return AttributeDict()
+        redis3 = Redis(interval=interval, db=3)
+        values = redis3.conn.hmget(f'{pair}:{interval}', fields)
+        del redis3
+        return AttributeDict({field: get_float(value.decode()) for field, value in
+                              zip(fields, values) if value is not None})
+
+    def __rule_error(self, pair, rule, error):
+        """Log rule which couldn't be evaluated for given pair"""
+        self.logger.warning("Unable to eval config rule for pair %s: %s: %s %s", pair,
+                            rule.name, rule.expression, error)
+
     @staticmethod
     def get_rules(rules, direction):
         """determine which rules have been matched"""
@@ -608,7 +1338,7 @@ class Redis():
         """
         Get final reconstructed candle data
         """
-        last_item = self.get_items(pair, interval)[-1]
+        last_item = self.get_items(pair, interval, last_n=1)[-1]
         raw = self.get_current(f'{pair}:{interval}', last_item)
         try:
             return raw[-1]
@@ -620,70 +1350,43 @@ class Redis():
         get only rule results, without checking tp/sl etc.
         """
 
-        def get_float(var):
-            """
-            try to convert var into float
-            otherwise return unmodified
-            """
-            try:
-                return float(var)
-            except ValueError:
-                return var
+        ruleset = get_config_rules(config.main, count=4)
+        agg = self.get_agg(pair, interval, ruleset.agg)
 
-        # fetch latest agg data and make available as AttributeDict
-        redis3 = Redis(interval=interval, db=3)
-        raw = redis3.conn.hgetall(f'{pair}:{interval}')
-        agg = AttributeDict({k.decode():get_float(v.decode()) for k, v in raw.items()})
-        del redis3
+        # only fetch indicators referenced by rules
+        ind_list = [event for event in get_plan(config.main.indicators).events
+                    if event in ruleset.fields]
+        items = self.get_items(pair, interval, last_n=5)
+        # look backwards through last 4 items of redis data, fetched in a single round trip
+        res = self.get_rows(pair, interval, items[-1:-5:-1], ind_list, heikin_ashi=True)
 
-        rules = {'open': [], 'close':[]}
-        res = []
-        ind_list = []
-        for i in config.main.indicators.split():
-            split = i.split(';')
-            ind = split[1]+'_' +split[2].split(',')[0]
-            ind_list.append(ind)
-        items = self.get_items(pair, interval)
-        for i in range(-1, -5, -1): # from, to, increment
-            # look backwards through last 3 items of redis data
-            datax = AttributeDict()
-            for indicator in ind_list:
-                datax[indicator] = self.get_result(items[i], indicator, pair, interval)
-            name = f"{pair}:{interval}"
-            ohlc = self.get_current(name, items[i])[-1]
-            for item in ['open', 'high', 'low', 'close']:
-                ohlc[item] = float(ohlc[item])
-            ha_raw = self.get_current(name, items[i], 'HA_0')[-1]
-            if ha_raw:
-                ha_ohlc={}
-                for item in ['open', 'high', 'low', 'close']:
-                    ha_ohlc[f'HA_{item}'] = float(ha_raw[item])
-                datax.update(ha_ohlc)
-
-            datax.update(ohlc)
-            res.append(datax)
-
-
-        for seq in range(1, 5):
-            current_config = None
-            for rule in "open", "close":
-                try:
-                    current_config = config.main[f'{rule}_rule{seq}']
-                except (KeyError, TypeError):
-                    pass
-                if current_config:
-                    try:
-                        rules[rule].append(eval(current_config))
-                    except (TypeError, KeyError) as error:
-                        self.logger.warning("Unable to eval config rule for pair %s: %s_rule: %s "
-                                            "%s mepoch: %s", pair, rule, current_config, error,
-                                                               items[seq])
-                        continue
+        rules = ruleset.evaluate(res, agg, on_error=partial(self.__rule_error, pair))
         dbase = Mysql(interval=config.main.interval)
         try:
             open_price = dbase.get_trade_value(pair)[0][0]
         except IndexError:
             open_price = None
+        return self.__get_rule_result(rules, open_price, items[-1], float(res[0].close))
+
+    def get_rule_actions(self, pairs, interval):
+        """
+        get rule results for several pairs at once, evaluating each rule for all pairs together
+        Returns:
+          dict of pair and result in the same format as get_rule_action, for pairs returned by
+          get_rule_results.  None if rules can't be vectorized or open trades can't be fetched
+        """
+        results = self.get_rule_results(pairs, interval, action=False)
+        open_pairs = Mysql(interval=config.main.interval).get_trade_pairs() \
+                if results is not None else None
+        if open_pairs is None:
+            return None
+        return {pair: self.__get_rule_result(rules, pair in open_pairs, item, current_price)
+                for pair, (item, current_price, rules) in results.items()}
+
+    def __get_rule_result(self, rules, open_price, item, current_price):
+        """
+        Get result tuple of get_rule_action from rule results
+        """
         winning_open = self.get_rules(rules, 'open')
         winning_close = self.get_rules(rules, 'close')
         if any(rules['open']) and not open_price:
@@ -694,8 +1397,7 @@ class Redis():
             result = 'HODL'
         event = self.get_event_str(result)
 
-        current_epoch = int(items[-1])/1000
-        current_price = float(res[0].close)
+        current_epoch = int(item)/1000
         current_time = time.strftime("%Y-%m-%d %H:%M:%S", time.gmtime(current_epoch))
 
         return result, event, current_time, current_price, {'close': winning_close,
@@ -706,6 +1408,9 @@ class Redis():
         Determine if we are in a OPEN/HOLD/CLOSE/NOITEM state for a specific pair and interval
         Will retrieve the current and previous 4 elements from redis and run open/close rules, as
         well as assessing stop_loss and take_profit status
+        Only indicators referenced by rules and rate_indicator are fetched, so other indicators
+        aren't available in res.  perc_rate and rate are set for res[0] - res[3], as res[4] has
+        no previous candle to compare with
         Returns: tupple of dicts containing data
         eg
           ('NOITEM',                 -- status
@@ -714,38 +1419,26 @@ class Redis():
            0.068467,                 -- current price of asset
            {'close': [], 'open': []})  -- matched open/close rules
         """
-        main_indicators = config.main.indicators.split()
-
+        # rate_indicator is used for perc_rate and rate below
+        ruleset = get_config_rules(config.main)
         ind_list = []
-        for i in main_indicators:
-            if 'vol' in i:
+        for indicator in get_plan(config.main.indicators):
+            if indicator.event not in ruleset.fields and \
+                    indicator.event != config.main.rate_indicator:
+                continue
+            if 'vol' in indicator.spec:
                 ind_list.append("volume")
-            split = i.split(';')
-            ind = split[1] + '_' + split[2].split(',')[0]
-            ind_list.append(ind)
+            ind_list.append(indicator.event)
 
-        res = []
-        name = f"{pair}:{interval}"
-        # loop backwards through last 5 items
         try:
-            items = self.get_items(pair=pair, interval=interval)
+            items = self.get_items(pair=pair, interval=interval, last_n=5)
             _ = items[-5]
         except (ValueError, IndexError) as err:
             self.logger.warning("Not enough data for %s: %s", pair, err)
             return ('HOLD', 'Not enough data', 0, 0, {'open':[], 'close':[]})
 
-        for i in range(-1, -6, -1):
-            datax = AttributeDict()
-            for indicator in ind_list:
-                datax[indicator] = self.get_result(items[i], indicator, pair, self.interval)
-
-            # Floatify each of the ohlc elements before adding
-            ohlc = self.get_current(name, items[i])[-1]
-            for item in ['open', 'high', 'low', 'close']:
-                ohlc[item] = float(ohlc[item])
-
-            datax.update(ohlc)
-            res.append(datax)
+        # last 5 items, newest first, fetched in a single round trip
+        res = self.get_rows(pair, interval, items[-1:-6:-1], ind_list)
 
         stop_loss_perc = self.get_on_entry(pair, 'stop_loss_perc')
         take_profit_perc = self.get_on_entry(pair, 'take_profit_perc')
@@ -778,9 +1471,9 @@ class Redis():
         # specified in the rate_indicator config option - best with EMA_500
         rate_indicator = config.main.rate_indicator
 
-        for i in range(0, 5):
+        for i in range(0, 4):
             # loop through first 4 results (can't use 5th as we will need
-            # following item which doesn't exist
+            # following item which doesn't exist, so rules using res[4].perc_rate don't match)
             res[i]['perc_rate'] = float(perc_diff(float(res[i+1][rate_indicator]),
                                                   float(res[i][rate_indicator]))) \
                                         if res[i][rate_indicator] and \
@@ -790,23 +1483,8 @@ class Redis():
                                    if res[i][rate_indicator] and \
                                    res[i+1][rate_indicator] else 0
 
-        rules = {'open': [], 'close': []}
-        for seq in range(1, 10):
-            current_config = None
-            for rule in "open", "close":
-                try:
-                    current_config = config.main[f'{rule}_rule{seq}']
-                    self.logger.debug("Rule: %s_rule%s: %s", rule, seq, current_config)
-                except (KeyError, TypeError):
-                    pass
-                if current_config:
-                    try:
-                        rules[rule].append(eval(current_config))
-                    except (TypeError, KeyError) as error:
-                        self.logger.warning("Unable to eval config rule for pair %s: %s_rule: %s "
-                                            "%s mepoch: %s", pair, rule, current_config, error,
-                                                               items[seq])
-                        continue
+        agg = self.get_agg(pair, interval, ruleset.agg)
+        rules = ruleset.evaluate(res, agg, on_error=partial(self.__rule_error, pair))
         close_timeout = False
         able_to_open = True
 
@@ -903,8 +1581,8 @@ class Redis():
         elif any(rules['open']) and not open_price and able_to_open and not both:
             # if we match any open rules are NOT in a trade and close rules don't match
             # set stop_loss and take_profit
-            self.update_on_entry(pair, 'take_profit_perc', eval(config.main.take_profit_perc))
-            self.update_on_entry(pair, 'stop_loss_perc', eval(config.main.stop_loss_perc))
+            self.update_on_entry(pair, 'take_profit_perc', get_value(config.main.take_profit_perc))
+            self.update_on_entry(pair, 'stop_loss_perc', get_value(config.main.stop_loss_perc))
 
             # delete and re-store high price
             self.logger.debug("Close: %s, Previous Close: %s, >: %s",
@@ -915,8 +1593,8 @@ class Redis():
 
         elif open_price:
             result = 'HOLD'
-            self.update_on_entry(pair, 'take_profit_perc', eval(config.main.take_profit_perc))
-            self.update_on_entry(pair, 'stop_loss_perc', eval(config.main.stop_loss_perc))
+            self.update_on_entry(pair, 'take_profit_perc', get_value(config.main.take_profit_perc))
+            self.update_on_entry(pair, 'stop_loss_perc', get_value(config.main.stop_loss_perc))
             event = self.get_event_str(result)
         else:
             result = 'NOITEM'
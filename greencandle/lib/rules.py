@@ -0,0 +1,402 @@
+"""
+Compiled open/close rules built from config.main.open_rule{n} and close_rule{n}
+
+Rules are python expressions evaluated against the latest candles, where res[0] is the current
+candle and res[1] the previous one, and aggregate data (agg) eg.
+  res[0].EMA_2 > res[0].EMA_69 and res[1].EMA_2 < res[1].EMA_69
+close can be used as shorthand for res[0].close
+Each rule is parsed once into a restricted AST and compiled to a code object.  Only comparisons,
+boolean and arithmetic operators, constants, a few functions and the fields of res and agg are
+allowed, so bad rules fail when compiled rather than within a trade loop
+
+Rules can also be compiled to numpy expressions which are evaluated for many pairs at once
+against a structured array of candle data with shape (pairs, candles)
+"""
+
+import ast
+import copy
+from functools import lru_cache, reduce
+import numpy
+from greencandle.lib.common import perc_diff
+from greencandle.lib.logger import get_logger
+
+LOGGER = get_logger(__name__)
+
+# number of candles available to rules as res[0] - res[4]
+LOOKBACK = 5
+FUNCTIONS = {"perc_diff": perc_diff, "abs": abs, "min": min, "max": max}
+# names which can be used in rules as shorthand for candle fields
+ALIASES = {"close": "res[0].close"}
+# globals for evaluating rules, without builtins
+NAMESPACE = {"__builtins__": {}, **FUNCTIONS}
+NODES = (ast.Expression, ast.BoolOp, ast.And, ast.Or, ast.UnaryOp, ast.Not, ast.USub, ast.UAdd,
+         ast.BinOp, ast.Add, ast.Sub, ast.Mult, ast.Div, ast.Compare, ast.Eq, ast.NotEq, ast.Lt,
+         ast.LtE, ast.Gt, ast.GtE, ast.Is, ast.IsNot, ast.Call, ast.Name, ast.Load,
+         ast.Attribute, ast.Subscript, ast.Constant) + \
+        ((ast.Index,) if hasattr(ast, "Index") else ())
+
+# nodes which can make a rule match with missing values, eg. "a or b"
+PARTIAL = (ast.Or, ast.Not, ast.Is, ast.IsNot, ast.NotEq)
+
+def truth(value):
+    """Get boolean array for truth value of each item, where NaN (missing data) is False"""
+    value = numpy.asarray(value)
+    if value.dtype.kind == "f":
+        return (value != 0) & ~numpy.isnan(value)
+    return value.astype(bool)
+
+def get_item(values, index):
+    """Get item of list field for each pair, NaN if field doesn't hold lists of that length"""
+    values = numpy.asarray(values, dtype=float)
+    if values.ndim < 2 or not -values.shape[-1] <= index < values.shape[-1]:
+        return numpy.full(values.shape[:1], numpy.nan)
+    return values[..., index]
+
+# functions for vector rules, operating element-wise on arrays of values for each pair
+VECTOR_FUNCTIONS = {"perc_diff": lambda num1, num2: (num2 - num1) / numpy.abs(num1) * 100,
+                    "abs": numpy.abs,
+                    "min": lambda *values: reduce(numpy.minimum, values),
+                    "max": lambda *values: reduce(numpy.maximum, values)}
+VECTOR_NAMESPACE = {"__builtins__": {}, **VECTOR_FUNCTIONS,
+                    "_and": lambda *values: reduce(numpy.logical_and, map(truth, values)),
+                    "_or": lambda *values: reduce(numpy.logical_or, map(truth, values)),
+                    "_not": lambda value: ~truth(value),
+                    "_isnan": numpy.isnan,
+                    "_item": get_item,
+                    "_field": lambda rows, field, index: rows[field][:, index],
+                    "_agg": lambda aggs, field: aggs[field]}
+
+def get_slice(node):
+    """Get subscript of a Subscript node, for all supported python versions"""
+    return node.slice.value if isinstance(node.slice, getattr(ast, "Index", ())) else node.slice
+
+def parse(expression, name):
+    """
+    Parse expression into an AST, ensuring only allowed syntax is used
+    Raises:
+        ValueError if expression is invalid or uses unsupported syntax
+    """
+    try:
+        tree = ast.parse(expression.strip(), mode="eval")
+    except SyntaxError as err:
+        raise ValueError(f"Invalid rule {name}: {expression}: {err.msg}") from None
+
+    for node in ast.walk(tree):
+        if not isinstance(node, NODES):
+            raise ValueError(f"Unsupported syntax {type(node).__name__} in rule {name}: "
+                             f"{expression}")
+        if isinstance(node, ast.Constant) and not isinstance(node.value, (int, float, str,
+                                                                          type(None))):
+            raise ValueError(f"Unsupported constant {node.value!r} in rule {name}: {expression}")
+        if isinstance(node, ast.Call) and (node.keywords or not isinstance(node.func, ast.Name)
+                                           or node.func.id not in FUNCTIONS):
+            raise ValueError(f"Unsupported function call in rule {name}: {expression}")
+    return tree
+
+class Alias(ast.NodeTransformer):
+    """
+    Replace names in ALIASES with the expressions they stand for
+    """
+    def visit_Name(self, node):  #pylint: disable=invalid-name
+        """close etc."""
+        if node.id not in ALIASES:
+            return node
+        return ast.copy_location(ast.parse(ALIASES[node.id], mode="eval").body, node)
+
+def call(name, *args):
+    """Create AST node calling a function in VECTOR_NAMESPACE"""
+    return ast.Call(func=ast.Name(id=name, ctx=ast.Load()), args=list(args), keywords=[])
+
+class Vectorize(ast.NodeTransformer):
+    """
+    Convert a checked rule AST into an expression operating on arrays of values for each pair
+    res[i].<field> is read from a structured array rows of shape (pairs, candles) and
+    agg.<field> from structured array aggs of shape (pairs,).  Boolean operators and chained
+    comparisons are replaced with element-wise functions
+    """
+    def __init__(self):
+        # (candle, field) and agg fields which must not be missing for each pair
+        self.fields = set()
+        self.agg = set()
+
+    def visit_Attribute(self, node):  #pylint: disable=invalid-name
+        """res[i].<field> and agg.<field>"""
+        if isinstance(node.value, ast.Name):
+            self.agg.add(node.attr)
+            return call("_agg", ast.Name(id="aggs", ctx=ast.Load()), ast.Constant(node.attr))
+        index = get_slice(node.value).value
+        self.fields.add((index, node.attr))
+        return call("_field", ast.Name(id="rows", ctx=ast.Load()), ast.Constant(node.attr),
+                    ast.Constant(index))
+
+    def visit_Subscript(self, node):  #pylint: disable=invalid-name
+        """res[i]['<field>'] and items of list fields eg. res[0].STX_22[0]"""
+        index = get_slice(node)
+        if isinstance(node.value, ast.Subscript) and isinstance(node.value.value, ast.Name):
+            self.fields.add((get_slice(node.value).value, index.value))
+            return call("_field", ast.Name(id="rows", ctx=ast.Load()), ast.Constant(index.value),
+                        ast.Constant(get_slice(node.value).value))
+        if not (isinstance(index, ast.Constant) and isinstance(index.value, int)):
+            raise ValueError("Only constant integer subscripts can be vectorized")
+        return call("_item", self.visit(node.value), index)
+
+    def visit_Constant(self, node):  #pylint: disable=invalid-name
+        """numbers and None, strings can't be compared with arrays of floats"""
+        if isinstance(node.value, (str, bytes)):
+            raise ValueError("Only numeric constants can be vectorized")
+        return node
+
+    def visit_BoolOp(self, node):  #pylint: disable=invalid-name
+        """and/or"""
+        self.generic_visit(node)
+        return call("_and" if isinstance(node.op, ast.And) else "_or", *node.values)
+
+    def visit_UnaryOp(self, node):  #pylint: disable=invalid-name
+        """not"""
+        self.generic_visit(node)
+        return call("_not", node.operand) if isinstance(node.op, ast.Not) else node
+
+    def visit_Compare(self, node):  #pylint: disable=invalid-name
+        """chained comparisons and is None"""
+        self.generic_visit(node)
+        operands = [node.left] + node.comparators
+        compares = []
+        for left, operator, right in zip(operands, node.ops, operands[1:]):
+            if isinstance(operator, (ast.Is, ast.IsNot)):
+                if not (isinstance(right, ast.Constant) and right.value is None):
+                    raise ValueError("Only comparisons with None can use is")
+                compare = call("_isnan", left)
+                compares.append(call("_not", compare) if isinstance(operator, ast.IsNot)
+                                else compare)
+            else:
+                compares.append(ast.Compare(left=copy.deepcopy(left), ops=[operator],
+                                            comparators=[right]))
+        return compares[0] if len(compares) == 1 else call("_and", *compares)
+
+class Rule():
+    """
+    Single compiled rule
+    """
+    def __init__(self, name, expression):
+        """
+        Args:
+            name: name of rule eg. open_rule1
+            expression: rule string from config
+        Raises:
+            ValueError if rule is invalid
+        """
+        self.name = name
+        self.expression = expression
+        # fields referenced as res[i].<field> and agg.<field>
+        self.fields = set()
+        self.agg = set()
+        tree = ast.fix_missing_locations(Alias().visit(parse(expression, name)))
+        self.__check_names(tree)
+        self.code = compile(tree, f"<{name}>", "eval")
+        self.vector = self.__vectorize(tree)
+        # rules which can match with missing values when called, see complete
+        self.partial = any(isinstance(node, PARTIAL) or isinstance(node, ast.Constant) and
+                           node.value is None for node in ast.walk(tree))
+
+    def __vectorize(self, tree):
+        """
+        Compile rule for evaluating with arrays of values for all pairs at once
+        Returns:
+            tuple of code object and Vectorize instance with referenced fields, or None if rule
+            can't be vectorized
+        """
+        transform = Vectorize()
+        try:
+            vector_tree = ast.fix_missing_locations(transform.visit(copy.deepcopy(tree)))
+        except ValueError as err:
+            LOGGER.debug("Unable to vectorize rule %s: %s", self.name, err)
+            return None
+        return compile(vector_tree, f"<{self.name}>", "eval"), transform
+
+    def __check_names(self, tree):
+        """
+        Ensure res is only used as res[i].<field> and agg as agg.<field>, and collect the names
+        of referenced fields
+        """
+        parents = {child: node for node in ast.walk(tree) for child in ast.iter_child_nodes(node)}
+        for node in ast.walk(tree):
+            if isinstance(node, ast.Name) and node.id == "res":
+                row = parents.get(node)
+                field = parents.get(row)
+                index = get_slice(row) if isinstance(row, ast.Subscript) else None
+                if not (isinstance(index, ast.Constant) and isinstance(index.value, int) and
+                        0 <= index.value < LOOKBACK):
+                    raise ValueError(f"res must be used as res[0] - res[{LOOKBACK - 1}] in rule "
+                                     f"{self.name}: {self.expression}")
+                if isinstance(field, ast.Attribute):
+                    self.fields.add(field.attr)
+                elif isinstance(field, ast.Subscript) and \
+                        isinstance(get_slice(field), ast.Constant) and \
+                        isinstance(get_slice(field).value, str):
+                    self.fields.add(get_slice(field).value)
+                else:
+                    raise ValueError(f"No field given for {ast.unparse(row)} in rule "
+                                     f"{self.name}: {self.expression}")
+            elif isinstance(node, ast.Name) and node.id == "agg":
+                if not isinstance(parents.get(node), ast.Attribute):
+                    raise ValueError(f"agg must be used as agg.<field> in rule {self.name}: "
+                                     f"{self.expression}")
+                self.agg.add(parents[node].attr)
+            elif isinstance(node, ast.Name) and node.id not in FUNCTIONS:
+                raise ValueError(f"Unknown name {node.id} in rule {self.name}: "
+                                 f"{self.expression}")
+            elif isinstance(node, ast.Attribute) and (
+                    node.attr.startswith("_") or not isinstance(node.value, ast.Subscript) and
+                    not (isinstance(node.value, ast.Name) and node.value.id == "agg")):
+                raise ValueError(f"Invalid attribute {node.attr} in rule {self.name}: "
+                                 f"{self.expression}")
+
+    def __call__(self, res, agg=None):
+        """
+        Evaluate rule against list of candle rows and aggregate data
+        """
+        return eval(self.code, NAMESPACE, {"res": res, "agg": agg})  #pylint: disable=eval-used
+
+    def evaluate_vector(self, rows, aggs):
+        """
+        Evaluate rule for all pairs at once
+
+        Args:
+            rows: structured array of shape (pairs, candles) with a field for each candle field
+                  referenced by rule, newest candle first.  Missing values are NaN
+            aggs: structured array of shape (pairs,) with a field for each agg field
+        Returns:
+            boolean array of result for each pair, pairs with missing referenced values don't match
+        """
+        code, _ = self.vector
+        with numpy.errstate(all="ignore"):
+            result = truth(eval(code, VECTOR_NAMESPACE,  #pylint: disable=eval-used
+                                {"rows": rows, "aggs": aggs}))
+        return numpy.broadcast_to(result, (len(rows),)) & self.complete(rows, aggs)
+
+    def complete(self, rows, aggs):
+        """
+        Get boolean array of pairs for which evaluate_vector gives the same result as calling the
+        rule.  A rule without or, not, is, != and None doesn't match when called with any missing
+        value, the same as the vector result, otherwise pairs must have all referenced values
+        """
+        _, transform = self.vector
+        result = numpy.ones(len(rows), dtype=bool)
+        if not self.partial:
+            return result
+        for index, field in transform.fields:
+            values = numpy.isnan(rows[field][:, index])
+            result &= ~values.reshape(len(rows), -1).any(axis=1)
+        for field in transform.agg:
+            result &= ~numpy.isnan(aggs[field])
+        return result
+
+    def __repr__(self):
+        return f"Rule({self.name!r}, {self.expression!r})"
+
+class RuleSet():
+    """
+    Compiled open and close rules
+    """
+    def __init__(self, open_rules, close_rules):
+        """
+        Args:
+            open_rules: list of open rule strings in sequence order, empty rules are skipped
+            close_rules: list of close rule strings in sequence order
+        Raises:
+            ValueError if any rule is invalid
+        """
+        self.rules = {direction: tuple(Rule(f"{direction}_rule{seq}", expression)
+                                       for seq, expression in enumerate(rules, 1)
+                                       if expression and expression.strip())
+                      for direction, rules in (("open", open_rules), ("close", close_rules))}
+        LOGGER.debug("Compiled %s open and %s close rules", len(self.rules["open"]),
+                      len(self.rules["close"]))
+
+    @property
+    def fields(self):
+        """Set of candle fields referenced by any rule"""
+        return set().union(*(rule.fields for rules in self.rules.values() for rule in rules))
+
+    @property
+    def agg(self):
+        """Set of aggregate data fields referenced by any rule"""
+        return set().union(*(rule.agg for rules in self.rules.values() for rule in rules))
+
+    def evaluate(self, res, agg=None, on_error=None):
+        """
+        Evaluate all rules against given candle rows and aggregate data
+        Rules which can't be evaluated due to missing or invalid data don't match, and are
+        passed to on_error along with the exception if given.  They still have a result so
+        the position of each rule in the returned lists (used as the number of the matching
+        rule) doesn't depend on data, the same as evaluate_vector
+
+        Returns:
+            dict of open and close lists of rule results
+        """
+        results = {"open": [], "close": []}
+        for direction, rules in self.rules.items():
+            for rule in rules:
+                try:
+                    results[direction].append(rule(res, agg))
+                except (TypeError, KeyError, ZeroDivisionError) as error:
+                    results[direction].append(False)
+                    if on_error:
+                        on_error(rule, error)
+        return results
+
+    @property
+    def vectorized(self):
+        """True if all rules can be evaluated for many pairs at once"""
+        return all(rule.vector for rules in self.rules.values() for rule in rules)
+
+    def complete(self, rows, aggs):
+        """
+        Get boolean array of pairs for which evaluate_vector gives the same results as
+        evaluate, see Rule.complete
+        """
+        return reduce(numpy.logical_and, (rule.complete(rows, aggs) for rules in
+                                          self.rules.values() for rule in rules),
+                      numpy.ones(len(rows), dtype=bool))
+
+    def evaluate_vector(self, rows, aggs):
+        """
+        Evaluate all rules for all pairs at once, see Rule.evaluate_vector
+
+        Returns:
+            dict of open and close boolean arrays of shape (rules, pairs)
+        """
+        return {direction: numpy.array([rule.evaluate_vector(rows, aggs) for rule in rules],
+                                       dtype=bool).reshape(len(rules), len(rows))
+                for direction, rules in self.rules.items()}
+
+@lru_cache(maxsize=None)
+def get_ruleset(open_rules, close_rules):
+    """
+    Get compiled rules for tuples of open and close rule strings, parsed once per process
+    """
+    return RuleSet(open_rules, close_rules)
+
+def get_config_rules(main, count=9):
+    """
+    Get compiled rules for open_rule1 - close_rule{count} from given config section
+    eg. config.main
+    """
+    return get_ruleset(*(tuple(main.get(f"{direction}_rule{seq}") for seq in range(1, count + 1))
+                         for direction in ("open", "close")))
+
+@lru_cache(maxsize=None)
+def get_value(expression):
+    """
+    Get value of a constant numeric expression from config eg. take_profit_perc, parsed once per
+    process
+
+    Raises:
+        ValueError if expression is not a numeric expression
+    """
+    tree = parse(str(expression), "value")
+    for node in ast.walk(tree):
+        if isinstance(node, (ast.Attribute, ast.Subscript)) or \
+                isinstance(node, ast.Name) and node.id not in FUNCTIONS:
+            raise ValueError(f"Invalid value: {expression}")
+    return eval(compile(tree, "<value>", "eval"), NAMESPACE)  #pylint: disable=eval-used
@@ -13,14 +13,17 @@ from concurrent.futures import ThreadPoolExecutor
 from collections import defaultdict
 import pandas
 import requests
+from str2bool import str2bool
 from greencandle.lib.binance import Binance
 from greencandle.lib.auth import binance_auth
 from greencandle.lib.engine import Engine
-from greencandle.lib.redis_conn import Redis
+from greencandle.lib.indicator_state import IndicatorState
+from greencandle.lib.indicator_plan import IndicatorPlan
+from greencandle.lib.redis_conn import Redis, check_retention
 from greencandle.lib.mysql import Mysql
 from greencandle.lib.profit import get_recent_profit
 from greencandle.lib.order import Trade
-from greencandle.lib.binance_common import get_dataframes
+from greencandle.lib.binance_common import get_dataframes, add_kline
 from greencandle.lib.logger import get_logger, exception_catcher
 from greencandle.lib import config
 
@@ -29,6 +32,12 @@ CHUNK_SIZE = int(config.main.no_of_klines)
 GET_EXCEPTIONS = exception_catcher((Exception))
 PAIRS = config.main.pairs.split()
 MAIN_INDICATORS = config.main.indicators.split()
+MAIN_PLAN = IndicatorPlan(MAIN_INDICATORS, functions=Engine)
+ENGINE_WORKERS = int(config.main.engine_workers)
+ENGINE_DTYPE = config.main.engine_dtype
+ENGINE_BATCH = str2bool(config.main.engine_batch)
+ENGINE_METRICS = str2bool(config.main.engine_metrics)
+VECTOR_RULES = str2bool(config.main.vector_rules)
 
 @GET_EXCEPTIONS
 def serial_test(pairs, intervals, data_dir, indicators):
@@ -83,7 +92,7 @@ def perform_data(pair, interval, data_dir, indicators):
             break
         dataframes = {pair:dataframe}
         engine = Engine(dataframes=dataframes,
-                        interval=interval, test=True, redis=redis)
+                        interval=interval, test=True, redis=redis, dtype=ENGINE_DTYPE)
         engine.get_data(localconfig=indicators)
 
         result, event, current_time, current_price, _ = redis.get_action(pair=pair,
@@ -91,16 +100,14 @@ def perform_data(pair, interval, data_dir, indicators):
         del engine
         current_trade = dbase.get_trade_value(pair)
         current_candle = dataframes[pair].iloc[-1]
-        redis.update_drawdown(pair, current_candle)
-        redis.update_drawup(pair, current_candle)
+        redis.update_draw(pair, current_candle)
         action = 1 if config.main.trade_direction == 'long' else -1
         if result == "OPEN":
             opens.append((pair, current_time, current_price, event, action))
             LOGGER.debug("Items to open: %s", opens)
             trade_result = trade.open_trade(opens)
             if trade_result:
-                redis.update_drawdown(pair, current_candle, event='open')
-                redis.update_drawup(pair, current_candle, event='open')
+                redis.update_draw(pair, current_candle, event='open')
             else:
                 LOGGER.info("Unable to open trade")
 
@@ -120,11 +127,8 @@ def perform_data(pair, interval, data_dir, indicators):
         closes.append((pair, current_time, current_price, event, 0))
         current_candle = dataframes[pair].iloc[-1]
 
-        redis.update_drawdown(pair, current_candle)
-        redis.update_drawup(pair, current_candle)
-
-        drawdown = redis.get_drawdown(pair)['perc']
-        drawup = redis.get_drawup(pair)['perc']
+        draws = redis.update_draw(pair, current_candle)
+        drawdown, drawup = draws['drawdown'], draws['drawup']
         trade_result = trade.close_trade(closes, drawdowns={pair:drawdown}, drawups={pair:drawup})
 
     del redis
@@ -168,14 +172,13 @@ def parallel_test(pairs, interval, data_dir, indicators):
                 break
             dataframes.update({pair:dataframe})
             engine = Engine(dataframes=dataframes,
-                            interval=interval, test=True, redis=redis)
+                            interval=interval, test=True, redis=redis, dtype=ENGINE_DTYPE)
             engine.get_data(localconfig=indicators)
 
             result, event, current_time, current_price, _ = redis.get_action(pair=pair,
                                                                              interval=interval)
             current_candle = dataframe.iloc[-1]
-            redis.update_drawdown(pair, current_candle)
-            redis.update_drawup(pair, current_candle)
+            redis.update_draw(pair, current_candle)
 
             LOGGER.info('In Strategy %s', result)
             del engine
@@ -183,8 +186,7 @@ def parallel_test(pairs, interval, data_dir, indicators):
             action = 1 if config.main.trade_direction == 'long' else -1
             if result == "OPEN":
                 LOGGER.debug("Items to open")
-                redis.update_drawdown(pair, current_candle, event='open')
-                redis.update_drawup(pair, current_candle, event='open')
+                redis.update_draw(pair, current_candle, event='open')
                 opens.append((pair, current_time, current_price, event, action))
             if result == "CLOSE":
                 LOGGER.debug("Items to close")
@@ -220,9 +222,21 @@ def get_pickle_data(pair, data_dir, interval):
 class ProdRunner():
     """
     Collect and OHLC and indicator data whilst preserving previous candles
+    Running indicator state is kept between loops so supported indicators can be updated
+    incrementally
     """
     def __init__(self):
+        # fail at startup rather than trimming history needed by indicators
+        check_retention(MAIN_PLAN)
         self.dataframes = {}
+        self.state = IndicatorState(MAIN_INDICATORS)
+
+    def update_state(self):
+        """
+        Sync running indicator state with current dataframes
+        """
+        for pair, dataframe in self.dataframes.items():
+            self.state.update(pair, dataframe)
 
     @staticmethod
     @GET_EXCEPTIONS
@@ -232,11 +246,11 @@ class ProdRunner():
         redis = Redis()
         current_time = time.strftime("%Y-%m-%d %H:%M:%S", time.gmtime())
 
+        trades = []
         for trade in dbase.get_trades():
-            closes = []
-            drawdowns = {}
-            drawups = {}
             pair = trade[0].strip()
+            if not dbase.trade_in_context(pair, config.main.name, config.main.trade_direction):
+                continue
             open_price, _, open_time, _, _, _ = dbase.get_trade_value(pair)[0]
 
             klines = 60 if interval.endswith('s') or interval.endswith('m') else 5
@@ -251,35 +265,37 @@ class ProdRunner():
                 # Ensure we skip iteration so we don't update db/redis
                 # using values from previous loop
                 continue
+            trades.append((pair, open_price, open_time, current_candle))
 
-            if dbase.trade_in_context(pair, config.main.name, config.main.trade_direction):
-                redis.update_drawdown(pair, current_candle, open_time=open_time)
-                redis.update_drawup(pair, current_candle, open_time=open_time)
-                result, event, current_time, current_price = redis.get_intermittent(pair,
-                                                                                    open_price,
-                                                                                    current_candle,
-                                                                                    open_time)
+        # update drawdown/drawup of all open trades in a single round trip
+        draws = redis.update_draws([(pair, current_candle, None, open_time)
+                                    for pair, _, open_time, current_candle in trades])
 
-                LOGGER.debug("%s int check result: %s Open:%s Current:%s Time:%s",
-                             pair, result, open_price, current_price, current_time)
-                if result == "CLOSE":
-                    LOGGER.debug("Items to close")
-                    closes.append((pair, current_time, current_price, event, 0))
-                    drawdowns[pair] = redis.get_drawdown(pair)['perc']
-                    drawups[pair] = redis.get_drawup(pair)['perc']
-                    if alert:
-                        payload = {"pair":pair, "strategy":"alert", "host": "alert",
-                                   "text": "Closing API trade according to TP/SL rules",
-                                   "action":"close"}
-                        url = f"http://router:1080/{config.web.api_token}"
-                        try:
-                            requests.post(url, json=payload, timeout=1)
-                        except Exception:
-                            pass
-
-                    trade = Trade(interval=interval, test_trade=test,
-                                  test_data=False, config=config)
-                    trade.close_trade(closes, drawdowns=drawdowns, drawups=drawups)
+        for pair, open_price, open_time, current_candle in trades:
+            result, event, current_time, current_price = redis.get_intermittent(pair,
+                                                                                open_price,
+                                                                                current_candle,
+                                                                                open_time)
+
+            LOGGER.debug("%s int check result: %s Open:%s Current:%s Time:%s",
+                         pair, result, open_price, current_price, current_time)
+            if result == "CLOSE":
+                LOGGER.debug("Items to close")
+                closes = [(pair, current_time, current_price, event, 0)]
+                if alert:
+                    payload = {"pair":pair, "strategy":"alert", "host": "alert",
+                               "text": "Closing API trade according to TP/SL rules",
+                               "action":"close"}
+                    url = f"http://router:1080/{config.web.api_token}"
+                    try:
+                        requests.post(url, json=payload, timeout=1)
+                    except Exception:
+                        pass
+
+                trade = Trade(interval=interval, test_trade=test,
+                              test_data=False, config=config)
+                trade.close_trade(closes, drawdowns={pair: draws[pair]['drawdown']},
+                                  drawups={pair: draws[pair]['drawup']})
 
         del redis
         del dbase
@@ -294,9 +310,11 @@ class ProdRunner():
         no_of_klines = config.main.no_of_klines
         LOGGER.debug("Getting %s klines", no_of_klines)
         self.dataframes = get_dataframes(PAIRS, interval=interval, no_of_klines=no_of_klines)
+        self.update_state()
         engine = Engine(dataframes=self.dataframes, interval=interval,
-                        test=test, redis=redis)
-        engine.get_data(localconfig=MAIN_INDICATORS, first_run=first_run, no_of_runs=no_of_runs)
+                        test=test, redis=redis, workers=ENGINE_WORKERS,
+                        dtype=ENGINE_DTYPE, batch=ENGINE_BATCH, metrics=ENGINE_METRICS)
+        engine.get_data(localconfig=MAIN_PLAN, first_run=first_run, no_of_runs=no_of_runs)
 
         del redis
         del engine
@@ -346,25 +364,23 @@ class ProdRunner():
             # skip pair if empty dataframe (no new trades in kline)
             if len(new_dataframes[pair]) == 0:
                 continue
-            if pair in data['closed'] and self.dataframes[pair].iloc[-1]['openTime'] == \
-                    data['closed'][pair]['openTime'] and \
-              self.dataframes[pair].iloc[-1]['numTrades'] < data['closed'][pair]['numTrades']:
+            # read last values by column, a row of mixed dtypes would be upcast to float
+            open_time = self.dataframes[pair].openTime.values[-1]
+            num_trades = self.dataframes[pair].numTrades.values[-1]
+            if pair in data['closed'] and open_time == data['closed'][pair]['openTime'] and \
+                    num_trades < data['closed'][pair]['numTrades']:
                 # candle closed
-                self.dataframes[pair].iloc[-1] = pandas.Series(data['closed'][pair])
-
-            elif self.dataframes[pair].iloc[-1]['openTime'] <  data['recent'][pair]['openTime']:
-                # new candle
-                df2 = self.dataframes[pair].append(pandas.Series(data['recent'][pair]),
-                                                   ignore_index=True,
-                                                   verify_integrity=True).tail(max_klines)
-                self.dataframes[pair] = df2
+                self.dataframes[pair] = add_kline(self.dataframes[pair], data['closed'][pair],
+                                                  max_klines)
 
-            elif self.dataframes[pair].iloc[-1]['openTime'] == \
-                    data['recent'][pair]['openTime'] and \
-              self.dataframes[pair].iloc[-1]['numTrades'] < data['recent'][pair]['numTrades']:
-                # updated candle
-                self.dataframes[pair].iloc[-1] = pandas.Series(data['recent'][pair])
+            elif open_time < data['recent'][pair]['openTime'] or \
+                    open_time == data['recent'][pair]['openTime'] and \
+                    num_trades < data['recent'][pair]['numTrades']:
+                # new or updated candle
+                self.dataframes[pair] = add_kline(self.dataframes[pair], data['recent'][pair],
+                                                  max_klines)
 
+        self.update_state()
         gc.collect()
         return None
 
@@ -380,8 +396,9 @@ class ProdRunner():
         if data:
             self.append_data(interval)
             engine = Engine(dataframes=self.dataframes, interval=interval,
-                            redis=redis)
-            engine.get_data(localconfig=MAIN_INDICATORS, first_run=False)
+                            redis=redis, workers=ENGINE_WORKERS, state=self.state,
+                            dtype=ENGINE_DTYPE, batch=ENGINE_BATCH, metrics=ENGINE_METRICS)
+            engine.get_data(localconfig=MAIN_PLAN, first_run=False)
             del engine
 
         if analyse:
@@ -390,15 +407,23 @@ class ProdRunner():
             drawdowns = {}
             drawups = {}
 
-            for pair in PAIRS:
-                pair = pair.strip()
+            pairs = [pair.strip() for pair in PAIRS]
+            if VECTOR_RULES:
+                # pairs not in a trade which don't match any open rule have nothing to do
+                rule_results = redis.get_rule_results(pairs, interval)
+                open_pairs = Mysql(interval=interval).get_trade_pairs()
+                if rule_results is not None and open_pairs is not None:
+                    pairs = [pair for pair in pairs if pair in open_pairs or pair not in
+                             rule_results or any(rule_results[pair][2]['open'])]
+                    LOGGER.debug("%s pairs to check after evaluating rules", len(pairs))
+
+            for pair in pairs:
                 result, event, current_time, current_price, _ = redis.get_action(pair=pair,
                                                                                  interval=interval)
                 current_candle = redis.get_last_candle(pair, interval)
                 client = binance_auth()
                 if result != "NOITEM":
-                    redis.update_drawdown(pair, current_candle)
-                    redis.update_drawup(pair, current_candle)
+                    redis.update_draw(pair, current_candle)
 
                 action = 1 if config.main.trade_direction == 'long' else -1
                 if result == "OPEN":
@@ -406,8 +431,7 @@ class ProdRunner():
                     tick = client.tickers()
                     current_price = tick[pair]['ask'] if config.main.trade_direction == 'long' \
                             else tick[pair]['bid']
-                    redis.update_drawdown(pair, current_candle, event='open')
-                    redis.update_drawup(pair, current_candle, event='open')
+                    redis.update_draw(pair, current_candle, event='open')
                     opens.append((pair, current_time, current_price, event, action))
 
                 if result == "CLOSE":
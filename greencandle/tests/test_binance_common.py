@@ -0,0 +1,134 @@
+#pylint: disable=wrong-import-position,no-member
+
+"""
+Unittest file for kline dataframes and daily klines cache built from binance data
+"""
+
+import unittest
+from unittest import mock
+from greencandle.lib import config
+config.create_config()
+
+from greencandle.lib.binance_common import KLINE_TYPES, DailyKlinesCache, add_kline, \
+        klines_to_dataframe
+
+DAY = 86400000
+
+def get_kline(open_time, close, num_trades=10):
+    """
+    Create kline dict with string values as returned by binance
+    """
+    return {"openTime": str(open_time), "open": "1.5", "high": str(close + 1),
+            "low": "0.5", "close": str(close), "volume": "100.25",
+            "closeTime": str(open_time + 3599999), "quoteVolume": "150.5",
+            "numTrades": str(num_trades)}
+
+class TestKlines(unittest.TestCase):
+    """
+    Test kline dataframes keep numeric dtypes
+    """
+
+    def setUp(self):
+        self.dataframe = klines_to_dataframe([get_kline(pos * 3600000, 1.0 + pos)
+                                              for pos in range(5)])
+
+    def assert_dtypes(self, dataframe):
+        """
+        Assert columns have numeric kline dtypes
+        """
+        self.assertEqual({key: str(value) for key, value in dataframe.dtypes.items()},
+                         KLINE_TYPES)
+
+    def test_dtypes(self):
+        """
+        Test string klines are converted to int and float columns
+        """
+        self.assert_dtypes(self.dataframe)
+        self.assertEqual(self.dataframe.openTime.values[-1], 4 * 3600000)
+        self.assertEqual(self.dataframe.close.values[-1], 5.0)
+
+    def test_update(self):
+        """
+        Test kline with the same open time replaces the last candle in place
+        """
+        result = add_kline(self.dataframe, get_kline(4 * 3600000, 6.5, num_trades=20), 5)
+        self.assertIs(result, self.dataframe)
+        self.assertEqual(len(result), 5)
+        self.assert_dtypes(result)
+        self.assertEqual(result.close.values[-1], 6.5)
+        self.assertEqual(result.numTrades.values[-1], 20)
+        self.assertEqual(result.closeTime.values[-1], 4 * 3600000 + 3599999)
+        self.assertEqual(result.close.values[-2], 4.0)
+
+    def test_new(self):
+        """
+        Test newer kline is added and old candles beyond max_klines are dropped
+        """
+        result = add_kline(self.dataframe, get_kline(5 * 3600000, 7.0), 5)
+        self.assertEqual(len(self.dataframe), 5)
+        self.assertEqual(len(result), 5)
+        self.assert_dtypes(result)
+        self.assertEqual(list(result.openTime), [pos * 3600000 for pos in range(1, 6)])
+        self.assertEqual(list(result.index), list(range(5)))
+
+        # updating the new candle doesn't change the original dataframe
+        add_kline(result, get_kline(5 * 3600000, 8.0), 5)
+        self.assertEqual(result.close.values[-1], 8.0)
+        self.assertEqual(self.dataframe.close.values[-1], 5.0)
+        self.assert_dtypes(result)
+
+class TestDailyKlinesCache(unittest.TestCase):
+    """
+    Test daily klines used for pivot points are cached per pair and date
+    """
+
+    def setUp(self):
+        patcher = mock.patch('greencandle.lib.binance_common.get_all_klines',
+                             side_effect=lambda pair, interval, start_time, no_of_klines:
+                             [{'pair': pair, 'openTime': start_time}])
+        self.get_all_klines = patcher.start()
+        self.addCleanup(patcher.stop)
+        self.cache = DailyKlinesCache(max_days=2)
+
+    def test_get(self):
+        """
+        Test each pair and date is fetched once
+        """
+        for _ in range(3):
+            for pair in ('XXXUSDT', 'YYYUSDT'):
+                self.assertEqual(self.cache.get(pair, DAY)[0]['pair'], pair)
+        self.assertEqual(self.get_all_klines.call_count, 2)
+        # a later time on the same date is cached
+        self.cache.get('XXXUSDT', DAY + 3600000)
+        self.assertEqual(self.get_all_klines.call_count, 2)
+
+    def test_evict(self):
+        """
+        Test only pairs for the latest max_days dates are kept
+        """
+        for day in range(3):
+            self.cache.get('XXXUSDT', DAY * (day + 1))
+            self.cache.get('YYYUSDT', DAY * (day + 1))
+        self.assertEqual(len(self.cache.data), 4)
+        self.assertNotIn(self.cache.get_key('XXXUSDT', DAY), self.cache.data)
+        self.assertIn(self.cache.get_key('XXXUSDT', DAY * 3), self.cache.data)
+
+    def test_prefetch(self):
+        """
+        Test pairs missing from the cache are fetched together, and empty results are retried
+        """
+        self.cache.get('XXXUSDT', DAY)
+        self.get_all_klines.side_effect = lambda pair, **kwargs: \
+                [] if pair == 'ZZZUSDT' else [{'pair': pair}]
+        self.cache.prefetch({pair: DAY for pair in ('XXXUSDT', 'YYYUSDT', 'ZZZUSDT')})
+        self.assertEqual(sorted(call.kwargs['pair'] for call in
+                                self.get_all_klines.call_args_list[1:]),
+                         ['YYYUSDT', 'ZZZUSDT'])
+        self.assertEqual(self.cache.get('YYYUSDT', DAY), [{'pair': 'YYYUSDT'}])
+        self.assertEqual(self.get_all_klines.call_count, 3)
+
+        self.cache.prefetch({'ZZZUSDT': DAY})
+        self.assertEqual(self.get_all_klines.call_count, 4)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,188 @@
+#pylint: disable=wrong-import-position,no-member
+
+"""
+Unittest file for collecting indicator data with Engine
+"""
+
+import unittest
+from unittest import mock
+import numpy
+import pandas
+import talib
+from greencandle.lib import config
+config.create_config()
+
+from greencandle.lib import engine
+from greencandle.lib.engine import Engine
+from greencandle.lib.indicator_plan import IndicatorPlan
+from greencandle.lib.redis_conn import Redis
+from greencandle.tests.test_indicator_state import get_dataframe
+from greencandle.tests.test_redis_scripts import use_fake_redis
+
+INDICATORS = "get_moving_averages;EMA;20 get_rsi;RSI;14 get_bb;bb;20,2 get_atr;ATR;14 " \
+             "get_macd;MACD;12,26,9 get_supertrend;STX;10,3 get_ha;HA;0"
+
+def get_dataframes(count, candles=300):
+    """
+    Create dict of random ohlcv dataframes for count pairs
+    """
+    dataframes = {}
+    for pos in range(count):
+        dataframe = get_dataframe(candles=candles, start=10.0 + pos, seed=pos)
+        dataframe['volume'] = numpy.random.default_rng(pos).uniform(1, 100, candles)
+        dataframe['closeTime'] = dataframe.openTime + 3599999
+        dataframes[f"PAIR{pos}USDT"] = dataframe
+    return dataframes
+
+def get_data(dataframes, indicators=INDICATORS, **kwargs):
+    """
+    Run Engine.get_data and get data which would be written to redis
+    """
+    redis = mock.Mock()
+    Engine(dataframes=dataframes, interval='1h', test=True, redis=redis,
+           **kwargs).get_data(localconfig=IndicatorPlan(indicators.split()), first_run=True,
+                              no_of_runs=5)
+    (interval, data), _ = redis.add_bulk_data.call_args
+    assert interval == '1h'
+    return {pair: {open_time: dict(items) for open_time, items in candles.items()}
+            for pair, candles in data.items()}
+
+class TestEngine(unittest.TestCase):
+    """
+    Test Engine results
+    """
+
+    def test_workers(self):
+        """
+        Test pairs split between worker processes give the same data as a single process
+        """
+        dataframes = get_dataframes(engine.MIN_SHARD * 2 + 1)
+        with mock.patch('greencandle.lib.engine.ProcessPoolExecutor',
+                        wraps=engine.ProcessPoolExecutor) as pool:
+            sharded = get_data(dataframes, workers=4)
+        pool.assert_called_once_with(max_workers=2)
+        single = get_data(dataframes, workers=1)
+        self.assertEqual(len(single), len(dataframes))
+        self.assertEqual(sharded, single)
+
+    def test_few_pairs(self):
+        """
+        Test pairs aren't split between worker processes with fewer than MIN_SHARD for each
+        """
+        dataframes = get_dataframes(engine.MIN_SHARD - 1)
+        with mock.patch('greencandle.lib.engine.ProcessPoolExecutor') as pool:
+            data = get_data(dataframes, workers=4)
+        pool.assert_not_called()
+        self.assertEqual(data, get_data(dataframes, workers=1))
+
+    def test_ohlcv(self):
+        """
+        Test ohlcv columns are converted once to contiguous arrays of the configured dtype,
+        and float32 data gives close results
+        """
+        dataframes = get_dataframes(2)
+        for dtype in ('float64', 'float32'):
+            instance = Engine(dataframes=dataframes, interval='1h', dtype=dtype)
+            for pair, columns in instance.ohlcv.items():
+                self.assertEqual(sorted(columns), sorted(engine.OHLCV))
+                for column, values in columns.items():
+                    self.assertEqual(values.dtype, numpy.dtype(dtype))
+                    self.assertTrue(values.flags['C_CONTIGUOUS'])
+                    numpy.testing.assert_allclose(values, dataframes[pair][column].values,
+                                                  rtol=1e-6)
+
+        single = get_data(dataframes, dtype='float32')
+        double = get_data(dataframes)
+        for pair, candles in double.items():
+            for open_time, candle in candles.items():
+                for event in ('EMA_20', 'RSI_14', 'ATR_14'):
+                    self.assertAlmostEqual(single[pair][open_time][event] / candle[event], 1,
+                                           places=4, msg=f"{event} {pair} {open_time}")
+
+    def test_backfill(self):
+        """
+        Test the first back-filled candle uses data up to and including that candle
+        """
+        dataframe = get_dataframes(1)['PAIR0USDT']
+        data = get_data({'PAIR0USDT': dataframe})['PAIR0USDT']
+        open_times = [str(open_time) for open_time in dataframe.openTime.values[-5:]]
+        self.assertEqual(sorted(data, key=int), open_times)
+
+        first = data[open_times[0]]
+        self.assertEqual(first['ohlc']['close'], dataframe.close.values[-5])
+        self.assertEqual(first['ohlc']['openTime'], dataframe.openTime.values[-5])
+        self.assertEqual(first['EMA_20'], talib.EMA(dataframe.close.values, timeperiod=20)[-5])
+        self.assertEqual(first['RSI_14'],
+                         talib.RSI(dataframe.close.values[:-4] * 100000, timeperiod=14)[-1])
+
+    def test_candle_patterns(self):
+        """
+        Test patterns run over trailing windows match talib over the full history, and are
+        stored for each back-filled candle
+        """
+        dataframe = get_dataframes(1)['PAIR0USDT']
+        ohlc = [dataframe[column].values for column in ('open', 'high', 'low', 'close')]
+        patterns = ("HAMMER", "ENGULFING", "MORNINGSTAR", "SPINNINGTOP", "DOJI")
+        for count in (1, 10, 300):
+            results = engine.candle_patterns(*ohlc, patterns, count)
+            for pattern in patterns:
+                expected = getattr(talib, "CDL" + pattern)(*ohlc)[-count:]
+                numpy.testing.assert_array_equal(results[pattern], expected, err_msg=pattern)
+        self.assertTrue(any(results[pattern].any() for pattern in patterns))
+
+        data = get_data({'PAIR0USDT': dataframe},
+                        " ".join(f"get_indicators;{pattern};0" for pattern in patterns))
+        for pattern in patterns:
+            expected = getattr(talib, "CDL" + pattern)(*ohlc)[-5:]
+            self.assertEqual([data['PAIR0USDT'][str(open_time)][f"{pattern}_0"] for open_time
+                              in dataframe.openTime.values[-5:]], list(expected))
+
+    def test_metrics(self):
+        """
+        Test indicator timings are collected from each worker and stored for the api
+        """
+        use_fake_redis(self)
+        redis = Redis(interval='1h')
+        dataframes = get_dataframes(engine.MIN_SHARD * 2)
+        for workers in (1, 2):
+            Engine(dataframes=dataframes, interval='1h', test=True, redis=redis,
+                   workers=workers, metrics=True).get_data(
+                       localconfig=IndicatorPlan(["get_rsi;RSI;14", "get_bb;bb;20,2"]))
+            report = redis.get_metrics('1h')
+            self.assertEqual(report['interval'], '1h')
+            self.assertEqual(sorted(report['indicators']), ['RSI_14', 'bb_20', 'ohlc'])
+            for values in report['indicators'].values():
+                self.assertEqual(values['calls'], len(dataframes))
+                self.assertEqual(values['pairs'], len(dataframes))
+                self.assertEqual(values['candles'], 300 * len(dataframes))
+                self.assertGreater(values['wall'], 0)
+            self.assertEqual(sorted(report['pairs']), sorted(dataframes))
+
+        # without metrics nothing is recorded
+        redis.conn.delete('metrics:1h')
+        Engine(dataframes=dataframes, interval='1h', test=True,
+               redis=redis).get_data(localconfig=IndicatorPlan(["get_rsi;RSI;14"]))
+        self.assertIsNone(redis.get_metrics('1h'))
+
+    def test_tsi_cache(self):
+        """
+        Test tsi and signal share a single smi calculation for each pair
+        """
+        dataframes = get_dataframes(2)
+        smi = pandas.DataFrame({'SMI': numpy.arange(300.0), 'SMIs': numpy.arange(300.0) + 1})
+        with mock.patch('greencandle.lib.engine.ta.smi', return_value=smi,
+                        create=True) as calculate, \
+                mock.patch('greencandle.lib.engine.pandas.Series',
+                           wraps=pandas.Series) as series:
+            instance = Engine(dataframes=dataframes, interval='1h', redis=mock.Mock())
+            instance.get_tsi('PAIR0USDT', localconfig=('tsi', '25'))
+            self.assertEqual(instance.cache_stats, {'hits': 0, 'misses': 1})
+            instance.get_tsi('PAIR0USDT', localconfig=('signal', '25'))
+            self.assertEqual(instance.cache_stats, {'hits': 1, 'misses': 1})
+        self.assertEqual(calculate.call_count, 1)
+        self.assertEqual(series.call_count, 1)
+        self.assertEqual([scheme['data'] for scheme in instance.schemes],
+                         [29900.0, 30000.0])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,72 @@
+#pylint: disable=wrong-import-position,no-member
+
+"""
+Unittest file for parsing indicator config into a plan
+"""
+
+import unittest
+from unittest import mock
+from greencandle.lib import config
+config.create_config()
+
+from greencandle.lib.engine import Engine
+from greencandle.lib.indicator_plan import IndicatorPlan, get_plan
+from greencandle.tests.test_engine import get_dataframes
+
+INVALID = ["get_rsi;RSI", "get_rsi;RSI;14;1", "rsi;RSI;14", "get_rsi;;14", "get_rsi;RSI;x",
+           "get_bb;bb;20,"]
+
+class TestIndicatorPlan(unittest.TestCase):
+    """
+    Test indicator specs are parsed and validated once
+    """
+
+    def test_parse(self):
+        """
+        Test functions, names, parameters and redis keys of parsed specs
+        """
+        plan = get_plan("get_bb;bb;20,2  get_rsi;RSI;14 get_supertrend;STX;10,3")
+        self.assertEqual(len(plan), 3)
+        self.assertEqual([indicator.function for indicator in plan],
+                         ['get_bb', 'get_rsi', 'get_supertrend'])
+        self.assertEqual([indicator.params for indicator in plan],
+                         [(20.0, 2.0), (14.0,), (10.0, 3.0)])
+        self.assertEqual([indicator.localconfig for indicator in plan],
+                         [('bb', '20,2'), ('RSI', '14'), ('STX', '10,3')])
+        self.assertEqual(plan.events, ['bb_20', 'RSI_14', 'STX_10'])
+        self.assertEqual(plan.history, 20)
+        self.assertEqual(get_plan("").history, 0)
+
+    def test_cached(self):
+        """
+        Test the same config string is parsed once
+        """
+        self.assertIs(get_plan("get_rsi;RSI;14"), get_plan("get_rsi;RSI;14"))
+
+    def test_invalid(self):
+        """
+        Test bad specs fail when parsed
+        """
+        for spec in INVALID:
+            with self.assertRaises(ValueError, msg=spec):
+                IndicatorPlan([spec])
+
+    def test_validate(self):
+        """
+        Test indicator functions must exist in Engine
+        """
+        IndicatorPlan(["get_rsi;RSI;14", "get_bb;bb;20,2"], functions=Engine)
+        with self.assertRaises(ValueError):
+            IndicatorPlan(["get_rsi;RSI;14", "get_missing;X;1"], functions=Engine)
+
+        # engine errors are logged, but nothing is collected with a bad spec
+        redis = mock.Mock()
+        Engine(dataframes=get_dataframes(1), interval='1h', redis=redis).get_data(
+            localconfig=["get_rsi;RSI;14", "get_missing;X;1"])
+        redis.add_bulk_data.assert_not_called()
+        Engine(dataframes=get_dataframes(1), interval='1h', redis=redis).get_data(
+            localconfig=["get_rsi;RSI;14"])
+        redis.add_bulk_data.assert_called_once()
+
+if __name__ == '__main__':
+    unittest.main()
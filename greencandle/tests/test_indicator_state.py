@@ -0,0 +1,174 @@
+#pylint: disable=wrong-import-position,no-member
+
+"""
+Unittest file for ensuring running indicator state gives the same results as a full recompute
+"""
+
+import unittest
+import numpy
+import pandas
+import talib
+from greencandle.lib import config
+config.create_config()
+
+from greencandle.lib.indicator_state import IndicatorState, heikin_ashi, supertrend
+
+def get_dataframe(candles=300, start=100.0, seed=1):
+    """
+    Create random walk ohlc dataframe with hourly open times
+    """
+    rng = numpy.random.default_rng(seed)
+    close = start * numpy.exp(numpy.cumsum(rng.normal(0, 0.01, candles)))
+    open_ = numpy.concatenate([[start], close[:-1]])
+    spread = start * numpy.abs(rng.normal(0, 0.005, candles))
+    return pandas.DataFrame({'openTime': numpy.arange(candles, dtype='int64') * 3600000,
+                             'open': open_,
+                             'high': numpy.maximum(open_, close) + spread,
+                             'low': numpy.minimum(open_, close) - spread,
+                             'close': close})
+
+def get_macd(close, period):
+    """
+    MACD line, signal and histogram for the last candle as calculated by Engine.get_macd
+    """
+    short_term, long_term, signal_period = (int(x) for x in period.split(','))
+    series = pandas.Series(close)
+    macd = series.ewm(span=short_term, adjust=False).mean() - \
+            series.ewm(span=long_term, adjust=False).mean()
+    signal = macd.ewm(span=signal_period, adjust=False).mean()
+    return macd.iloc[-1], signal.iloc[-1], macd.iloc[-1] - signal.iloc[-1]
+
+def get_bb(close, period):
+    """
+    Upper, middle and lower bollinger bands for the last candle as calculated by Engine.get_bb
+    """
+    timeframe, multiplier = period.split(',')
+    bands = talib.BBANDS(close * 100000, timeperiod=int(timeframe), nbdevup=float(multiplier),
+                         nbdevdn=float(multiplier), matype=0)
+    return [band[-1] / 100000 for band in bands]
+
+def get_ha(dataframe):
+    """
+    Heikin-Ashi candle for the last candle as calculated by Engine.get_ha
+    """
+    ha_open, ha_high, ha_low, ha_close = heikin_ashi(*(dataframe[column].values for column in
+                                                       ('open', 'high', 'low', 'close')))
+    return {'open': ha_open[-1], 'high': ha_high[-1], 'low': ha_low[-1], 'close': ha_close[-1],
+            'openTime': float(dataframe.openTime.values[-1])}
+
+def get_supertrend(dataframe, period):
+    """
+    Supertrend direction and value for the last candle as calculated by Engine.get_supertrend
+    """
+    length, multiplier = period.split(',')
+    direction, value, _, _ = supertrend(dataframe.high.values, dataframe.low.values,
+                                        dataframe.close.values, int(length), float(multiplier))
+    return int(direction[-1]), value[-1]
+
+# indicator config and full recompute of last candle from dataframe
+FULL = {
+    "get_moving_averages;EMA;20": lambda df: talib.EMA(df.close.values, timeperiod=20)[-1],
+    "get_rsi;RSI;14": lambda df: talib.RSI(df.close.values * 100000, timeperiod=14)[-1],
+    "get_atr;ATR;14": lambda df: talib.ATR(df.high.values, df.low.values, df.close.values,
+                                           timeperiod=14)[-1],
+    "get_macd;MACD;12,26,9": lambda df: get_macd(df.close.values, "12,26,9"),
+    "get_bb;bb;20,2": lambda df: get_bb(df.close.values, "20,2"),
+    }
+
+class TestIndicatorState(unittest.TestCase):
+    """
+    Compare incremental indicator values with a full recompute over several loops
+    """
+
+    def run_loops(self, indicators, dataframe, start=200, window=None):
+        """
+        Simulate prod loops where each new candle is first seen while still open, then updated
+        If window is given, only the last window candles are kept as with ProdRunner.append_data
+        Returns list of (loop, indicator, incremental, full) tuples
+        """
+        state = IndicatorState(list(indicators))
+        results = []
+        for end in range(start, len(dataframe)):
+            first = max(0, end + 1 - window) if window else 0
+            current = dataframe.iloc[first:end + 1].copy()
+            # candle still open - close half way between open and final close
+            current.iloc[-1, current.columns.get_loc('close')] = \
+                    (current.open.values[-1] + current.close.values[-1]) / 2
+            for frame in (current, dataframe.iloc[first:end + 1]):
+                state.update('XXXUSDT', frame)
+                for indicator, full in indicators.items():
+                    result = state.get('XXXUSDT', *indicator.split(';')[::2], frame)
+                    self.assertIsNotNone(result, f"{indicator} not available at {end}")
+                    results.append((end, indicator, result, full(frame)))
+        return results
+
+    def assert_close(self, results, rtol=1e-9):
+        """
+        Assert incremental and full results are equal within given relative tolerance
+        """
+        for end, indicator, result, full in results:
+            numpy.testing.assert_allclose(numpy.array(result, dtype=float),
+                                          numpy.array(full, dtype=float), rtol=rtol,
+                                          err_msg=f"{indicator} differs at {end}")
+
+    def test_incremental(self):
+        """
+        Test EMA, RSI, ATR, MACD and BB match full recompute
+        """
+        self.assert_close(self.run_loops(FULL, get_dataframe()))
+
+    def test_sliding(self):
+        """
+        Test all indicators match full recompute over a window which drops old candles
+        """
+        indicators = {**FULL, "get_ha;HA;0": lambda df: list(get_ha(df).values()),
+                      "get_supertrend;STX;10,3": lambda df: get_supertrend(df, "10,3")}
+        self.assert_close([(end, indicator,
+                            list(result.values()) if isinstance(result, dict) else result, full)
+                           for end, indicator, result, full in
+                           self.run_loops(indicators, get_dataframe(seed=6), start=100,
+                                          window=100)])
+
+    def test_low_price(self):
+        """
+        Test bollinger bands and RSI match full recompute on a low-priced pair
+        """
+        indicators = {key: value for key, value in FULL.items()
+                      if key.startswith(("get_bb", "get_rsi"))}
+        self.assert_close(self.run_loops(indicators, get_dataframe(start=0.00001234, seed=2)))
+
+    def test_ha(self):
+        """
+        Test Heikin-Ashi candle matches full recompute
+        """
+        results = self.run_loops({"get_ha;HA;0": get_ha}, get_dataframe())
+        keys = ('open', 'high', 'low', 'close', 'openTime')
+        self.assert_close([(end, indicator, [result[key] for key in keys],
+                            [full[key] for key in keys])
+                           for end, indicator, result, full in results])
+
+    def test_supertrend(self):
+        """
+        Test Supertrend direction and value match full recompute
+        """
+        results = self.run_loops({"get_supertrend;STX;10,3":
+                                  lambda df: get_supertrend(df, "10,3")}, get_dataframe(seed=6))
+        self.assert_close(results)
+        # make sure trend changes were covered
+        self.assertEqual({result[0] for _, _, result, _ in results}, {-1, 1})
+
+    def test_rebuild(self):
+        """
+        Test state is rebuilt when candles are missed between loops
+        """
+        dataframe = get_dataframe()
+        state = IndicatorState(list(FULL))
+        state.update('XXXUSDT', dataframe.iloc[:200])
+        frame = dataframe.iloc[:205]
+        self.assertIsNone(state.get('XXXUSDT', 'get_rsi', '14', frame))
+        state.update('XXXUSDT', frame)
+        self.assertAlmostEqual(state.get('XXXUSDT', 'get_rsi', '14', frame),
+                               FULL["get_rsi;RSI;14"](frame))
+
+if __name__ == '__main__':
+    unittest.main()
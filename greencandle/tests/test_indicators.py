@@ -6,7 +6,6 @@ values which are none null/none
 """
 
 import os
-import json
 import unittest
 from greencandle.lib.logger import get_logger
 from greencandle.lib.binance_common import get_data
@@ -40,8 +39,7 @@ class TestIndicators(unittest.TestCase):
         items = redis.get_items(self.pair, self.interval)
 
         # get last entry from redis
-        results = json.loads(redis.get_item('{}:{}'.format(self.pair, self.interval),
-                                            items[-1]).decode())
+        results = redis.get_candle(self.pair, self.interval, items[-1])
         short_ind_names = []
         # cycle through indicators from config
         for ind in main_indicators:
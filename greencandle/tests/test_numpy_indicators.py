@@ -0,0 +1,222 @@
+#pylint: disable=wrong-import-position,no-member
+
+"""
+Unittest file for ensuring numpy indicator implementations match the pandas calculations they
+replaced
+"""
+
+import ast
+import os
+import pickle
+import timeit
+import unittest
+import zlib
+import numpy
+import pandas
+import talib
+from greencandle.lib import config
+config.create_config()
+
+from greencandle.lib.indicator_state import IndicatorState, heikin_ashi, supertrend
+from greencandle.lib.engine import stoch_rsi
+from greencandle.lib import batch_indicators
+from greencandle.tests.test_indicator_state import get_dataframe, get_macd
+
+def get_pickled_close():
+    """
+    Close prices of the candles saved in buy.p, sell.p and random.p, ordered by open time
+    Each file holds redis data for several candles with ohlc as a zlib compressed pickled row
+    """
+    rows = []
+    for name in ('buy', 'sell', 'random'):
+        with open(os.path.join(os.path.dirname(__file__), f'{name}.p'), 'rb') as handle:
+            for item in pickle.load(handle).values():
+                ohlc = ast.literal_eval(item[b'ohlc'].decode())['result']
+                rows.append(pickle.loads(zlib.decompress(ohlc)))
+    rows.sort(key=lambda row: int(row.openTime))
+    return numpy.array([float(row.close) for row in rows])
+
+def pandas_heikin_ashi(dataframe):
+    """
+    Heikin-Ashi open, high, low and close series calculated with pandas and a python loop
+    """
+    series = pandas.DataFrame({'Open': dataframe.open, 'High': dataframe.high,
+                               'Low': dataframe.low, 'Close': dataframe.close})
+    series['HA_Close'] = (series.Open + series.High + series.Low + series.Close) / 4
+    ha_open = [(series.Open[0] + series.Close[0]) / 2]
+    for i in range(0, len(series) - 1):
+        ha_open.append((ha_open[i] + series.HA_Close.values[i]) / 2)
+    series['HA_Open'] = ha_open
+    series['HA_High'] = series[['HA_Open', 'HA_Close', 'High']].max(axis=1)
+    series['HA_Low'] = series[['HA_Open', 'HA_Close', 'Low']].min(axis=1)
+    return series.HA_Open, series.HA_High, series.HA_Low, series.HA_Close
+
+def pandas_stoch_rsi(close, rsi_period, stoch_period, smooth):
+    """
+    Stochastic RSI k and d series calculated with pandas
+    """
+    series = pandas.Series(close, dtype='float32')
+    delta = series.astype('float32').diff().dropna()
+    ups = delta * 0
+    downs = ups.copy()
+    ups[delta > 0] = delta[delta > 0]
+    downs[delta < 0] = -delta[delta < 0]
+    ups[ups.index[rsi_period-1]] = numpy.mean(ups[:rsi_period])
+    ups = ups.drop(ups.index[:(rsi_period-1)])
+    downs[downs.index[rsi_period-1]] = numpy.mean(downs[:rsi_period])
+    downs = downs.drop(downs.index[:(rsi_period-1)])
+    r_s = ups.ewm(com=rsi_period-1, min_periods=0, adjust=False, ignore_na=False).mean() / \
+         downs.ewm(com=rsi_period-1, min_periods=0, adjust=False, ignore_na=False).mean()
+    rsi = 100 - 100 / (1 + r_s)
+
+    rsi_min = rsi.rolling(stoch_period, min_periods=0).min()
+    stochrsi = (rsi - rsi_min) / (rsi.rolling(stoch_period, min_periods=0).max() - rsi_min)
+    stochrsik = stochrsi.rolling(smooth, min_periods=0).mean()
+    stochrsid = stochrsik.rolling(smooth, min_periods=0).mean()
+    return 100 * stochrsik, 100 * stochrsid
+
+def pandas_supertrend(high, low, close, length, multiplier):
+    """
+    Supertrend direction and value series calculated over pandas rows with talib ATR, as in
+    pandas_ta.supertrend
+    """
+    high, low, close = pandas.Series(high), pandas.Series(low), pandas.Series(close)
+    matr = multiplier * pandas.Series(talib.ATR(high.values, low.values, close.values,
+                                                timeperiod=length))
+    upperband = (high + low) / 2 + matr
+    lowerband = (high + low) / 2 - matr
+    direction, trend = [1] * len(close), [0.0] * len(close)
+    for i in range(1, len(close)):
+        if close.iloc[i] > upperband.iloc[i - 1]:
+            direction[i] = 1
+        elif close.iloc[i] < lowerband.iloc[i - 1]:
+            direction[i] = -1
+        else:
+            direction[i] = direction[i - 1]
+            if direction[i] > 0 and lowerband.iloc[i] < lowerband.iloc[i - 1]:
+                lowerband.iloc[i] = lowerband.iloc[i - 1]
+            if direction[i] < 0 and upperband.iloc[i] > upperband.iloc[i - 1]:
+                upperband.iloc[i] = upperband.iloc[i - 1]
+        trend[i] = lowerband.iloc[i] if direction[i] > 0 else upperband.iloc[i]
+    return pandas.Series(direction), pandas.Series(trend)
+
+class TestNumpyIndicators(unittest.TestCase):
+    """
+    Compare numpy indicators with previous pandas implementations
+    """
+
+    def test_heikin_ashi(self):
+        """
+        Test numpy Heikin-Ashi matches pandas loop
+        """
+        for start in (100.0, 0.00001234):
+            dataframe = get_dataframe(start=start)
+            expected = pandas_heikin_ashi(dataframe)
+            results = heikin_ashi(*(dataframe[column].values for column in
+                                    ('open', 'high', 'low', 'close')))
+            for result, series in zip(results, expected):
+                numpy.testing.assert_allclose(result, series.values, rtol=1e-12)
+
+    def test_stoch_rsi(self):
+        """
+        Test numpy Stochastic RSI matches pandas for saved candles, including flat and
+        steadily rising stretches which give NaN values
+        """
+        close = get_pickled_close()
+        flat = close.copy()
+        flat[3:9] = flat[3]
+        flat[11:16] = flat[11] + numpy.arange(5)
+        for prices in (close, flat):
+            for periods in ((14, 14, 3), (5, 5, 3), (3, 4, 2)):
+                expected = pandas_stoch_rsi(prices, *periods)
+                results = stoch_rsi(prices, *periods)
+                for result, series in zip(results, expected):
+                    self.assertEqual(len(result), len(series))
+                    self.assertFalse(numpy.isnan(series.values).all())
+                    numpy.testing.assert_allclose(result, series.values, rtol=1e-9, atol=1e-9,
+                                                  err_msg=f"periods {periods}")
+
+    def test_supertrend(self):
+        """
+        Test Supertrend direction and value match pandas rows
+        """
+        for start in (100.0, 0.00001234):
+            dataframe = get_dataframe(start=start)
+            args = (dataframe.high.values, dataframe.low.values, dataframe.close.values, 10, 3.0)
+            direction, value, _, _ = supertrend(*args)
+            expected_direction, expected_value = pandas_supertrend(*args)
+            numpy.testing.assert_array_equal(direction, expected_direction.values)
+            numpy.testing.assert_allclose(value, expected_value.values, rtol=1e-12)
+
+    def test_supertrend_timing(self):
+        """
+        Report time taken for Supertrend of a single pair with pandas rows, numpy arrays and
+        running state updated with the latest candle
+        """
+        dataframe = get_dataframe(candles=500)
+        args = (dataframe.high.values, dataframe.low.values, dataframe.close.values, 10, 3.0)
+        state = IndicatorState(['get_supertrend;STX;10,3'])
+        state.update('XXXUSDT', dataframe)
+
+        timings = {"pandas": timeit.timeit(lambda: pandas_supertrend(*args), number=3) / 3,
+                   "numpy": timeit.timeit(lambda: supertrend(*args), number=30) / 30,
+                   "running": timeit.timeit(lambda: state.get('XXXUSDT', 'get_supertrend',
+                                                              '10,3', dataframe),
+                                            number=300) / 300}
+        print("Supertrend for 500 candles: " +
+              ", ".join(f"{name} {value * 1000:.3f}ms" for name, value in timings.items()))
+        self.assertLess(timings["numpy"], timings["pandas"])
+        self.assertLess(timings["running"], timings["numpy"])
+
+    def test_batch_indicators(self):
+        """
+        Test indicators calculated for stacked pairs match talib/pandas for each pair
+        """
+        frames = [get_dataframe(start=start, seed=seed) for seed, start in
+                  enumerate((100.0, 2.5, 0.00001234, 0.000001))]
+        high, low, close = (numpy.vstack([frame[column].values for frame in frames])
+                            for column in ('high', 'low', 'close'))
+        results = {"ema": batch_indicators.ema(close, 20),
+                   "rsi": batch_indicators.rsi(close * 100000, 14),
+                   "atr": batch_indicators.atr(high, low, close, 14),
+                   "bbands": [band / 100000 for band in
+                              batch_indicators.bbands(close * 100000, 20, 2.0)],
+                   "macd": batch_indicators.macd(close, 12, 26, 9)}
+
+        for position, frame in enumerate(frames):
+            prices = frame.close.values
+            bands = talib.BBANDS(prices * 100000, timeperiod=20, nbdevup=2.0, nbdevdn=2.0,
+                                 matype=0)
+            expected = {"ema": talib.EMA(prices, timeperiod=20),
+                        "rsi": talib.RSI(prices * 100000, timeperiod=14),
+                        "atr": talib.ATR(frame.high.values, frame.low.values, prices,
+                                         timeperiod=14),
+                        "bbands": tuple(band / 100000 for band in bands)}
+            for name, value in expected.items():
+                numpy.testing.assert_allclose(numpy.array(results[name])[..., position, :],
+                                              numpy.array(value), rtol=1e-9,
+                                              err_msg=f"{name} differs for pair {position}")
+
+            # pandas MACD is compared at the last candle, as used by Engine.get_macd
+            numpy.testing.assert_allclose([line[position, -1] for line in results["macd"]],
+                                          get_macd(prices, "12,26,9"), rtol=1e-7,
+                                          err_msg=f"macd differs for pair {position}")
+
+    def test_batch_bbands_low_price(self):
+        """
+        Test batch bollinger bands match get_bb for a low-priced pair with small price changes,
+        where the deviation is tiny compared to the price
+        """
+        rng = numpy.random.default_rng(1)
+        close = 0.000001 * (1 + numpy.cumsum(rng.normal(0, 0.00001, 300)))
+        expected = talib.BBANDS(close * 100000, timeperiod=20, nbdevup=2.0, nbdevdn=2.0,
+                                matype=0)
+        results = batch_indicators.bbands(numpy.vstack([close, close]) * 100000, 20, 2.0)
+        for result, band in zip(results, expected):
+            numpy.testing.assert_allclose(result[1] / 100000, band / 100000, rtol=1e-12)
+        # deviation is accurate rather than just the bands, which are dominated by the price
+        numpy.testing.assert_allclose(results[0][0] - results[1][0], expected[0] - expected[1],
+                                      rtol=1e-9)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,404 @@
+#pylint: disable=wrong-import-position,no-member
+
+"""
+Unittest file for lua scripts run server side by Redis, the candle update stream and shared
+connection pools, using fakeredis with lua support
+"""
+
+import json
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+from unittest import mock
+import redis
+import fakeredis
+import numpy
+from greencandle.lib import config
+config.create_config()
+
+from greencandle.lib import redis_conn
+from greencandle.lib.indicator_plan import get_plan
+from greencandle.lib.redis_conn import Redis, decode_candle, encode_candle, check_retention, \
+        MSGPACK_VERSION
+
+def use_fake_redis(test):
+    """
+    Point all Redis instances created during given test at a new fake server, with scripts
+    registered against it.  Candles are written as JSON and not trimmed unless patched
+    Returns:
+        client for db 0 of the fake server
+    """
+    server = fakeredis.FakeServer()
+    pools = {}
+
+    def get_pool(*args):
+        """Get pool for db of host, port and db args"""
+        database = args[2]
+        if database not in pools:
+            pools[database] = redis.ConnectionPool(connection_class=fakeredis.FakeConnection,
+                                                   server=server, db=database)
+        return pools[database]
+
+    for patcher in (mock.patch.object(redis_conn, 'get_pool', side_effect=get_pool),
+                    mock.patch.dict(redis_conn.SCRIPTS, clear=True),
+                    mock.patch.dict(config.redis, {'redis_encoding': 'json',
+                                                   'redis_expire': 'False',
+                                                   'redis_retention': '0'})):
+        patcher.start()
+        test.addCleanup(patcher.stop)
+    return fakeredis.FakeStrictRedis(server=server)
+
+def delete_items(conn, pair, interval, items):
+    """
+    Remove given keys (mepochs) from pair/interval hash and timestamp index
+    """
+    key = f"{pair}:{interval}"
+    conn.hdel(key, *items)
+    conn.zrem(Redis.index_key(key), *items)
+
+class TestRedisScripts(unittest.TestCase):
+    """
+    Test redis scripts against an in-memory server
+    """
+
+    def setUp(self):
+        """
+        Point all Redis instances at a new fake server
+        """
+        self.conn = use_fake_redis(self)
+        self.redis = Redis(interval='1h')
+
+    def get_candle(self, item, pair='XXXUSDT'):
+        """
+        Get decoded candle from fake server
+        """
+        return self.redis.get_candle(pair, '1h', item)
+
+    def test_merge_json(self):
+        """
+        Test merging JSON candles keeps existing members and raw values
+        """
+        candle = {'ohlc': {'open': 1.0, 'close': 2.0}, 'EMA_20': 0.12345678901234568,
+                  'STX_10': [1, 0.5], 'name': 'a,"b"]}'}
+        self.redis.add_data('XXXUSDT', '1h', {'1000': dict(candle)})
+        self.redis.append_data('XXXUSDT', '1h', {'event': {'date': '1000', 'result': 'OPEN'},
+                                                  'EMA_20': 0.2, 'RSI_14': [1, {'x': '}'}]})
+
+        expected = dict(candle, event={'date': '1000', 'result': 'OPEN'}, EMA_20=0.2,
+                        RSI_14=[1, {'x': '}'}])
+        result = self.get_candle('1000')
+        for key in ('current_epoch', 'current_time'):
+            expected[key] = result[key]
+        self.assertEqual(result, expected)
+        # members not in the update are spliced without being re-encoded
+        raw = self.conn.hget('XXXUSDT:1h', '1000').decode()
+        self.assertIn(json.dumps(candle['ohlc']), raw)
+
+    def test_merge_keeps_event(self):
+        """
+        Test an event appended between two engine writes is kept
+        """
+        self.redis.add_data('XXXUSDT', '1h', {'1000': {'ohlc': {'close': 1.0}}})
+        self.redis.append_data('XXXUSDT', '1h', {'event': {'date': '1000'}})
+        self.redis.add_data('XXXUSDT', '1h', {'1000': {'ohlc': {'close': 2.0},
+                                                       'EMA_20': 1.5}})
+
+        result = self.get_candle('1000')
+        self.assertEqual(result['event'], {'date': '1000'})
+        self.assertEqual(result['ohlc'], {'close': 2.0})
+        self.assertEqual(result['EMA_20'], 1.5)
+
+    def test_decode_json(self):
+        """
+        Test candles stored as JSON are decoded
+        """
+        self.conn.hset('XXXUSDT:1h', '1000', json.dumps({'ohlc': {'close': 1.0}}))
+        self.assertEqual(decode_candle(self.conn.hget('XXXUSDT:1h', '1000')),
+                         {'ohlc': {'close': 1.0}})
+
+    def test_index(self):
+        """
+        Test timestamp index is used to list items, and items removed from it aren't listed
+        """
+        self.redis.add_data('XXXUSDT', '1h', {str(item): {'ohlc': {'close': 1.0}}
+                                              for item in range(1000, 1010)})
+        self.assertEqual(self.redis.get_items('XXXUSDT', '1h'),
+                         [str(item) for item in range(1000, 1010)])
+        self.assertEqual(self.redis.get_items('XXXUSDT', '1h', last_n=2), ['1008', '1009'])
+        self.assertEqual(self.redis.get_items('XXXUSDT', '1h', last_n=0), [])
+        self.assertEqual(self.redis.get_items('XXXUSDT', '1h', start=1002, end=1005, last_n=2),
+                         ['1004', '1005'])
+
+        delete_items(self.conn, 'XXXUSDT', '1h', ['1000', '1001'])
+        self.assertEqual(self.redis.get_items('XXXUSDT', '1h', last_n=9)[0], '1002')
+        self.assertEqual(self.conn.zcard('XXXUSDT:1h:index'), 8)
+
+    def test_legacy_index(self):
+        """
+        Test candles written before the index existed are indexed on read, and on first write
+        """
+        for item in range(1000, 1005):
+            self.conn.hset('AAAUSDT:1h', str(item), json.dumps({'ohlc': {'close': 1.0}}))
+            self.conn.hset('BBBUSDT:1h', str(item), json.dumps({'ohlc': {'close': 1.0}}))
+
+        self.assertEqual(len(self.redis.get_items('AAAUSDT', '1h')), 5)
+
+        self.redis.append_data('BBBUSDT', '1h', {'event': {'date': '1005'}})
+        self.assertEqual(self.redis.get_items('BBBUSDT', '1h'),
+                         [str(item) for item in range(1000, 1006)])
+
+    def test_merge_msgpack(self):
+        """
+        Test merging msgpack candles keeps existing members
+        """
+        candle = {'ohlc': {'open': 1.0, 'close': 2.0}, 'EMA_20': 0.12345678901234568,
+                  'STX_10': [1, 0.5], 'name': 'a' * 40}
+        # over 15 members so the stored map header is no longer a fixmap
+        candle.update({f'IND_{item}': item for item in range(20)})
+        with mock.patch.dict(config.redis, {'redis_encoding': 'msgpack'}):
+            self.redis.add_data('XXXUSDT', '1h', {'1000': dict(candle)})
+            self.assertEqual(self.conn.hget('XXXUSDT:1h', '1000')[:1], MSGPACK_VERSION)
+            self.redis.append_data('XXXUSDT', '1h', {'event': {'date': '1000'}, 'EMA_20': 0.2,
+                                                      'big': 2 ** 40, 'neg': -1.5,
+                                                      'bytes': 'b' * 300})
+
+        expected = dict(candle, event={'date': '1000'}, EMA_20=0.2, big=2 ** 40, neg=-1.5,
+                        bytes='b' * 300)
+        result = self.get_candle('1000')
+        for key in ('current_epoch', 'current_time'):
+            expected[key] = result[key]
+        self.assertEqual(result, expected)
+
+    def test_merge_mixed_encoding(self):
+        """
+        Test data is merged into stored candles with a different encoding, keeping members such
+        as trade events written before the encoding was changed
+        """
+        self.redis.add_data('XXXUSDT', '1h', {'1000': {'ohlc': {'close': 1.0}},
+                                              '1001': {'ohlc': {'close': 1.5}}})
+        self.redis.append_data('XXXUSDT', '1h', {'event': {'date': '1000', 'result': 'OPEN'}})
+        with mock.patch.dict(config.redis, {'redis_encoding': 'msgpack'}):
+            self.redis.add_data('XXXUSDT', '1h', {'1000': {'ohlc': {'close': 2.0},
+                                                           'EMA_20': 0.12345678901234568},
+                                                  '1002': {'ohlc': {'close': 3.0}}})
+            self.redis.append_data('XXXUSDT', '1h', {'event': {'date': '1001'}})
+
+        result = self.get_candle('1000')
+        self.assertEqual(result['event'], {'date': '1000', 'result': 'OPEN'})
+        self.assertEqual(result['ohlc'], {'close': 2.0})
+        self.assertEqual(result['EMA_20'], 0.12345678901234568)
+        self.assertEqual(self.get_candle('1001')['ohlc'], {'close': 1.5})
+        self.assertEqual(self.get_candle('1001')['event'], {'date': '1001'})
+        for item in ('1000', '1001', '1002'):
+            self.assertEqual(self.conn.hget('XXXUSDT:1h', item)[:1], MSGPACK_VERSION)
+
+        # and back again
+        self.redis.add_data('XXXUSDT', '1h', {'1000': {'RSI_14': 50.0}})
+        self.assertEqual(self.get_candle('1000')['event'], {'date': '1000', 'result': 'OPEN'})
+        self.assertEqual(self.get_candle('1000')['RSI_14'], 50.0)
+        self.assertEqual(self.redis.get_items('XXXUSDT', '1h'), ['1000', '1001', '1002'])
+
+    def test_encode_candle(self):
+        """
+        Test candles round trip through both encodings, including numpy values
+        """
+        candle = {'ohlc': {'close': numpy.float64(1.5), 'numTrades': numpy.int64(3)},
+                  'STX_10': (1, 0.5)}
+        expected = {'ohlc': {'close': 1.5, 'numTrades': 3}, 'STX_10': [1, 0.5]}
+        self.assertEqual(decode_candle(encode_candle(candle, 'msgpack')), expected)
+        self.assertEqual(decode_candle(encode_candle(expected, 'json').encode()), expected)
+
+    def test_trim(self):
+        """
+        Test only the latest retention candles are kept, including legacy candles missing from
+        the index
+        """
+        for item in range(900, 1000):
+            self.conn.hset('XXXUSDT:1h', str(item), json.dumps({'ohlc': {'close': 1.0}}))
+        with mock.patch.dict(config.redis, {'redis_retention': '10'}):
+            self.redis.add_data('XXXUSDT', '1h', {str(item): {'ohlc': {'close': 1.0}}
+                                                  for item in range(1000, 1005)})
+        self.assertEqual(self.conn.hlen('XXXUSDT:1h'), 10)
+        self.assertEqual(self.redis.get_items('XXXUSDT', '1h'),
+                         [str(item) for item in range(995, 1005)])
+
+        # candles beyond retention are not written
+        with mock.patch.dict(config.redis, {'redis_retention': '10'}):
+            self.redis.add_data('XXXUSDT', '1h', {str(item): {'ohlc': {'close': 1.0}}
+                                                  for item in range(1005, 1100)})
+        self.assertEqual(self.redis.get_items('XXXUSDT', '1h'),
+                         [str(item) for item in range(1090, 1100)])
+
+    def test_bulk_batches(self):
+        """
+        Test candles for several pairs are written in batches of batch_size timestamps, and
+        add_data merges into existing candles rather than replacing them
+        """
+        data = {pair: {str(item): {'ohlc': {'close': float(item)}, 'EMA_20': 1.0}
+                       for item in range(1000, 1010)} for pair in ('XXXUSDT', 'YYYUSDT')}
+        with mock.patch.object(redis.client.Pipeline, 'execute', autospec=True,
+                               side_effect=redis.client.Pipeline.execute) as execute:
+            self.assertTrue(self.redis.add_bulk_data('1h', data, batch_size=4))
+        # 20 candles in batches of 4, with the remaining 2 candles sent with the final flush
+        self.assertEqual(execute.call_count, 5)
+        for pair in data:
+            self.assertEqual(self.redis.get_items(pair, '1h'),
+                             [str(item) for item in range(1000, 1010)])
+            self.assertEqual(self.get_candle('1009', pair)['ohlc'], {'close': 1009.0})
+
+        self.redis.add_data('XXXUSDT', '1h', {'1009': {'RSI_14': 50.0}})
+        result = self.get_candle('1009')
+        self.assertEqual((result['ohlc'], result['EMA_20'], result['RSI_14']),
+                         ({'close': 1009.0}, 1.0, 50.0))
+
+    def test_no_trim(self):
+        """
+        Test all candles are kept when retention is 0
+        """
+        with mock.patch.dict(config.redis, {'redis_retention': '10'}):
+            self.redis.add_bulk_data('1h', {'XXXUSDT': {str(item): {'ohlc': {'close': 1.0}}
+                                                        for item in range(1000, 1100)}},
+                                     retention=0)
+        self.assertEqual(self.conn.hlen('XXXUSDT:1h'), 100)
+        self.assertEqual(self.conn.zcard('XXXUSDT:1h:index'), 100)
+
+    def test_retention_check(self):
+        """
+        Test retention below the largest indicator period is rejected
+        """
+        plan = get_plan("get_moving_averages;EMA;200 get_bb;bb;20,2 get_ha;HA;0")
+        self.assertEqual(plan.history, 200)
+        for retention in ('0', '200', '500'):
+            with mock.patch.dict(config.redis, {'redis_retention': retention}):
+                check_retention(plan)
+        with mock.patch.dict(config.redis, {'redis_retention': '60'}):
+            with self.assertRaises(ValueError):
+                check_retention(plan)
+        self.assertEqual(get_plan("get_ha;HA;0").history, 0)
+
+        # a backfill with enough retention keeps the history needed by indicators
+        with mock.patch.dict(config.redis, {'redis_retention': '200'}):
+            check_retention(plan)
+            self.redis.add_bulk_data('1h', {'XXXUSDT': {str(item): {'ohlc': {'close': 1.0}}
+                                                        for item in range(1000, 1500)}})
+        self.assertEqual(len(self.redis.get_items('XXXUSDT', '1h')), plan.history)
+
+    def test_updates(self):
+        """
+        Test update events are read per consumer group and redelivered until acknowledged
+        """
+        # groups are created at the end of the stream
+        self.assertEqual(self.redis.get_updates('1h', 'analyse', block=0), ([], {}))
+        self.assertEqual(self.redis.get_updates('1h', 'api', block=0), ([], {}))
+        with mock.patch.dict(config.redis, {'redis_stream_length': '1000'}):
+            self.assertIsNone(self.redis.publish_updates('1h', {}))
+            self.redis.publish_updates('1h', {'AAAUSDT': 1000, 'BBBUSDT': 1000})
+            self.redis.publish_updates('1h', {'AAAUSDT': 2000})
+
+        ids, pairs = self.redis.get_updates('1h', 'analyse', block=0)
+        self.assertEqual(len(ids), 2)
+        self.assertEqual(pairs, {'AAAUSDT': '2000', 'BBBUSDT': '1000'})
+
+        # each group receives every event
+        self.assertEqual(self.redis.get_updates('1h', 'api', block=0)[1], pairs)
+
+        # unacknowledged events are returned again, eg. after a restart
+        self.assertEqual(self.redis.get_updates('1h', 'analyse', block=0), (ids, pairs))
+        self.redis.ack_updates('1h', 'analyse', ids)
+        self.assertEqual(self.redis.get_updates('1h', 'analyse', block=0), ([], {}))
+
+    def test_updates_backlog(self):
+        """
+        Test a new group doesn't replay events added before it was created
+        """
+        with mock.patch.dict(config.redis, {'redis_stream_length': '1000'}):
+            for open_time in range(100):
+                self.redis.publish_updates('1h', {'AAAUSDT': open_time})
+            self.assertEqual(self.redis.get_updates('1h', 'analyse', block=0), ([], {}))
+            self.redis.publish_updates('1h', {'BBBUSDT': 1000})
+        self.assertEqual(self.redis.get_updates('1h', 'analyse', block=0)[1],
+                         {'BBBUSDT': '1000'})
+
+    def test_updates_empty(self):
+        """
+        Test reading an empty stream returns no events, waiting up to block seconds
+        """
+        for block in (0, 1, None):
+            with mock.patch.dict(config.redis, {'redis_stream_block': '1'}):
+                self.assertEqual(self.redis.get_updates('1h', 'analyse', block=block), ([], {}))
+
+    def test_draw(self):
+        """
+        Test drawdown and drawup keep the lowest and highest price of long and short trades
+        """
+        def candle(low, high, close):
+            return {'low': low, 'high': high, 'close': close}
+
+        for direction, results in (('long', [(0, 0), (50, 100), (50, 100), (75, 100)]),
+                                   ('short', [(0, 0), (100, 50), (100, 50), (100, 75)])):
+            with mock.patch.dict(config.main, {'trade_direction': direction}), \
+                    mock.patch.object(redis_conn, 'get_short_name', return_value='unit'):
+                self.redis.rm_drawdown('XXXUSDT')
+                self.redis.rm_drawup('XXXUSDT')
+                # no record until trade is opened
+                self.assertEqual(self.redis.update_draw('XXXUSDT', candle(1, 1000, 100)),
+                                 {'drawdown': 0, 'drawup': 0})
+
+                candles = [('open', candle(10, 1000, 100)), (None, candle(50, 200, 100)),
+                           (None, candle(90, 110, 100)), (None, candle(25, 150, 100))]
+                for (event, current), (drawdown, drawup) in zip(candles, results):
+                    self.assertEqual(self.redis.update_draw('XXXUSDT', current, event=event),
+                                     {'drawdown': drawdown, 'drawup': drawup})
+                self.assertEqual(self.redis.get_drawdown('XXXUSDT')['perc'], results[-1][0])
+                self.assertEqual(self.redis.get_drawup('XXXUSDT')['perc'], results[-1][1])
+
+    def test_draws(self):
+        """
+        Test several trades are updated with a single call
+        """
+        with mock.patch.dict(config.main, {'trade_direction': 'long'}), \
+                mock.patch.object(redis_conn, 'get_short_name', return_value='unit'):
+            for pair in ('AAAUSDT', 'BBBUSDT'):
+                self.redis.update_draw(pair, {'low': 100, 'high': 100, 'close': 100},
+                                       event='open')
+            results = self.redis.update_draws(
+                [('AAAUSDT', {'low': 80, 'high': 110, 'close': 100}, None, None),
+                 ('BBBUSDT', {'low': 90, 'high': 150, 'close': 100}, None, None)])
+        self.assertEqual(results, {'AAAUSDT': {'drawdown': 20, 'drawup': 10},
+                                   'BBBUSDT': {'drawdown': 10, 'drawup': 50}})
+
+class TestPools(unittest.TestCase):
+    """
+    Test connection pools and scripts are shared within a process
+    """
+
+    def setUp(self):
+        for patcher in (mock.patch.dict(redis_conn.POOLS, clear=True),
+                        mock.patch.dict(redis_conn.SCRIPTS, clear=True),
+                        mock.patch.dict(config.redis, {'redis_max_connections': '7',
+                                                       'redis_health_check_interval': '15'})):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def test_shared(self):
+        """
+        Test Redis instances for the same db share a configured pool and scripts
+        """
+        with ThreadPoolExecutor(max_workers=8) as pool:
+            instances = list(pool.map(lambda _: Redis(interval='1h'), range(16)))
+        other = Redis(interval='1h', db=2)
+        pools = {id(instance.conn.connection_pool) for instance in instances}
+        self.assertEqual(len(pools), 1)
+        self.assertEqual(len(redis_conn.POOLS), 2)
+        self.assertIsNot(other.conn.connection_pool, instances[0].conn.connection_pool)
+        self.assertEqual({instance.merge_data for instance in instances},
+                         {instances[0].merge_data})
+        self.assertIsNot(other.merge_data, instances[0].merge_data)
+
+        connection_pool = instances[0].conn.connection_pool
+        self.assertEqual(connection_pool.max_connections, 7)
+        self.assertEqual(connection_pool.connection_kwargs['health_check_interval'], 15)
+        self.assertEqual(connection_pool.connection_kwargs['db'], 0)
+        self.assertEqual(other.conn.connection_pool.connection_kwargs['db'], 2)
+
+if __name__ == '__main__':
+    unittest.main()
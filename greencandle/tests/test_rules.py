@@ -0,0 +1,299 @@
+#pylint: disable=wrong-import-position,no-member
+
+"""
+Unittest file for compiling and evaluating open/close rules
+"""
+
+import unittest
+from unittest import mock
+import numpy
+from greencandle.lib import config
+config.create_config()
+
+from greencandle.lib.common import AttributeDict, perc_diff
+from greencandle.lib.indicator_plan import get_plan
+from greencandle.lib.redis_conn import Redis
+from greencandle.lib.rules import Rule, RuleSet, get_value, get_config_rules
+from greencandle.tests.test_redis_scripts import use_fake_redis
+
+# rules which must fail when compiled
+INVALID = [
+    "__import__('os').system('ls')",
+    "open('/etc/passwd')",
+    "res[0].close.__class__",
+    "res[0].__dict__",
+    "agg.__class__.__bases__",
+    "[x for x in res]",
+    "{'a': 1}",
+    "lambda: 1",
+    "res[0].close if res[0].close else 1",
+    "res[0].close > (x := 1)",
+    "f'{res[0].close}'",
+    "res[0].close > b'1'",
+    "abs(x=1)",
+    "res[0].close.real > 1",
+    "res[5].close > 1",
+    "res[-1].close > 1",
+    "res[0] > 1",
+    "res.close > 1",
+    "agg > 1",
+    "foo > 1",
+    "res[0].close >",
+    "res[0].close ** 2 > 1",
+    "(1).__class__",
+    ]
+
+INDICATORS = "get_moving_averages;EMA;2 get_moving_averages;EMA;69 get_rsi;RSI;14 " \
+             "get_supertrend;STX;22,3"
+# open_rule1-4 and close_rule1-4 used for both vector and scalar evaluation
+RULES = {"open_rule1": "res[0].EMA_2 > res[0].EMA_69 and res[1].EMA_2 < res[1].EMA_69",
+         "open_rule2": "res[0].RSI_14 < 40 and res[0].STX_22[0] == 1",
+         "open_rule3": "perc_diff(res[1].close, res[0].close) > 1 or agg.res_1h > 0.5",
+         "open_rule4": "30 < res[0]['RSI_14'] <= 60 and not res[0].close > res[3].close",
+         "close_rule1": "res[0].EMA_2 < res[0].EMA_69 and res[0].HA_close < res[0].HA_open",
+         "close_rule2": "max(res[1].close, res[2].close) < res[0].close - 1",
+         "close_rule3": "abs(res[0].perc_rate) > 0.5 and res[0].rate > 0",
+         "close_rule4": "res[0].STX_22[1] is not None and res[0].STX_22[1] > res[0].close"}
+
+def get_res(*closes, **fields):
+    """
+    Create list of candle rows with given close prices, newest first, and extra fields
+    """
+    return [AttributeDict({'close': close, **{key: value[pos] for key, value in fields.items()}})
+            for pos, close in enumerate(closes)]
+
+class TestRules(unittest.TestCase):
+    """
+    Test compiled rules
+    """
+
+    def test_invalid(self):
+        """
+        Test unsupported syntax, names and attributes are rejected
+        """
+        for expression in INVALID:
+            with self.assertRaises(ValueError, msg=expression):
+                Rule("open_rule1", expression)
+
+    def test_fields(self):
+        """
+        Test referenced candle and agg fields are collected
+        """
+        rule = Rule("open_rule1", "res[0].EMA_2 > res[1]['EMA_69'] and agg.res_1h > "
+                                  "res[0].STX_22[0]")
+        self.assertEqual(rule.fields, {'EMA_2', 'EMA_69', 'STX_22'})
+        self.assertEqual(rule.agg, {'res_1h'})
+
+    def test_evaluate(self):
+        """
+        Test rules are evaluated against candle rows and aggregate data
+        """
+        res = get_res(10.0, 8.0, 9.0, EMA_2=[2.0, 1.0, 1.0], STX_22=[[1, 5.0], [-1, 6.0],
+                                                                    [-1, 6.0]])
+        ruleset = RuleSet(["res[0].close > res[1].close and res[0].STX_22[0] == 1",
+                           "",
+                           "perc_diff(res[1].close, res[0].close) > 20",
+                           "agg.res_1h > 1"],
+                          ["max(res[1].close, res[2].close) > res[0].close",
+                           "res[0].missing > 1"])
+        errors = []
+        results = ruleset.evaluate(res, AttributeDict({'res_1h': 2}),
+                                   on_error=lambda rule, error: errors.append(rule.name))
+        self.assertEqual(results, {'open': [True, True, True], 'close': [False, False]})
+        self.assertEqual(errors, ['close_rule2'])
+        self.assertEqual([rule.name for rule in ruleset.rules['open']],
+                         ['open_rule1', 'open_rule3', 'open_rule4'])
+
+    def test_alias(self):
+        """
+        Test close is shorthand for the current candle's close
+        """
+        rule = Rule("open_rule1", "close > res[1].close")
+        self.assertEqual(rule.fields, {'close'})
+        self.assertTrue(rule(get_res(2.0, 1.0)))
+        self.assertFalse(rule(get_res(1.0, 2.0)))
+        with self.assertRaises(ValueError):
+            get_value("close")
+
+    def test_errors(self):
+        """
+        Test rules which raise don't match and keep their position in the results
+        """
+        ruleset = RuleSet(["perc_diff(res[1].close, res[0].close) > 1", "res[0].close > 1"],
+                          ["res[0].close > 'a'", "res[0].close > 1"])
+        errors = []
+        results = ruleset.evaluate(get_res(2.0, 0.0), AttributeDict(),
+                                   on_error=lambda rule, error: errors.append(rule.name))
+        self.assertEqual(results, {'open': [False, True], 'close': [False, True]})
+        self.assertEqual(errors, ['open_rule1', 'close_rule1'])
+
+    def test_missing(self):
+        """
+        Test rules using missing values don't match
+        """
+        ruleset = RuleSet(["res[0].EMA_2 > 1"], ["agg.res_1h > 1"])
+        results = ruleset.evaluate(get_res(1.0, EMA_2=[None]), AttributeDict())
+        self.assertEqual(results, {'open': [False], 'close': [False]})
+
+    def test_get_value(self):
+        """
+        Test constant numeric expressions from config
+        """
+        self.assertEqual(get_value("1"), 1)
+        self.assertEqual(get_value("0.5 * 3 + abs(-1)"), 2.5)
+        for expression in ("res[0].close", "foo", "__import__('os')", "[1]"):
+            with self.assertRaises(ValueError, msg=expression):
+                get_value(expression)
+
+    def test_vectorize(self):
+        """
+        Test rules comparing with strings are only evaluated for each pair
+        """
+        self.assertIsNotNone(Rule("open_rule1", "res[0].STX_22[1] is not None").vector)
+        self.assertIsNone(Rule("open_rule1", "agg.res_1h == 'n/a'").vector)
+        self.assertFalse(RuleSet(["agg.res_1h == 'n/a'"], []).vectorized)
+
+class TestVectorRules(unittest.TestCase):
+    """
+    Test rules evaluated for all pairs at once match evaluating each pair separately
+    """
+
+    def setUp(self):
+        """
+        Write random candles for several pairs to a fake redis server
+        """
+        self.conn = use_fake_redis(self)
+        for patcher in (mock.patch.dict(config.main, {'indicators': INDICATORS,
+                                                      'rate_indicator': 'EMA_69',
+                                                      **RULES}),
+                        mock.patch.dict(config.main, {f"{direction}_rule{seq}": ""
+                                                      for direction in ("open", "close")
+                                                      for seq in range(5, 10)})):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+        rng = numpy.random.default_rng(3)
+        self.redis = Redis(interval='1h')
+        self.pairs = [f"PAIR{pos}USDT" for pos in range(40)]
+        data = {}
+        for pair in self.pairs:
+            closes = 100 + numpy.cumsum(rng.normal(0, 2, 6))
+            data[pair] = {str(1000 + pos): {'ohlc': {'open': close - 1, 'high': close + 1,
+                                                     'low': close - 2, 'close': close},
+                                            'EMA_2': close + rng.normal(0, 1),
+                                            'EMA_69': 100 + rng.normal(0, 1),
+                                            'RSI_14': rng.uniform(20, 70),
+                                            'STX_22': [int(rng.choice([-1, 1])),
+                                                       close + rng.normal(0, 2)],
+                                            'HA_0': {'open': close + rng.normal(0, 1),
+                                                     'high': close + 2, 'low': close - 2,
+                                                     'close': close + rng.normal(0, 1)}}
+                          for pos, close in enumerate(closes)}
+        # pair with missing indicators in the latest candle
+        for key in ('RSI_14', 'STX_22', 'EMA_2'):
+            del data['PAIR0USDT']['1005'][key]
+        self.redis.add_bulk_data('1h', data)
+        redis3 = Redis(interval='1h', db=3)
+        for pair in self.pairs[::2]:
+            redis3.conn.hset(f'{pair}:1h', 'res_1h', str(rng.uniform(0, 1)))
+
+    def get_scalar(self, pair, action):
+        """
+        Evaluate rules for a single pair as get_action and get_rule_action do
+        """
+        ruleset = get_config_rules(config.main, count=9 if action else 4)
+        events = [event for event in get_plan(INDICATORS).events if event in ruleset.fields]
+        items = self.redis.get_items(pair, '1h', last_n=5)
+        if action:
+            res = self.redis.get_rows(pair, '1h', items[-1:-6:-1], events + ['EMA_69'])
+            for i in range(0, 4):
+                valid = res[i].EMA_69 and res[i+1].EMA_69
+                res[i]['perc_rate'] = float(perc_diff(res[i+1].EMA_69, res[i].EMA_69)) \
+                        if valid else 0
+                res[i]['rate'] = res[i].EMA_69 - res[i+1].EMA_69 if valid else 0
+        else:
+            res = self.redis.get_rows(pair, '1h', items[-1:-5:-1], events, heikin_ashi=True)
+        return ruleset.evaluate(res, self.redis.get_agg(pair, '1h', ruleset.agg))
+
+    def test_vector(self):
+        """
+        Test get_rule_results matches scalar evaluation for each pair
+        """
+        # odd pairs have no agg data used by open_rule3, and PAIR0USDT no latest indicators
+        complete = self.pairs[2::2]
+        for action in (True, False):
+            results = self.redis.get_rule_results(self.pairs, '1h', action=action)
+            self.assertEqual(sorted(results), sorted(complete))
+            matches = 0
+            for pair, (item, price, rules) in results.items():
+                self.assertEqual(item, '1005')
+                self.assertEqual(price, self.redis.get_rows(pair, '1h', [item], [])[0].close)
+                self.assertEqual(rules, self.get_scalar(pair, action), f"{pair} {action}")
+                matches += sum(rules['open']) + sum(rules['close'])
+            self.assertGreater(matches, 0)
+
+    def test_get_action(self):
+        """
+        Test get_action only fetches indicators used by rules and rate_indicator, and sets
+        perc_rate and rate for the first 4 candles
+        """
+        patchers = (mock.patch.dict(config.main, {'indicators': INDICATORS +
+                                                                " get_atr;ATR;14",
+                                                  'open_rule5': "res[3].perc_rate < 100",
+                                                  'close_rule5': "res[4].perc_rate < 100",
+                                                  'wait_between_trades': 'false'}),
+                    mock.patch('greencandle.lib.redis_conn.Mysql'),
+                    mock.patch.object(Redis, 'get_rows', autospec=True,
+                                      side_effect=Redis.get_rows),
+                    mock.patch.object(Redis, 'get_on_entry', return_value=0),
+                    mock.patch.object(Redis, 'update_on_entry'),
+                    mock.patch.object(Redis, 'get_drawup', return_value={'price': None}),
+                    mock.patch.object(Redis, 'get_drawdown', return_value={'price': None}))
+        for patcher in patchers:
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        mysql, get_rows = patchers[1].target.Mysql, Redis.get_rows
+        mysql.return_value.get_trade_value.return_value = []
+        mysql.return_value.get_recent_high.return_value = False
+
+        for pair in self.pairs[2::2]:
+            _, _, _, _, winning = self.redis.get_action(pair, '1h')
+            *_, indicators = get_rows.call_args.args
+            self.assertEqual(sorted(indicators), ['EMA_2', 'EMA_69', 'RSI_14', 'STX_22'])
+            self.assertIn(5, winning['open'])
+            self.assertNotIn(5, winning['close'])
+            scalar = self.get_scalar(pair, True)
+            self.assertEqual(winning, {direction: self.redis.get_rules(scalar, direction)
+                                       for direction in ('close', 'open')}, pair)
+
+    def test_irregular(self):
+        """
+        Test pairs with non-numeric values are left to scalar evaluation
+        """
+        self.redis.add_bulk_data('1h', {'PAIR4USDT': {'1005': {'RSI_14': 'n/a'}}})
+        Redis(interval='1h', db=3).conn.hset('PAIR6USDT:1h', 'res_1h', 'n/a')
+        self.assertEqual(self.redis.get_agg('PAIR6USDT', '1h', ['res_1h']).res_1h, 'n/a')
+        # rules without or/not, which would otherwise be evaluated with missing values
+        patcher = mock.patch.dict(config.main, {'open_rule3': "agg.res_1h > 0.5"})
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        for action in (True, False):
+            results = self.redis.get_rule_results(self.pairs, '1h', action=action)
+            self.assertEqual(sorted(results), sorted(set(self.pairs[1:]) -
+                                                     {'PAIR4USDT', 'PAIR6USDT'}))
+            for pair, (_, _, rules) in results.items():
+                self.assertEqual(rules, self.get_scalar(pair, action), f"{pair} {action}")
+
+    def test_list_rate(self):
+        """
+        Test pairs are left to scalar evaluation when rate_indicator holds lists
+        """
+        self.redis.add_bulk_data('1h', {'PAIR2USDT': {'1005': {'EMA_69': [1.0, 2.0]}}})
+        for action in (True, False):
+            self.assertEqual(self.redis.get_rule_results(self.pairs, '1h', action=action), {})
+
+        with mock.patch.dict(config.main, {'rate_indicator': 'STX_22'}):
+            self.assertEqual(self.redis.get_rule_results(self.pairs, '1h', action=True), {})
+
+if __name__ == '__main__':
+    unittest.main()